@@ -1,18 +1,23 @@
 
 import os
 import time
-import re
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
 from ui import ui_EVFileMaker
-import sys, traceback, glob
-import win32com.client
+import sys, traceback, tempfile
+from datetime import timedelta
 import SelectSurveyDlg
-from MaceFunctions import connectdlg,  dbConnection
+from MaceFunctions import connectdlg
+from EVFunctions import transectSegments, evrFile, evlFile, lineRegionIndex, rawIndex, preflight
+from EVFunctions import evBackend, dbSession, metadataCache, calibrationStore, runLedger, exportMetrics
+from EVFunctions import traceSpans, echoviewWatchdog, transectScheduler
 
 class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
 
+    #  emitted by the metadata cache refresh thread with the list of changed snapshots
+    metadataUpdated = pyqtSignal(list)
+
     #  set the maximum time in seconds that we will wait for EV to index the raw files
     #  we add to our EV file.
     EV_INDEXING_TIMEOUT = 60
@@ -45,6 +50,35 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
         self.templateEvFileEdit.setText(templ_file)
         temp2_file= self.appSettings.value('temp2_file', QDir.home().path())
         self.ECSFileEdit.setText(temp2_file)
+        self.evBackendName = self.appSettings.value('ev_backend', '')
+        #  the calibration store directory, by default a directory in the destination directory
+        self.calibrationStoreDir = self.appSettings.value('calibration_store', '')
+        self.calStore = None
+        #  every build is recorded in the run ledger, by default in ~/.EVFunctions
+        try:
+            self.ledger = runLedger.RunLedger(self.appSettings.value('run_ledger', '') or None)
+        except Exception:
+            self.ledger = None
+        #  the stages of each build run are traced to a Chrome trace file in this directory
+        self.traceDir = self.appSettings.value('trace_dir', traceSpans.DEFAULT_TRACE_DIR)
+        #  Echoview is quit after every file unless a memory or handle limit is set,
+        #  then it is kept running until the watchdog sees it reach one
+        self.watchdog = echoviewWatchdog.EchoviewWatchdog(self.appSettings.value('ev_max_memory_mb', ''),
+                self.appSettings.value('ev_max_handles', ''),
+                float(self.appSettings.value('ev_watchdog_interval', 2)))
+        self.runningEv = None
+        #  metrics are exposed in a textfile collector file and/or on a local HTTP port if set
+        self.metrics = None
+        metricsFile = self.appSettings.value('metrics_file', '')
+        metricsPort = self.appSettings.value('metrics_port', '')
+        if metricsFile or metricsPort:
+            try:
+                self.metrics = exportMetrics.enable(textfile=metricsFile or None,
+                        port=int(metricsPort) if metricsPort else None)
+            except (ValueError, OSError):
+                self.metrics = None
+        #  set by the preflight check if the user chose to replace the existing EV files
+        self.replaceExisting = False
         lineregion_dir = self.appSettings.value('lineregion_dir', QDir.home().path())
         self.lineregionPath.setText(lineregion_dir)
 
@@ -65,7 +99,13 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
         self.pbPickECS.clicked.connect(self.pickFile)
         self.lineregionCheck.clicked.connect(self.enableLineRegion)
         self.lineregionButton.clicked.connect(self.pickFile)
-        self.reloadBtn.clicked.connect(self.getTransects)
+        self.reloadBtn.clicked.connect(self.reloadTransects)
+        self.metadataUpdated.connect(self.metadataChanged)
+
+        #  the metadata cache is created when we connect
+        self.baseTitle = self.windowTitle()
+        self.metadata = None
+        self.db = None
 
 
         #  create a label on the status bar for feedback
@@ -112,34 +152,46 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
             self.dbPassword = connectDlg.getPassword()
 
         #  create the database connection
-        self.db = dbConnection.dbConnection(self.odbc, self.dbUser,
+        self.db = dbSession.getSession(self.odbc, self.dbUser,
                 self.dbPassword, 'EVFileMaker')
 
+        #  the startup metadata is loaded from the local snapshot when there is one
+        self.metadata = metadataCache.MetadataCache('EVFileMaker', on_update=self.metadataUpdated.emit)
+
         try:
             #  attempt to connect to the database
             self.db.dbOpen()
-        except dbConnection.DBError as e:
+        except dbSession.DBError as e:
             #  ooops, there was a problem
             errorMsg = ('Unable to connect to ' + self.dbUser+ '@' +
                     self.odbc + '\n' + e.error)
-            QMessageBox.critical(self, "Databse Login Error", errorMsg)
-            self.close()
-            return
+            if not self.metadata.hasSnapshots():
+                QMessageBox.critical(self, "Databse Login Error", errorMsg)
+                self.close()
+                return
+            #  carry on with the cached metadata
+            self.metadata.offline = True
+            QMessageBox.warning(self, "Database Login Error", errorMsg + '\n\nUsing cached metadata. ' +
+                    "EV files can't be built until the connection is restored.")
 
         #  query CLAMS to determine the current active ship and survey
         sql = ("SELECT parameter_value FROM " + self.bioSchema + ".application_configuration " +
                 "WHERE parameter='ActiveShip'")
-        query = self.db.dbQuery(sql)
-        self.ship, = query.first()
+        shipQuery = self.metadata.query(self.db, sql)
         sql = ("SELECT parameter_value FROM " + self.bioSchema + ".application_configuration " +
                 "WHERE parameter='ActiveSurvey'")
-        query = self.db.dbQuery(sql)
-        self.survey, = query.first()
+        surveyQuery = self.metadata.query(self.db, sql)
+        if len(shipQuery) == 0 or len(surveyQuery) == 0:
+            QMessageBox.critical(self, "Error", "Unable to determine the active ship and survey.")
+            self.close()
+            return
+        self.ship, = shipQuery.first()
+        self.survey, = surveyQuery.first()
 
         #  set the dataset
-        sql = ("SELECT data_set_id FROM macebase2.data_sets WHERE ship=" + self.ship +
-                " AND survey=" + self.survey + " ORDER BY data_set_id ASC")
-        query = self.db.dbQuery(sql)
+        sql = ("SELECT data_set_id FROM macebase2.data_sets WHERE ship=? AND survey=? " +
+                "ORDER BY data_set_id ASC")
+        query = self.metadata.query(self.db, sql, (self.ship, self.survey))
         self.dataset, = query.first()
 
         #  and update the labels
@@ -150,6 +202,42 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
         #  update the transects combobox
         self.getTransects()
 
+        #  start refreshing the snapshots in the background
+        self.metadata.start(self.db)
+        self.showMetadataStatus()
+
+
+    def metadataChanged(self, changed):
+        '''
+        metadataChanged is called when the metadata cache has been refreshed. If
+        any snapshots changed the transect list is reloaded.
+        '''
+        if changed:
+            current = self.cbTransects.currentText()
+            self.getTransects()
+            index = self.cbTransects.findText(current)
+            if index >= 0:
+                self.cbTransects.setCurrentIndex(index)
+        self.showMetadataStatus()
+
+
+    def showMetadataStatus(self):
+        status = self.metadata.statusText()
+        if status:
+            self.setWindowTitle(self.baseTitle + ' - ' + status)
+        else:
+            self.setWindowTitle(self.baseTitle)
+
+
+    def reloadTransects(self):
+        '''
+        reloadTransects is called when the reload button is pressed. It asks the
+        metadata cache to check the database and shows the current snapshot.
+        '''
+        if self.metadata is not None:
+            self.metadata.invalidate()
+        self.getTransects()
+
 
     def changeSurvey(self):
         '''
@@ -251,9 +339,8 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
 
         #  get a list of the completed transects
         sql = ("SELECT transect FROM transect_events WHERE transect_event_type='ET' AND " +
-                "ship=" + self.ship + " AND survey=" + self.survey + " GROUP BY transect " +
-                "ORDER BY transect DESC")
-        query = self.db.dbQuery(sql)
+                "ship=? AND survey=? GROUP BY transect ORDER BY transect DESC")
+        query = self.metadata.query(self.db, sql, (self.ship, self.survey))
 
         #  add them to the combobox
         for transect, in query:
@@ -263,16 +350,135 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
 
 
     def makeFileSetup(self):
-        if self.doallCheck.isChecked():
-            for ind in reversed(range(0, len(self.transect_list))):
-                self.cbTransects.setCurrentIndex(ind)
-                self.makeFile()
-        else:
-            self.makeFile()
+        run = runLedger.Run(tool='EVFileMaker')
+        if self.ledger is not None:
+            run = self.ledger.startRun('EVFileMaker', self.ship, self.survey, self.dataset,
+                    {'ek_dir':self.EKFilePathEdit.text(), 'dest_dir':self.destinationEdit.text(),
+                    'template':self.templateEvFileEdit.text(), 'ecs_file':self.ECSFileEdit.text(),
+                    'lineregion_dir':self.lineregionPath.text() if self.lineregionCheck.isChecked() else '',
+                    'ev_backend':self.evBackendName, 'do_all':self.doallCheck.isChecked()})
+        tracer = traceSpans.Tracer('EVFileMaker v' + str(self.ship) + ' s' + str(self.survey))
+        built = []
+        self.replaceExisting = False
+        try:
+            with tracer.span('build run', ship=self.ship, survey=self.survey, data_set=self.dataset) as runSpan:
+                if self.doallCheck.isChecked():
+                    #  check all of the transects before we start so we only build the ones that will work
+                    with runSpan.child('preflight', transects=len(self.transect_list)) as span:
+                        validTransects = self.preflightCheck(self.transect_list)
+                        span.set(valid=len(validTransects))
+                    #  build the transects with the most raw data first
+                    scheduler = transectScheduler.TransectScheduler(
+                            transectScheduler.CostModel.fromLedger(self.ledger, ('EVFileMaker',)))
+                    for ind in range(0, len(self.transect_list)):
+                        if self.transect_list[ind] in validTransects:
+                            scheduler.add(self.transect_list[ind],
+                                    self.preflightRawBytes.get(str(self.transect_list[ind]), 0), ind)
+                    while True:
+                        scheduled = scheduler.next()
+                        if scheduled is None:
+                            break
+                        self.cbTransects.setCurrentIndex(scheduled.item)
+                        with runSpan.child('makeFile', transect=scheduled.name,
+                                predicted_seconds=scheduled.predicted) as span:
+                            built.append(self.makeFile(run, span))
+                        scheduler.finish(scheduled, ok=bool(built[-1]))
+                    runSpan.set(predicted_makespan=scheduler.predictedMakespan,
+                            achieved_makespan=scheduler.achievedMakespan())
+                    if built:
+                        self.updateStatusBar('Makespan: ' + scheduler.report())
+                else:
+                    with runSpan.child('makeFile', transect=self.cbTransects.currentText()) as span:
+                        built.append(self.makeFile(run, span))
+                runSpan.set(built=len([b for b in built if b]), failed=len([b for b in built if not b]))
+        finally:
+            run.finish('ok' if built and all(built) else 'partial')
+            if self.runningEv is not None:
+                self.runningEv.quit()
+                self.runningEv = None
+            self.writeTrace(tracer)
+
+
+    def writeTrace(self, tracer):
+        '''
+        writeTrace writes a build run's spans to a Chrome trace file in the trace directory
+        '''
+        if not self.traceDir:
+            return
+        tracer.end()
+        path = os.path.join(self.traceDir, 'EVFileMaker-v' + str(self.ship) + '-s' + str(self.survey) +
+                '-' + time.strftime('%Y%m%d-%H%M%S') + '.trace.json')
+        try:
+            tracer.writeChromeTrace(path)
+        except (IOError, OSError):
+            pass
 
 
-    def makeFile(self):
+    def preflightCheck(self, transects):
+        '''
+        preflightCheck checks all of the provided transects against the raw file index
+        and the database before Echoview is started, presents a single report if there
+        are any problems and returns the list of transects that can be built.
+        '''
 
+        if not QDir(self.EKFilePathEdit.text()).exists():
+            QMessageBox.critical(self, "Error", "EK raw file directory does not exist.")
+            return []
+        if not QDir(self.destinationEdit.text()).exists():
+            QMessageBox.critical(self, "Error", "File destination directory does not exist.")
+            return []
+
+        self.updateStatusBar('Checking transects...')
+        datasetCheck = preflight.checkDataset(self.db, self.ship, self.survey, self.dataset)
+        rows = preflight.surveyEvents(self.db, self.ship, self.survey, transects)
+        EKindex = rawIndex.getIndex(self.EKFilePathEdit.text())
+        results = preflight.runPreflight(transects, rows, EKindex, self.destinationEdit.text(),
+                self.ship, self.survey, dataset_check=datasetCheck,
+                just_missed=self.JUSTMISSEDTHRESH)
+        self.updateStatusBar('')
+
+        validTransects = [r.transect for r in results if not r.problems]
+        existing = preflight.existingFiles(results)
+        #  the size of each transect's raw files, used to build the largest first
+        self.preflightRawBytes = dict([(r.transect, sum([runLedger.fileSize(path) or 0 for path in r.files]))
+                for r in results])
+        if len(validTransects) < len(results) or any([r.warnings for r in results]):
+            if not validTransects:
+                QMessageBox.critical(self, "Error", preflight.formatReport(results))
+                return []
+            if existing:
+                #  ask once for all of the existing files instead of for each file
+                reply = QMessageBox.question(self, "Preflight Check", preflight.formatReport(results) +
+                        "\n\nDo you want to replace the " + str(len(existing)) + " existing EV file(s)? " +
+                        "Choose No to build only the transects without an EV file.",
+                        QMessageBox.StandardButton.Yes|QMessageBox.StandardButton.No|
+                        QMessageBox.StandardButton.Cancel)
+                if (reply == QMessageBox.StandardButton.Cancel):
+                    return []
+                self.replaceExisting = reply == QMessageBox.StandardButton.Yes
+                if not self.replaceExisting:
+                    validTransects = [t for t in validTransects if t not in existing]
+            else:
+                reply = QMessageBox.question(self, "Preflight Check", preflight.formatReport(results) +
+                        "\n\nDo you want to build the transects that passed?",
+                        QMessageBox.StandardButton.Yes|QMessageBox.StandardButton.No)
+                if (reply == QMessageBox.StandardButton.No):
+                    return []
+
+        return validTransects
+
+
+    def makeFile(self, run=None, span=None):
+        '''
+        makeFile builds the EV file for the selected transect and returns True if
+        it was built. The build is recorded as a unit of run, a runLedger.Run, and
+        its stages are traced as children of span, a traceSpans.Span.
+        '''
+
+        if run is None:
+            run = runLedger.Run(tool='EVFileMaker')
+        if span is None:
+            span = traceSpans.Tracer('EVFileMaker').span('makeFile')
 
         # check that all of our inputs are complete
         if (self.cbTransects.currentText() == ''):
@@ -288,23 +494,31 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
             QMessageBox.critical(self, "Error", "Template file doesn't exist.")
             return
 
+        #  builds that stop before the end are recorded with the status 'error'
+        unit = run.unit(self.cbTransects.currentText())
+
+        def stage(name, **attrs):
+            #  start timing a stage in the ledger and trace
+            unit.begin(name)
+            return span.stage(name, **attrs)
+
+        stage('query')
+
         #  get the dataset properties
         self.updateStatusBar('Getting dataset parameters...')
         sql = ("SELECT b.source_name,a.layer_reference,a.interval_type," +
                 "a.interval_units,a.interval_length FROM macebase2.data_sets a," +
-                "macebase2.acoustic_data_sources b WHERE ship=" + self.ship +
-                " AND survey=" + self.survey + " AND a.data_set_id=" + self.dataset +
-                " AND a.source_id=b.source_id")
-        query = self.db.dbQuery(sql)
+                "macebase2.acoustic_data_sources b WHERE ship=? AND survey=? AND a.data_set_id=? " +
+                "AND a.source_id=b.source_id")
+        query = self.db.dbQuery(sql, (self.ship, self.survey, self.dataset))
         sourceName, layerReference, intervalType, intervalUnits, intervalLength = query.first()
 
         #  get the surface exclusion line depth
         sql = ("SELECT b.exclusion_line_offset from zones a, exclusion_lines b " +
-                "WHERE ship=" + self.ship + " AND survey=" + self.survey +
-                " AND a.data_set_id=" + self.dataset + " AND " +
+                "WHERE ship=? AND survey=? AND a.data_set_id=? AND " +
                 "a.upper_exclusion_name='surface_exclusion' AND " +
                 "a.upper_exclusion_line=b.exclusion_line_id")
-        query = self.db.dbQuery(sql)
+        query = self.db.dbQuery(sql, (self.ship, self.survey, self.dataset))
         surface_exclusion_depth, = query.first()
         if surface_exclusion_depth is None:
             QMessageBox.critical(self, "Error", "Unable to find the surface exclusion line depth. " +
@@ -322,11 +536,10 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
 
         #  get the bottom offset.
         sql = ("SELECT b.exclusion_line_offset from zones a, exclusion_lines b " +
-                "WHERE ship=" + self.ship + " AND survey=" + self.survey +
-                " AND a.data_set_id=" + self.dataset + " AND " +
+                "WHERE ship=? AND survey=? AND a.data_set_id=? AND " +
                 "a.lower_exclusion_name='bottom_exclusion' AND " +
                 "a.lower_exclusion_line=b.exclusion_line_id")
-        query = self.db.dbQuery(sql)
+        query = self.db.dbQuery(sql, (self.ship, self.survey, self.dataset))
         botom_line_offset, = query.first()
         if botom_line_offset is None:
             QMessageBox.critical(self, "Error", "Unable to find the bottom exclusion line offset. " +
@@ -346,12 +559,15 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
         transect = '%03i' % float(self.cbTransects.currentText())
         EvFileName = 'v' + self.ship + '-s' + self.survey + '-x2-f38-t' + transect + '-z0.ev'
         self.EvFileName = os.path.normpath(str(self.destinationEdit.text())) + os.sep + EvFileName
+        unit.evFile = self.EvFileName
+        span.set(ev_file=EvFileName)
 
-        # check to see if file exists
-        if QFile(self.EvFileName).exists():
+        # check to see if file exists, unless the preflight check already asked
+        if QFile(self.EvFileName).exists() and not self.replaceExisting:
             reply = QMessageBox.warning(self, "WARNING", "This EV file already exists. Do you want to " +
                     "replace it?",  QMessageBox.StandardButton.Yes, QMessageBox.StandardButton.No)
             if (reply == QMessageBox.StandardButton.No):
+                unit.finish('skipped')
                 return
 
         #  get the events and times for this transect
@@ -359,150 +575,104 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
         transect = self.cbTransects.currentText()
         event_times=[]
         events=[]
-        sql = ("SELECT transect_event_type, TO_CHAR(time) FROM transect_events WHERE transect=" +
-            transect + " AND ship=" + self.ship + " AND survey=" + self.survey + " ORDER BY time ASC")
-        query = self.db.dbQuery(sql)
+        sql = ("SELECT transect_event_type, TO_CHAR(time) FROM transect_events WHERE transect=? " +
+            "AND ship=? AND survey=? ORDER BY time ASC")
+        query = self.db.dbQuery(sql, (transect, self.ship, self.survey))
         for event_type, evtime in query:
-            event_times.append(QDateTime().fromString(evtime,'MM/dd/yyyy hh:mm:ss.zzz'))
+            event_times.append(evtime)
             events.append(event_type)
 
-        #  Create lists of the starting and ending times of our transect segments
-        #  to use to build our .raw file list
-        start_times = []
-        end_times = []
-        if not 'BT' in events:
-            # this is a non broken transect
-            start_times.append(event_times[events.index('ST')])
-            end_times.append(event_times[events.index('ET')])
-        elif events.count('BT')==1:
-            # one break
-            start_times.append(event_times[events.index('ST')])
-            end_times.append(event_times[events.index('BT')])
-            start_times.append(event_times[events.index('RT')])
-            end_times.append(event_times[events.index('ET')])
-        else:
-            # many breaks
-            start_times.append(event_times[events.index('ST')])
-            cnt=events.count('BT')
-            for i in range(cnt):
-                idx = events.index('BT')
-                end_times.append(event_times.pop(idx))
-                events.pop(idx)
-                idx = events.index('RT')
-                start_times.append(event_times.pop(idx))
-                events.pop(idx)
-            end_times.append(event_times[events.index('ET')])
+        #  Create the starting and ending times of our transect segments to use to
+        #  build our .raw file list. The segment engine handles any number of breaks
+        #  and cleans up duplicated or unmatched events, which we report as warnings.
+        segments, anomalies = transectSegments.buildSegments([transect] * len(events),
+                events, transectSegments.eventTimes(event_times))
+        if (len(segments.start) == 0):
+            QMessageBox.critical(self, "Error", "Unable to determine any on-effort time spans " +
+                    "for this transect. Please check the ST/BT/RT/ET events for transect " +
+                    transect + ".")
+            self.updateStatusBar('')
+            return
+        if (anomalies and not self.doallCheck.isChecked()):
+            QMessageBox.warning(self, "Warning", "The events for this transect have problems:\n" +
+                    '\n'.join([anomaly.message for anomaly in anomalies]))
 
         try:
 
-            #  get a listing of all of the raw files in the raw file firectory
+            #  get the time index of all of the raw files in the raw file firectory
             self.updateStatusBar('Finding the files associated with timespans...')
-            EKfilelist = sorted(glob.glob(str(os.path.normpath(self.EKFilePathEdit.text())) +
-                    os.sep + '*.raw'))
-            if (not EKfilelist):
+            stageSpan = stage('raw index')
+            EKindex = rawIndex.getIndex(self.EKFilePathEdit.text())
+            stageSpan.set(raw_files_in_directory=len(EKindex))
+            if (len(EKindex) == 0) and (not EKindex.badNames):
                 QMessageBox.critical(self, "Error", "No .raw files found in raw file directory.")
                 return
 
-            #  work through the raw file list to determine which files are within our transect events
-            keepFiles = []
-            file_index = range(len(EKfilelist) - 1)
-            for i in range(len(start_times)):
-                keep_ind=[]
-                keep_files = False
-                for j in file_index:
-                    #  get the current and next file file names
-                    fullPath = EKfilelist[j]
-                    filename = fullPath.split(os.sep)[-1]
-                    nextPath = EKfilelist[j + 1]
-                    nextName = nextPath.split(os.sep)[-1]
-
-                    #  extract the data files' date/time string
-                    #  2/19/21 - this method was extended to us regular expressions
-                    #            to extract the date/time to allow for more flexibility.
-                    try:
-                        fileDate = re.findall('D[0-9]{8}-T[0-9]{6}', filename)[0]
-                        fileDate =  QDateTime().fromString(fileDate,'DyyyyMMdd-Thhmmss')
-                    except:
-                        QMessageBox.critical(self, "Error", "The raw file " + filename +
-                            " is misnamed. Raw files must have the date and time in the name " +
-                            "in the form DYYYYMMDD-Thhmmss.")
-                        return
-                    try:
-                        nextFileDate = re.findall('D[0-9]{8}-T[0-9]{6}', nextName)[0]
-                        nextFileDate =  QDateTime().fromString(nextFileDate,'DyyyyMMdd-Thhmmss')
-                    except:
-                        QMessageBox.critical(self, "Error", "The raw file " + nextName +
-                            " is misnamed. Raw files must have the date and time in the name " +
-                            "in the form DYYYYMMDD-Thhmmss.")
-                        return
-
-                    #print(start_times[i],end_times[i],fileDate)
-
-                    if (keep_files):
-                        keepFiles.append(fullPath)
-                        keep_ind.append(j)
-                    else:
-                        #  check if this file falls within
-                        if ((fileDate <= start_times[i] <= nextFileDate) or
-                                abs(fileDate.secsTo(start_times[i])) < self.JUSTMISSEDTHRESH):
-
-                            keepFiles.append(fullPath)
-                            keep_ind.append(j)
-                            keep_files = True
-
-                    if (fileDate <= end_times[i] <= nextFileDate):
-                        keep_files = False
-
-#                    if (((fileDate >=start_times[i]) and (fileDate<=end_times[i])) or
-#                            abs(fileDate.secsTo(start_times[i])) < self.JUSTMISSEDTHRESH):
-#                        keepFiles.append(fullPath)
-#                        keep_ind.append(j)
-
-
-                if (not keep_ind):
-                    QMessageBox.critical(self, "Error", "There are no data files for your " +
-                            "transect segment that starts at " + str(start_times[i]) +
-                            ". This usually means the data hasn't been copied into your " +
-                            "EK80 raw data directory yet.")
-                    return
-
-                #start_file = min(keep_ind)
-                #keepFiles.append(EKfilelist[start_file - 1])
-
-            #print(keepFiles)
+            #  2/19/21 - the date/time is extracted with regular expressions
+            #            to allow for more flexibility.
+            if (EKindex.badNames):
+                QMessageBox.critical(self, "Error", "The raw file " + os.path.basename(EKindex.badNames[0]) +
+                    " is misnamed. Raw files must have the date and time in the name " +
+                    "in the form DYYYYMMDD-Thhmmss.")
+                return
+
+            #  intersect our transect segments with the raw file spans
+            keepFiles, missing = EKindex.files(segments.start, segments.end,
+                    just_missed=self.JUSTMISSEDTHRESH)
+            stageSpan.set(segments=len(segments.start), raw_files=len(keepFiles))
+            if (missing):
+                QMessageBox.critical(self, "Error", "There are no data files for your " +
+                        "transect segment that starts at " + str(segments.start[missing[0]]) +
+                        ". This usually means the data hasn't been copied into your " +
+                        "EK80 raw data directory yet.")
+                return
 
             #Open up Echoview
             self.updateStatusBar('Opening echoview...')
+            stageSpan = stage('open')
+            stageSpan.stage('start echoview')
             QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
-            EvApp = win32com.client.Dispatch("EchoviewCom.EvApplication")
-            license = EvApp.IsLicensed()
-            if (license == 0):
+            #  starting the backend minimizes echoview
+            ev = exportMetrics.meterBackend(evBackend.getBackend(self.evBackendName))
+            if not ev.start():
                 self.updateStatusBar('ERROR: No dongle or no licensed scripting module.')
                 QMessageBox.warning(self, "ERROR", 'No Scripting Module Found')
-                EvApp.Quit()
                 self.updateStatusBar('')
                 QApplication.restoreOverrideCursor()
                 return
-
-            #  minimize
-            EvApp.Minimize()
+            self.watchdog.watch(ev, self.cbTransects.currentText())
 
             #  create the new EV file
             self.updateStatusBar('Loading template...')
-            EvFile = EvApp.NewFile(self.templateEvFileEdit.text())
-            # add the ECS file
-            Evfileset = EvFile.Filesets.FindByName('Fileset 1')
-            Evfileset.SetCalibrationFile(self.ECSFileEdit.text())
+            stageSpan.stage('load template', template=self.templateEvFileEdit.text())
+            EvFile = ev.newFile(self.templateEvFileEdit.text())
+            stageSpan.stage('set calibration')
+            # add the ECS file. The EV file refers to the copy in the calibration store so
+            #  later changes to the selected ECS file don't change it.
+            Evfileset = ev.findFileset(EvFile, 'Fileset 1')
+            storeDir = self.calibrationStoreDir
+            if storeDir == '':
+                storeDir = os.path.join(str(self.destinationEdit.text()), calibrationStore.STORE_DIRNAME)
+            if self.calStore is None or self.calStore.root != os.path.normpath(storeDir):
+                self.calStore = calibrationStore.CalibrationStore(storeDir)
+            calibration = self.calStore.add(self.ECSFileEdit.text())
+            ev.setCalibrationFile(Evfileset, calibration.path)
+            stageSpan.current.set(calibration=calibration.digest)
             #  add the .raw files
             self.updateStatusBar('Adding .raw files...')
+            stageSpan = stage('add raw files', raw_files=len(keepFiles))
             for file in keepFiles:
-                EvFile.Filesets.Item(0).DataFiles.Add(file)
+                ev.addDataFile(EvFile, file, 0)
+                unit.input(file)
+            stageSpan.set(raw_bytes=sum([size or 0 for path, size in unit.inputs]))
 
             #  we must wait for EV to index all of the raw files before proceeding since
             #  our line created below will not be complete if some files haven't been indexed
             #  this shows up as the bottom_exclusion line being incomplete or "flat" for
             #  whole raw file segments.
             self.updateStatusBar('Waiting for echoview to index .raw files...')
+            stageSpan = stage('pre-read')
+            stageSpan.stage('indexing')
 
             #  the EvFile.PreRead method doesn't do squat here - we have to wait
             #  for the files to be indexed
@@ -523,7 +693,11 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
                 if (allIndexed) or (waitTime > self.EV_INDEXING_TIMEOUT):
                     indexing = False
 
+            stageSpan.set(indexing_wait=waitTime, all_indexed=allIndexed,
+                    unindexed=len([file for file in keepFiles if not QFile(file+'.evi').exists()]))
+
             #  give EV just a bit more time after indexing all of the files
+            stageSpan.stage('settle')
             time.sleep(3)
 
             #  At this time (EV 8.0.x) we cannot create time based regions so we cannot
@@ -531,25 +705,30 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
             #  create an EVR file, import it, then delete it
             if not self.lineregionCheck.isChecked():
                 self.updateStatusBar('Importing regions...')
-                tempFilePath = os.path.normpath(str(self.destinationEdit.text()))
-                evrFile = self.createEVRFile(transect, tempFilePath)
-                EvFile.Import(evrFile)
-                os.remove(evrFile)
+                stageSpan = stage('region import', transect=transect)
+                #  write the temporary EVR file to local disk, not the destination share
+                tempFilePath = tempfile.gettempdir()
+                evrPath = self.createEVRFile(transect, tempFilePath)
+                ev.importFile(EvFile, evrPath)
+                os.remove(evrPath)
 
             #  create the new bottom_exclusion line based on the mean of all sounder detected bottom lines
             self.updateStatusBar('Creating new bottom_exclusion line...')
-            EvLine = EvFile.Lines.FindByName('Mean of all sounder-detected bottom lines')
-            EvNewLine = EvFile.Lines.CreateOffsetLinear(EvLine,1, botom_line_offset,1)
-            EvLineOld = EvFile.Lines.FindByName('bottom_exclusion')
-            EvLineOld.OverwriteWith(EvNewLine)
-            EvFile.Lines.Delete(EvNewLine)
+            stageSpan = stage('line setup')
+            stageSpan.stage('bottom_exclusion', offset=botom_line_offset)
+            EvLine = ev.findLine(EvFile, 'Mean of all sounder-detected bottom lines')
+            EvNewLine = ev.createOffsetLinear(EvFile, EvLine, 1, botom_line_offset, 1)
+            EvLineOld = ev.findLine(EvFile, 'bottom_exclusion')
+            ev.overwriteLine(EvLineOld, EvNewLine)
+            ev.deleteLine(EvFile, EvNewLine)
 
             #  create the surface exclusion line
             self.updateStatusBar('Creating new surface_exclusion line...')
-            EvNewLine = EvFile.Lines.CreateFixedDepth(surface_exclusion_depth)
-            EvLineOld = EvFile.Lines.FindByName('surface_exclusion')
-            EvLineOld.OverwriteWith(EvNewLine)
-            EvFile.Lines.Delete(EvNewLine)
+            stageSpan.stage('surface_exclusion', depth=surface_exclusion_depth)
+            EvNewLine = ev.createFixedDepth(EvFile, surface_exclusion_depth)
+            EvLineOld = ev.findLine(EvFile, 'surface_exclusion')
+            ev.overwriteLine(EvLineOld, EvNewLine)
+            ev.deleteLine(EvFile, EvNewLine)
             
             # Future work can be to set the 0.5/2/3 m off bottom lines to be based off the depth of the bottom exclusion
             # This changes in winter (-0.5) and EBS summer (-0.25)
@@ -581,66 +760,102 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
 
             # Import lines and regions
             if self.lineregionCheck.isChecked():
-                # Find all the line and region files for this transect and load them
-                # Get line file names
-                t = 't%03i' % float(self.cbTransects.currentText())
-                lineFiles = glob.glob(str(os.path.normpath(self.lineregionPath.text()))+os.sep+'Lines'+os.sep+'*'+t+'*')
-                for file in lineFiles:
-
-                    splits = file.split('-')
-                    # Get the line name that this line should replace.  It is embedded into the file name, after the transect number
-                    lineName = splits[splits.index(t)+1]
-                    needsFix = lineName.find('.evl')
-                    if needsFix > -1:
-                        lineName = lineName[:needsFix]
-                    EvLineOld = EvFile.Lines.FindByName(lineName)
-
-                    if EvLineOld and EvLineOld.AsLineEditable():
-                        EvFile.Import(file)
-                        # Get the line name that was inserted into EV.  Strip off path and the end '.evl'
-                        newlineName = file.split('\\')[-1][:-4]
-                        # If there is a decimal in the name, only the string before the decimal is used by EV as
-                        #  the line name (it assumes that is the '.evl' part)
-                        newlineName = newlineName.split('.')[0]
-                        EvLineNew = EvFile.Lines.FindByName(newlineName)
-                        # If the evl file is empty, which apparently happens, then there will be no line to find, so skip it
+                # Find all the line and region files for this transect and load them.
+                # The index lists the Lines and Regions directories once and parses the
+                # line name that each file should replace out of the file name.
+                transectFiles = lineRegionIndex.transectFiles(self.lineregionPath.text(),
+                        self.cbTransects.currentText())
+                lineFiles = [(lineName, lineFile.path) for lineName, lineFile in
+                        transectFiles.lines.items()]
+                regionFiles = transectFiles.regions
+
+                #  check the files locally first so empty or malformed files, and files
+                #  from another transect or period, are skipped without a round trip to Echoview
+                self.updateStatusBar('Checking line and region files...')
+                stageSpan = stage('line import')
+                stageSpan.stage('validate', files=len(lineFiles) + len(regionFiles))
+                tolerance = timedelta(seconds=self.JUSTMISSEDTHRESH)
+                timeRange = (segments.start.min().tolist() - tolerance, segments.end.max().tolist() + tolerance)
+                badFiles = [r.path for r in evlFile.validateFiles([file for _, file in lineFiles] +
+                        regionFiles, time_range=timeRange) if r.problems]
+                lineFiles = [(lineName, file) for lineName, file in lineFiles if file not in badFiles]
+                regionFiles = [file for file in regionFiles if file not in badFiles]
+                stageSpan.current.set(bad_files=len(badFiles))
+
+                self.updateStatusBar('Importing lines and regions...')
+                linesSpan = stageSpan.stage('import lines', lines=len(lineFiles))
+                replaced = 0
+                created = 0
+                for lineName, file in lineFiles:
+
+                    EvLineOld = ev.findLine(EvFile, lineName)
+
+                    # Get the line name that will be inserted into EV.
+                    newlineName = evlFile.importedLineName(file)
+
+                    if EvLineOld and ev.isLineEditable(EvLineOld):
+                        ev.importFile(EvFile, file)
+                        EvLineNew = ev.findLine(EvFile, newlineName)
                         if EvLineNew:
                             # This line already exists, so replace it
-                            EvLineOld.OverwriteWith(EvLineNew)
-                            EvFile.Lines.Delete(EvLineNew)
-                            # This line doesn't exist, so create it/rename the new one as the embedded name
+                            ev.overwriteLine(EvLineOld, EvLineNew)
+                            ev.deleteLine(EvFile, EvLineNew)
+                            replaced += 1
                     elif not EvLineOld:
-                        EvFile.Import(file)
-                        # Get the line name that was inserted into EV.  Strip off path and the end '.evl'
-                        newlineName = file.split('\\')[-1][:-4]
-                        # If there is a decimal in the name, only the string before the decimal is used by
-                        #  EV as the line name (it assumes that is the '.evl' part)
-                        newlineName = newlineName.split('.')[0]
-                        EvLineNew = EvFile.Lines.FindByName(newlineName)
-                        # If the evl file is empty, which apparently happens, then there will be no line to find, so skip it
+                        # This line doesn't exist, so create it/rename the new one as the embedded name
+                        ev.importFile(EvFile, file)
+                        EvLineNew = ev.findLine(EvFile, newlineName)
                         if EvLineNew:
-                            EvLineNew.Name = lineName
+                            ev.renameLine(EvLineNew, lineName)
+                            created += 1
+                linesSpan.set(replaced=replaced, created=created)
 
-                regionFiles = glob.glob(str(os.path.normpath(str(self.lineregionPath.text())))+os.sep+'Regions'+os.sep+'*'+t+'*')
+                stageSpan.stage('import regions', regions=len(regionFiles))
                 for region in regionFiles:
-                    EvFile.Import(region)
+                    ev.importFile(EvFile, region)
             #  save the changes
             self.updateStatusBar('Saving file...')
-            EvFile.SaveAs(self.EvFileName)
-            EvApp.CloseFile(EvFile)
-            EvApp.Quit()
-
-            #  give EV some time to clean up
-            time.sleep(3)
+            stageSpan = stage('save')
+            stageSpan.stage('save file')
+            ev.saveFileAs(EvFile, self.EvFileName)
+            stageSpan.stage('close file')
+            ev.closeFile(EvFile)
+            usage = self.watchdog.stop()
+            reason = self.watchdog.recycleReason(usage)
+            if usage is not None and usage.end is not None:
+                stageSpan.set(echoview_rss=usage.end.rss, echoview_peak_rss=usage.peak_rss,
+                        echoview_handles=usage.end.handles)
+            if not self.watchdog.enabled or reason:
+                stageSpan.stage('quit echoview', reason=reason or 'every file')
+                ev.quit()
+                self.runningEv = None
+            else:
+                self.runningEv = ev
+            stage('copy')
+            calibrationStore.writeRunMetadata(os.path.splitext(self.EvFileName)[0] + '-run.json',
+                    calibrationStore.calibrationMetadata(calibration, None))
+            unit.output(self.EvFileName)
+            unit.output(os.path.splitext(self.EvFileName)[0] + '-run.json')
+            unit.finish('ok')
+            span.end()
+            span.set(status='ok', bytes=sum([size or 0 for path, size in unit.outputs]))
+
+            #  give EV some time to clean up if it was quit
+            if self.runningEv is None:
+                time.sleep(3)
 
             #  update the GUI and inform the user we're done
             QApplication.restoreOverrideCursor()
             self.statusLabel.setText('')
             if not self.doallCheck.isChecked():
                 QMessageBox.information(self, "Congratulations!", "EV file has been created.")
+            return True
 
         except:
             #  there was an error - give the user a wee bit of feedback
+            unit.finish('error')
+            span.set(status='error', error=str(sys.exc_info()[1]))
+            self.watchdog.stop()
             self.sendError()
 
 
@@ -661,66 +876,36 @@ class EVFileMaker(QMainWindow, ui_EVFileMaker.Ui_MainWindow):
         self.appSettings.setValue('dest_dir',self.destinationEdit.text())
         self.appSettings.setValue('templ_file',self.templateEvFileEdit.text())
 
+        #  stop the metadata refresh and close the database session
+        if self.metadata is not None:
+            self.metadata.close()
+        if self.metrics is not None:
+            self.metrics.shutdown()
+        if self.db is not None:
+            self.db.close()
+
         event.accept()
 
 
     def createEVRFile(self, transect, path):
+        '''
+        createEVRFile writes an EVR file containing a marker region for each of
+        the transect's events and returns the file name. The file is built in
+        memory and written in one go by evrFile.writeEVR.
+        '''
 
-        #  determine the number of events for this transect
-        sql = ("SELECT count(*) FROM macebase2.transect_events WHERE transect=" +
-                transect + " AND " + "ship=" + self.ship + " AND survey=" + self.survey)
-        query = self.db.dbQuery(sql)
-        nEvents, = query.first()
+        #get the data
+        sql = ("SELECT transect_event_type, TO_CHAR(time) FROM macebase2.transect_events " +
+                "WHERE transect=? AND ship=? AND survey=? ORDER BY time ASC")
+        query = self.db.dbQuery(sql, (transect, self.ship, self.survey))
 
         #  ensure we have a proper path
         pathText = os.path.normpath(str(path))
         pathText = pathText + os.sep + 'Transect_' + transect + '.evr'
 
-        #  open te output file and write the header
-        evrFile = QFile(pathText)
-        evrFile.open(QIODevice.OpenModeFlag.ReadWrite|QIODevice.OpenModeFlag.Truncate)
-        evrStream = QTextStream(evrFile)
-        evrStream << 'EVRG 7 7.1.34.30284' << '\r\n'
-        evrStream << nEvents << '\r\n'
-        evrStream << '\r\n'
-
-        #get the data
-        sql = ("SELECT transect_event_type, TO_CHAR(time) FROM macebase2.transect_events " +
-                "WHERE transect=" + transect + " AND ship=" + self.ship + " AND survey=" + self.survey)
-        query = self.db.dbQuery(sql)
-
-        #  loop thru the events for this transect
-        cnt = 1
-        for event_type, evtime in query:
-
-            #  convert the time to a QDateTime
-            t = QDateTime().fromString(evtime,'MM/dd/yyyy hh:mm:ss.zzz')
-            #  get the start date and time components
-            d1 = t.toString('yyyyMMdd')
-            t1 = t.toString('hhmmsszzz0')
-            #  now generate the end date and time
-            tf = t.addMSecs(1003)
-            d2 = tf.toString('yyyyMMdd')
-            t2 = t.toString('hhmmsszzz0')
-
-            #  write the region data for this event
-            evrStream << '13 4 ' << str(cnt) << ' 0 6 -1 1 ' << d1 << ' ' << t1 << \
-                    '  -9999.99 ' << d2 << ' ' << t2 << '  9999.99\r\n'
-            evrStream << '1\r\n'
-            evrStream << event_type << '_' << transect << '\r\n'
-            evrStream << '0\r\n'
-            evrStream << 'Unclassified\r\n'
-            evrStream << d1 << ' ' << t1 << ' -9999.9900000000 ' << d1 << ' ' << t1 << \
-                    '  9999.9900000000 ' << d2 << ' ' << t2 << ' 9999.9900000000 ' << d2 << \
-                    ' ' << t2 << ' -9999.9900000000 2 \r\n'
-            evrStream << event_type << '_' << transect << '\r\n'
-            evrStream<<'\r\n'
-
-            #  increment the counter
-            cnt += 1
-
-        #  close the file
-        evrFile.close()
+        #  the region count in the header is taken from the regions we write
+        regions = evrFile.eventRegions([(transect, event_type, evtime) for event_type, evtime in query])
+        evrFile.writeEVR(regions, pathText)
 
         return str(pathText)
 
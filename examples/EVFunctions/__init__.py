@@ -0,0 +1,12 @@
+'''
+EVFunctions - non-GUI helpers shared by EchoviewExport.py and EVFileMaker.py
+
+Modules in this package are imported individually, in the same way the apps
+import MaceFunctions, e.g.:
+
+    from EVFunctions import transectSegments
+
+Nothing in this package imports PyQt6 or win32com at module level and numpy is
+imported lazily (see lazyImport), so the core can be imported and run headless
+cheaply. python -m EVFunctions.startupTime checks that this stays true.
+'''
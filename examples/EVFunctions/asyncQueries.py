@@ -0,0 +1,111 @@
+'''
+asyncQueries - runs database lookups off the GUI thread.
+
+Selecting a ship in the Exporter chains getSurveys -> getDataSets ->
+getExportParameters, about ten round trips that used to run on the GUI
+thread before the dialog responded. A QueryRunner runs each load on a
+background executor and hands the result back to the GUI thread through a
+deliver function (the apps pass the emit method of a signal that takes a
+callable), so widgets are only touched on the GUI thread.
+
+Loads are submitted on named channels. Submitting a new load on a channel
+supersedes the load in flight on it and can cancel dependent channels, e.g.
+a new ship cancels the pending surveys, data sets and parameter loads. A
+superseded load is cancelled if it hasn't started and its result is dropped
+if it has. parallel() runs independent lookups concurrently.
+'''
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueryRunner(object):
+    '''
+    QueryRunner runs loads on a background executor. deliver is called from
+    the worker thread with a function that must be run on the GUI thread.
+    '''
+
+    def __init__(self, deliver, workers=2, parallel_workers=6):
+        self.deliver = deliver
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        #  a separate executor for parallel() so loads can't deadlock waiting on it
+        self.fanout = ThreadPoolExecutor(max_workers=parallel_workers)
+        self.generation = {}
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def submit(self, channel, work, on_result, on_error=None, cancels=()):
+        '''
+        submit runs work() in the background and calls on_result(result) (or
+        on_error(exception)) on the GUI thread, unless another load is submitted
+        on the channel, or the channel is cancelled, before it finishes. The
+        channels in cancels are cancelled first.
+        '''
+        for other in cancels:
+            self.cancel(other)
+        with self.lock:
+            self._supersede(channel)
+            generation = self.generation[channel]
+            future = self.executor.submit(work)
+            self.futures[channel] = future
+
+        def done(future):
+            if future.cancelled():
+                return
+            self.deliver(lambda: self._finish(channel, generation, future, on_result, on_error))
+        future.add_done_callback(done)
+        return future
+
+    def _supersede(self, channel):
+        self.generation[channel] = self.generation.get(channel, 0) + 1
+        future = self.futures.pop(channel, None)
+        if future is not None:
+            future.cancel()
+
+    def cancel(self, channel):
+        '''
+        cancel drops the load in flight on a channel
+        '''
+        with self.lock:
+            self._supersede(channel)
+
+    def isCurrent(self, channel, generation):
+        with self.lock:
+            return self.generation.get(channel) == generation
+
+    def _finish(self, channel, generation, future, on_result, on_error):
+        #  this runs on the GUI thread. Drop results that have been superseded.
+        if not self.isCurrent(channel, generation):
+            return
+        with self.lock:
+            self.futures.pop(channel, None)
+        error = future.exception()
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+            else:
+                raise error
+        else:
+            on_result(future.result())
+
+    def busy(self, channel):
+        '''
+        busy returns True if a load is in flight on the channel
+        '''
+        with self.lock:
+            return channel in self.futures
+
+    def parallel(self, *functions):
+        '''
+        parallel runs the functions concurrently and returns their results in
+        order. It is meant to be called from within a load.
+        '''
+        futures = [self.fanout.submit(f) for f in functions]
+        return [f.result() for f in futures]
+
+    def shutdown(self):
+        with self.lock:
+            for channel in list(self.futures.keys()):
+                self._supersede(channel)
+        self.executor.shutdown(wait=False)
+        self.fanout.shutdown(wait=False)
@@ -0,0 +1,119 @@
+'''
+calibrationStore - keeps one copy of each distinct calibration (.ecs) file.
+
+export_py_MB2 used to read the ECS file and write a full copy of it as
+<transect>-calibration-.ecs for every transect, so a survey's output
+directory ended up with hundreds of identical copies, each one written over
+the share. EVFileMaker pointed each new EV file at whatever ECS file was
+selected, which could be edited or moved after the EV file was made.
+
+A CalibrationStore keeps each distinct ECS file once, named by its SHA-1
+digest, in a store directory (by default a 'calibration' directory in the
+output directory). add() returns the stored copy, hashing a source file only
+once per session unless it changes. Echoview is pointed at the stored copy.
+link() gives a transect its <transect>-calibration-.ecs name as a hard link
+(or symlink) to the stored copy instead of a new file. When neither is
+possible (e.g. the store is on another volume) the transect only gets its
+manifest entry. The digest and stored path are always recorded in the
+transect's run metadata file with writeRunMetadata.
+'''
+
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+
+from EVFunctions import stagingUpload
+
+
+#  the name of the store directory created in the output directory
+STORE_DIRNAME = 'calibration'
+
+#  a stored calibration file. source is the file it was added from.
+CalibrationFile = namedtuple('CalibrationFile', ['digest', 'path', 'source'])
+
+
+class CalibrationStore(object):
+    '''
+    CalibrationStore stores calibration files by content in the root directory
+    '''
+
+    def __init__(self, root):
+        self.root = os.path.normpath(str(root))
+        self.lock = threading.Lock()
+        #  stored files keyed by (source path, size, modification time)
+        self.known = {}
+
+    def add(self, source):
+        '''
+        add stores a calibration file if its contents aren't already in the
+        store and returns its CalibrationFile.
+        '''
+        source = os.path.abspath(str(source))
+        stat = os.stat(source)
+        sourceKey = (source, stat.st_size, stat.st_mtime)
+        with self.lock:
+            stored = self.known.get(sourceKey)
+        if stored is not None and os.path.exists(stored.path):
+            return stored
+
+        digest = stagingUpload.fileDigest(source)
+        extension = os.path.splitext(source)[1] or '.ecs'
+        path = os.path.join(self.root, digest + extension.lower())
+        if not os.path.exists(path):
+            #  written to a temporary name and renamed, so other workstations
+            #  adding the same file at the same time are harmless
+            stagingUpload.uploadFile(source, path)
+        stored = CalibrationFile(digest, path, source)
+        with self.lock:
+            self.known[sourceKey] = stored
+        return stored
+
+    def link(self, stored, destination):
+        '''
+        link makes destination a hard link (or failing that a symlink) to a
+        stored calibration file. Returns 'hardlink', 'symlink' or None if
+        neither could be made.
+        '''
+        if os.path.lexists(destination):
+            if os.path.exists(destination) and os.path.samefile(destination, stored.path):
+                return 'hardlink' if not os.path.islink(destination) else 'symlink'
+            os.remove(destination)
+        try:
+            os.link(stored.path, destination)
+            return 'hardlink'
+        except (OSError, AttributeError, NotImplementedError):
+            pass
+        try:
+            os.symlink(stored.path, destination)
+            return 'symlink'
+        except (OSError, AttributeError, NotImplementedError):
+            return None
+
+
+def writeRunMetadata(path, values):
+    '''
+    writeRunMetadata merges a dict of values into a JSON run metadata file,
+    creating it if needed.
+    '''
+    metadata = {}
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                metadata = json.load(f)
+        except ValueError:
+            metadata = {}
+    metadata.update(values)
+    metadata['updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    with open(path, 'w') as f:
+        json.dump(metadata, f, indent=2, sort_keys=True)
+
+
+def calibrationMetadata(stored, linked):
+    '''
+    calibrationMetadata returns the run metadata entry for a stored calibration
+    file. linked is the value returned by CalibrationStore.link.
+    '''
+    return {'calibration': {'sha1': stored.digest, 'stored_path': stored.path,
+            'source': stored.source, 'linked': linked or 'manifest'}}
@@ -0,0 +1,461 @@
+'''
+comTrace - record and replay of Echoview backend call traces.
+
+Echoview can't run in CI or on Linux, so we can't directly check whether a
+change to the orchestration in export_py_MB2 or makeFile adds COM round
+trips. RecordingBackend wraps a real backend during a production run and
+writes every call (method, arguments, return value, duration and the time
+spent in our own code since the previous call) to a JSON lines trace file.
+ReplayBackend is a stand-in backend that serves a recorded trace back to the
+same code on any platform, optionally reproducing the recorded COM timing,
+and reports any extra, missing or reordered calls and any added latency
+between calls.
+
+Select with the EV_BACKEND environment variable or the ev_backend setting:
+
+    record  - record the backend named by EV_RECORD_BACKEND (default win32com)
+              to the file named by EV_TRACE_FILE
+    replay  - replay the file named by EV_TRACE_FILE. Set EV_REPLAY_TIMING=1
+              to sleep for the recorded duration of each call.
+
+The apps create a backend for every transect. The backends of a process that
+use the same trace file share one trace session, so a run's transects are
+numbered, and replayed, as one trace.
+
+A trace recorded by a job board worker (EV_BACKEND=record) can be replayed
+against the board's units with the current export code, which reports the
+mismatches and exits with status 1 if there are any. The replay writes to an
+empty directory, so the trace should be recorded with an empty output
+directory too, or lines that were up to date aren't in it:
+
+    python -m EVFunctions.comTrace replay <trace> <board dir>
+    python -m EVFunctions.comTrace compare <baseline trace> [<trace>]
+'''
+
+import os
+import abc
+import json
+import time
+import threading
+
+from EVFunctions import evBackend
+
+
+#  environment variables used when the backends are created by the apps
+TRACE_FILE_ENV_VAR = 'EV_TRACE_FILE'
+RECORD_BACKEND_ENV_VAR = 'EV_RECORD_BACKEND'
+REPLAY_TIMING_ENV_VAR = 'EV_REPLAY_TIMING'
+
+#  the position of the output path argument of the export methods. The export
+#  code reads back what it exported (the line export cache, for example), so a
+#  replayed export that succeeded leaves an empty file there.
+EXPORT_PATH_ARGS = {'exportLine': 2, 'exportRegionsLog': 1, 'exportIntegrationByRegionsByCells': 1,
+        'exportRegionDefinitions': 1}
+
+
+class Handle(object):
+    '''
+    Handle stands in for a COM object (file, fileset, variable or line) in a
+    replayed trace.
+    '''
+    def __init__(self, handle_id):
+        self.handle_id = handle_id
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return '<Handle ' + str(self.handle_id) + '>'
+
+
+class _HandleTable(object):
+    '''
+    _HandleTable assigns stable ids to the opaque objects returned by a backend
+    '''
+    def __init__(self):
+        self.ids = {}
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def idFor(self, obj):
+        with self.lock:
+            key = id(obj)
+            if key not in self.ids:
+                handle_id = 'h' + str(len(self.ids) + 1)
+                self.ids[key] = handle_id
+                #  keep a reference so the id can't be reused
+                self.objects[handle_id] = obj
+            return self.ids[key]
+
+
+#  the trace sessions of this process keyed by kind and trace file
+_sessions = {}
+_sessionsLock = threading.Lock()
+
+
+def _session(kind, trace_file, factory):
+    key = (kind, os.path.normcase(os.path.abspath(trace_file)))
+    with _sessionsLock:
+        if key not in _sessions:
+            _sessions[key] = factory()
+        return _sessions[key]
+
+
+def endSession(trace_file):
+    '''
+    endSession ends this process's record and replay sessions of a trace file,
+    so the next backends that use it start a new session
+    '''
+    with _sessionsLock:
+        for kind in ('record', 'replay'):
+            _sessions.pop((kind, os.path.normcase(os.path.abspath(trace_file))), None)
+
+
+def _encode(value, handles):
+    '''
+    _encode converts arguments and return values to JSON friendly values. Anything
+    that isn't a simple type is treated as a handle.
+    '''
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Handle):
+        return {'__handle__': value.handle_id}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v, handles) for v in value]
+    return {'__handle__': handles.idFor(value)}
+
+
+def _decode(value, handles):
+    '''
+    _decode converts recorded values back into python values, creating Handle
+    objects for recorded handles.
+    '''
+    if isinstance(value, dict) and '__handle__' in value:
+        handle_id = value['__handle__']
+        if handle_id not in handles:
+            handles[handle_id] = Handle(handle_id)
+        return handles[handle_id]
+    if isinstance(value, list):
+        return [_decode(v, handles) for v in value]
+    return value
+
+
+class RecordSession(object):
+    '''
+    RecordSession is the call numbering and handle table shared by the
+    RecordingBackends of a process that write to the same trace file
+    '''
+    def __init__(self, trace_file):
+        self.traceFile = trace_file
+        self.handles = _HandleTable()
+        self.seq = 0
+        self.lastReturn = None
+        self.lock = threading.Lock()
+
+
+class RecordingBackend(evBackend.EchoviewBackend):
+    '''
+    RecordingBackend passes every call through to another backend and appends a
+    record of it to a JSON lines trace file.
+    '''
+
+    def __init__(self, trace_file=None, backend=None, **kwargs):
+        self.traceFile = trace_file or os.environ.get(TRACE_FILE_ENV_VAR, 'ev_trace.jsonl')
+        self.backend = evBackend.getBackend(backend or os.environ.get(RECORD_BACKEND_ENV_VAR,
+                evBackend.DEFAULT_BACKEND), **kwargs)
+        self.session = _session('record', self.traceFile, lambda: RecordSession(self.traceFile))
+
+    def _call(self, method, args, kwargs):
+        session = self.session
+        start = time.perf_counter()
+        gap = 0.0 if session.lastReturn is None else start - session.lastReturn
+        error = None
+        result = None
+        try:
+            result = getattr(self.backend, method)(*args, **kwargs)
+            return result
+        except Exception as e:
+            error = type(e).__name__ + ': ' + str(e)
+            raise
+        finally:
+            end = time.perf_counter()
+            with session.lock:
+                session.lastReturn = end
+                session.seq += 1
+                record = {'seq': session.seq, 'method': method,
+                        'args': _encode(list(args), session.handles),
+                        'kwargs': dict([(k, _encode(v, session.handles)) for k, v in kwargs.items()]),
+                        'result': _encode(result, session.handles), 'error': error,
+                        'duration': end - start, 'gap': gap}
+                with open(self.traceFile, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+
+class TraceMismatch(object):
+    '''
+    TraceMismatch describes one difference between a replayed run and its trace.
+    kind is one of 'extra call', 'reordered call', 'argument mismatch',
+    'missing call' or 'added latency'.
+    '''
+    def __init__(self, kind, seq, method, message):
+        self.kind = kind
+        self.seq = seq
+        self.method = method
+        self.message = message
+
+    def __repr__(self):
+        return '<TraceMismatch ' + self.kind + ' #' + str(self.seq) + ' ' + self.method + '>'
+
+
+class ReplaySession(object):
+    '''
+    ReplaySession serves the return values of a recorded trace back to the code
+    under test. Calls are expected in the recorded order. If reproduce_timing
+    is True each call sleeps for its recorded duration. Time spent between calls
+    that exceeds the recorded gap by more than latency_tolerance seconds (or
+    latency_factor times the recorded gap) is reported as added latency.
+    '''
+
+    def __init__(self, trace_file, reproduce_timing=False, latency_tolerance=0.5, latency_factor=2.0):
+        self.traceFile = trace_file
+        #  (replayed, recorded) path prefixes for runs that write elsewhere than the recorded run
+        self.pathMap = []
+        self.records = loadTrace(trace_file)
+        self.reproduceTiming = reproduce_timing
+        self.latencyTolerance = latency_tolerance
+        self.latencyFactor = latency_factor
+        self.handles = {}
+        self.used = [False] * len(self.records)
+        self.position = 0
+        self.lastReturn = None
+        self.mismatches = []
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def _find(self, method, args, kwargs):
+        '''
+        _find returns the index of the first unused recorded call to method and
+        whether its arguments match. Looking ahead from the current position
+        lets us tell reordered calls from extra calls.
+        '''
+        table = _HandleTable()
+        encodedArgs = self._mapPaths(_encode(list(args), table))
+        encodedKwargs = dict([(k, self._mapPaths(_encode(v, table))) for k, v in kwargs.items()])
+        for i in range(self.position, len(self.records)):
+            record = self.records[i]
+            if not self.used[i] and record['method'] == method:
+                return i, record['args'] == encodedArgs and record['kwargs'] == encodedKwargs
+        return None, False
+
+    def _mapPaths(self, value):
+        if isinstance(value, list):
+            return [self._mapPaths(v) for v in value]
+        if isinstance(value, str):
+            for replayed, recorded in self.pathMap:
+                if value.startswith(replayed):
+                    return recorded + value[len(replayed):]
+        return value
+
+    def call(self, method, args, kwargs):
+        '''
+        call replays a call and returns the recorded result
+        '''
+        now = time.perf_counter()
+        with self.lock:
+            self.calls += 1
+            index, argsMatch = self._find(method, args, kwargs)
+
+            if index is None:
+                self.mismatches.append(TraceMismatch('extra call', None, method,
+                        'call to ' + method + ' is not in the trace'))
+                self.lastReturn = time.perf_counter()
+                return None
+
+            record = self.records[index]
+            skipped = [r['method'] + ' #' + str(r['seq']) for r, used in
+                    zip(self.records[self.position:index], self.used[self.position:index]) if not used]
+            if skipped:
+                self.mismatches.append(TraceMismatch('reordered call', record['seq'], method,
+                        method + ' was called before ' + ', '.join(skipped)))
+            if not argsMatch:
+                self.mismatches.append(TraceMismatch('argument mismatch', record['seq'], method,
+                        method + ' was called with different arguments'))
+
+            #  check the time our own code took since the last call
+            if self.lastReturn is not None:
+                gap = now - self.lastReturn
+                allowed = max(record['gap'] * self.latencyFactor, record['gap'] + self.latencyTolerance)
+                if gap > allowed:
+                    self.mismatches.append(TraceMismatch('added latency', record['seq'], method,
+                            '%.3f s before %s (recorded %.3f s)' % (gap, method, record['gap'])))
+
+            #  mark the record used and move the position past any used records
+            self.used[index] = True
+            while self.position < len(self.records) and self.used[self.position]:
+                self.position += 1
+
+        if self.reproduceTiming:
+            time.sleep(record['duration'])
+        self.lastReturn = time.perf_counter()
+
+        if record['error']:
+            raise RuntimeError('replayed error: ' + record['error'])
+        if record['result'] and len(args) > EXPORT_PATH_ARGS.get(method, len(args)):
+            path = args[EXPORT_PATH_ARGS[method]]
+            if os.path.isdir(os.path.dirname(path) or '.'):
+                open(path, 'w').close()
+        return _decode(record['result'], self.handles)
+
+    def finish(self):
+        '''
+        finish reports any recorded calls that were never made and returns the
+        list of TraceMismatch objects for the replay.
+        '''
+        with self.lock:
+            for record, used in zip(self.records, self.used):
+                if not used:
+                    self.mismatches.append(TraceMismatch('missing call', record['seq'], record['method'],
+                            record['method'] + ' was recorded but not called'))
+            self.used = [True] * len(self.records)
+            self.position = len(self.records)
+        return self.mismatches
+
+    def report(self):
+        '''
+        report returns a text summary of the replay
+        '''
+        lines = ['%i calls replayed, %i mismatches' % (self.calls, len(self.mismatches))]
+        lines.extend(['    ' + m.kind + ': ' + m.message for m in self.mismatches])
+        return '\n'.join(lines)
+
+
+class ReplayBackend(evBackend.EchoviewBackend):
+    '''
+    ReplayBackend replays a trace file through the process's ReplaySession of
+    it, see ReplaySession for the arguments. The settings of the first
+    backend of a session apply to the whole session.
+    '''
+
+    def __init__(self, trace_file=None, reproduce_timing=None, latency_tolerance=0.5,
+            latency_factor=2.0, **kwargs):
+        self.traceFile = trace_file or os.environ.get(TRACE_FILE_ENV_VAR, 'ev_trace.jsonl')
+        if reproduce_timing is None:
+            reproduce_timing = os.environ.get(REPLAY_TIMING_ENV_VAR, '0') == '1'
+        self.session = _session('replay', self.traceFile, lambda: ReplaySession(self.traceFile,
+                reproduce_timing, latency_tolerance, latency_factor))
+
+    def _call(self, method, args, kwargs):
+        return self.session.call(method, args, kwargs)
+
+    @property
+    def mismatches(self):
+        return self.session.mismatches
+
+    def finish(self):
+        return self.session.finish()
+
+    def report(self):
+        return self.session.report()
+
+
+def replayUnits(trace_file, units, output_dir, log=print):
+    '''
+    replayUnits exports job board units (see jobBoard.JobBoard.post) in order
+    against a trace with one ReplayBackend and returns it, finished, so
+    report() has the mismatches. The outputs are written to output_dir
+    instead of the units' output directory, paths in it are compared as the
+    recorded paths.
+    '''
+    from EVFunctions import jobBoard
+
+    endSession(trace_file)
+    replay = ReplayBackend(trace_file)
+    for unit in units:
+        replay.session.pathMap = [(output_dir, unit['params']['output_dir_mb2'])]
+        unit = dict(unit, params=dict(unit['params'], output_dir_mb2=output_dir))
+        try:
+            jobBoard.exportUnit(unit, backend=replay, log=log)
+        except Exception as e:
+            log('Replaying ' + os.path.basename(unit['ev_file']) + ' failed: ' + str(e))
+    replay.finish()
+    endSession(trace_file)
+    return replay
+
+
+def loadTrace(trace_file):
+    '''
+    loadTrace reads a trace file and returns the list of call records
+    '''
+    records = []
+    with open(trace_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+def summarizeTrace(records):
+    '''
+    summarizeTrace returns a dict keyed by method of (calls, total duration) so
+    traces from two runs can be compared.
+    '''
+    summary = {}
+    for record in records:
+        calls, duration = summary.get(record['method'], (0, 0.0))
+        summary[record['method']] = (calls + 1, duration + record['duration'])
+    return summary
+
+
+def _makeMethod(name):
+    def method(self, *args, **kwargs):
+        return self._call(name, args, kwargs)
+    method.__name__ = name
+    return method
+
+
+#  both backends forward every method of the backend interface to _call
+for _name in [n for n in dir(evBackend.EchoviewBackend) if not n.startswith('_')]:
+    setattr(RecordingBackend, _name, _makeMethod(_name))
+    setattr(ReplayBackend, _name, _makeMethod(_name))
+del _name
+abc.update_abstractmethods(RecordingBackend)
+abc.update_abstractmethods(ReplayBackend)
+
+evBackend.registerBackend('record', RecordingBackend)
+evBackend.registerBackend('replay', ReplayBackend)
+
+
+if __name__ == "__main__":
+
+    import sys
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Compare Echoview backend call traces or replay a trace')
+    parser.add_argument("command", choices=['compare', 'replay'],
+            help="Compare call counts and time, or replay a trace against a job board's units.")
+    parser.add_argument("trace", help="The (baseline) trace file.")
+    parser.add_argument("other", nargs='?', help="compare: a trace to compare with the baseline. " +
+            "replay: the job board directory the trace was recorded from.")
+    parser.add_argument("--output-dir", default=None,
+            help="replay: the directory to write the outputs to, a temporary directory by default.")
+    args = parser.parse_args()
+
+    if args.command == 'replay':
+        from EVFunctions import jobBoard
+
+        if args.other is None:
+            parser.error('replay needs the job board directory')
+        outputDir = args.output_dir or tempfile.mkdtemp(prefix='ev_replay')
+        replay = replayUnits(args.trace, jobBoard.JobBoard(args.other).units(), outputDir,
+                log=lambda msg: None)
+        print(replay.report())
+        sys.exit(1 if replay.mismatches else 0)
+
+    baseline = summarizeTrace(loadTrace(args.trace))
+    other = summarizeTrace(loadTrace(args.other)) if args.other else {}
+    print('%-36s %10s %10s %10s %10s' % ('Method', 'Calls', 'Seconds', 'New calls', 'Seconds'))
+    for method in sorted(set(baseline) | set(other)):
+        bc, bd = baseline.get(method, (0, 0.0))
+        oc, od = other.get(method, (0, 0.0))
+        print('%-36s %10i %10.2f %10i %10.2f' % (method, bc, bd, oc, od))
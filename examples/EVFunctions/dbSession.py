@@ -0,0 +1,413 @@
+'''
+dbSession - a shared database session for EchoviewExport.py and EVFileMaker.py.
+
+Both apps used to create their own MaceFunctions dbConnection in
+applicationInit and build every statement as a string. On long sessions at
+sea the Oracle connection silently drops and the next query fails. A
+DBSession provides the same dbOpen/dbQuery/dbExec/close interface on top of
+a small pool of DB-API connections and adds:
+
+    - a pool of connections that worker threads check out and return
+    - a keepalive thread that pings idle connections so they don't time out
+    - transparent reconnect and retry when a connection has dropped
+    - bound parameters (qmark style, e.g. "WHERE ship=? AND survey=?") with a
+      per connection cursor cache, so repeated lookups reuse the same
+      statement instead of being hard parsed for every set of values
+    - dbTransaction, which runs a batch of statements in one transaction
+
+Sessions can't be shared across processes. getSession returns the session
+for the calling process, creating a new one in a child process.
+
+Production sessions connect to an ODBC data source with pyodbc. For testing
+without Oracle, sqliteFactory creates connections to a local SQLite database
+with the macebase2/clamsbase2 schemas attached and an Oracle style TO_CHAR
+function, so the apps' SQL runs unchanged:
+
+    session = dbSession.DBSession(factory=dbSession.sqliteFactory('test.sqlite'))
+
+As with dbConnection, query values are returned as strings (or None) unless
+the session is created with as_strings=False.
+'''
+
+import os
+import time
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+#  how long a checkout waits for a connection before checking the pool again
+CHECKOUT_WAIT = 1.0
+
+
+class DBError(Exception):
+    '''
+    DBError is raised for database errors. Like dbConnection.DBError the
+    message is available as the error attribute.
+    '''
+    def __init__(self, error):
+        super(DBError, self).__init__(error)
+        self.error = error
+
+
+class Query(object):
+    '''
+    Query holds the rows returned by DBSession.dbQuery. It can be iterated and
+    first() returns the first row (or a row of None if there are no rows).
+    '''
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def first(self):
+        if self.rows:
+            return self.rows[0]
+        return tuple([None] * len(self.columns))
+
+
+class _Connection(object):
+    '''
+    _Connection wraps a DB-API connection and caches a cursor per SQL statement
+    so a repeated statement isn't re-prepared.
+    '''
+    def __init__(self, connection, cursor_cache_size=32):
+        self.connection = connection
+        self.cursors = OrderedDict()
+        self.cursorCacheSize = cursor_cache_size
+        self.lastUsed = time.time()
+
+    def cursor(self, sql):
+        cursor = self.cursors.pop(sql, None)
+        if cursor is None:
+            cursor = self.connection.cursor()
+            if len(self.cursors) >= self.cursorCacheSize:
+                _, old = self.cursors.popitem(last=False)
+                try:
+                    old.close()
+                except Exception:
+                    pass
+        self.cursors[sql] = cursor
+        return cursor
+
+    def close(self):
+        for cursor in self.cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self.cursors.clear()
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+
+
+def odbcFactory(source, username, password, autocommit=True):
+    '''
+    odbcFactory returns a function that creates pyodbc connections to an ODBC
+    data source. pyodbc is only imported when a connection is made.
+    '''
+    def connect():
+        import pyodbc
+        return pyodbc.connect('DSN=' + str(source) + ';UID=' + str(username) + ';PWD=' +
+                str(password), autocommit=autocommit)
+    return connect
+
+
+def _toChar(value, format=None):
+    return None if value is None else str(value)
+
+
+def sqliteFactory(path, schemas=('macebase2', 'clamsbase2')):
+    '''
+    sqliteFactory returns a function that creates connections to a SQLite
+    database for testing. The database is attached once per schema name so
+    schema qualified table names work. A TO_CHAR function is provided.
+    '''
+    def connect():
+        connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        for schema in schemas:
+            connection.execute('ATTACH DATABASE ? AS ' + schema, (path,))
+        connection.create_function('TO_CHAR', 1, _toChar)
+        connection.create_function('TO_CHAR', 2, _toChar)
+        return connection
+    return connect
+
+
+class DBSession(object):
+    '''
+    DBSession provides dbOpen/dbQuery/dbExec/close on top of a pool of
+    connections. Either provide the ODBC source, username and password or a
+    factory function that returns a new DB-API connection.
+
+    pool_size is the maximum number of open connections, keepalive is the
+    interval in seconds at which idle connections are pinged (0 disables the
+    keepalive) and retries is the number of times a statement is retried on a
+    new connection when its connection has dropped.
+    '''
+
+    def __init__(self, source=None, username=None, password=None, label='', factory=None,
+            pool_size=4, keepalive=300, retries=2, retry_delay=2.0, ping_sql=None,
+            as_strings=True):
+        self.source = source
+        self.username = username
+        self.label = label
+        if factory is None:
+            factory = odbcFactory(source, username, password)
+            if ping_sql is None:
+                ping_sql = 'SELECT 1 FROM DUAL'
+        self.factory = factory
+        self.pingSql = ping_sql or 'SELECT 1'
+        self.poolSize = max(1, pool_size)
+        self.keepaliveInterval = keepalive
+        self.retries = retries
+        self.retryDelay = retry_delay
+        self.asStrings = as_strings
+
+        #  the schema names the apps store on their db object
+        self.bioSchema = 'clamsbase2'
+        self.acousticSchema = 'macebase2'
+
+        self.pid = os.getpid()
+        self.idle = queue.LifoQueue()
+        self.nOpen = 0
+        self.lock = threading.Lock()
+        self.closed = True
+        self.stopKeepalive = threading.Event()
+        self.keepaliveThread = None
+
+    def dbOpen(self):
+        '''
+        dbOpen opens the first connection, raising DBError if it fails, and
+        starts the keepalive thread.
+        '''
+        self.closed = False
+        self.stopKeepalive.clear()
+        try:
+            connection = self._checkout()
+        except DBError:
+            self.closed = True
+            raise
+        self._checkin(connection)
+        if self.keepaliveInterval and self.keepaliveThread is None:
+            self.keepaliveThread = threading.Thread(target=self._keepalive, daemon=True)
+            self.keepaliveThread.start()
+
+    def _connect(self):
+        try:
+            return _Connection(self.factory())
+        except Exception as e:
+            raise DBError(str(e))
+
+    def _checkout(self):
+        while True:
+            if self.closed:
+                raise DBError('The database session is closed.')
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                create = self.nOpen < self.poolSize
+                if create:
+                    self.nOpen += 1
+            if create:
+                try:
+                    return self._connect()
+                except DBError:
+                    with self.lock:
+                        self.nOpen -= 1
+                    raise
+            #  wait for a connection to be checked in. A connection that dropped is
+            #  discarded instead, freeing a slot, so keep checking for one.
+            try:
+                return self.idle.get(timeout=CHECKOUT_WAIT)
+            except queue.Empty:
+                pass
+
+    def _checkin(self, connection):
+        connection.lastUsed = time.time()
+        if self.closed:
+            self._discard(connection)
+        else:
+            self.idle.put(connection)
+
+    def _discard(self, connection):
+        connection.close()
+        with self.lock:
+            self.nOpen -= 1
+
+    def _alive(self, connection):
+        try:
+            cursor = connection.connection.cursor()
+            cursor.execute(self.pingSql)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _run(self, work):
+        '''
+        _run calls work(connection) with a pooled connection. If it fails and the
+        connection no longer responds, the connection is replaced and work is
+        retried.
+        '''
+        if os.getpid() != self.pid:
+            raise DBError('A database session can not be shared across processes.')
+        attempt = 0
+        while True:
+            try:
+                connection = self._checkout()
+            except DBError:
+                #  we couldn't reconnect, try again after a delay
+                attempt += 1
+                if self.closed or attempt > self.retries:
+                    raise
+                time.sleep(self.retryDelay * attempt)
+                continue
+
+            try:
+                result = work(connection)
+            except Exception as e:
+                if self._alive(connection):
+                    #  the connection is fine, this is a problem with the statement
+                    self._checkin(connection)
+                    raise DBError(str(e))
+                self._discard(connection)
+                attempt += 1
+                if attempt > self.retries:
+                    raise DBError('Lost the database connection: ' + str(e))
+                time.sleep(self.retryDelay * attempt)
+                continue
+
+            self._checkin(connection)
+            return result
+
+    def _execute(self, sql, params, fetch):
+        def work(connection):
+            cursor = connection.cursor(sql)
+            if params is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql, tuple(params))
+            if fetch:
+                columns = [d[0] for d in cursor.description] if cursor.description else []
+                return Query(columns, [self._convert(row) for row in cursor.fetchall()])
+            return cursor.rowcount
+        return self._run(work)
+
+    def _convert(self, row):
+        if not self.asStrings:
+            return tuple(row)
+        return tuple([None if v is None else str(v) for v in row])
+
+    def dbQuery(self, sql, params=None):
+        '''
+        dbQuery runs a query and returns a Query. params are bound to the ?
+        placeholders in the SQL.
+        '''
+        return self._execute(sql, params, True)
+
+    def dbExec(self, sql, params=None):
+        '''
+        dbExec runs a statement that doesn't return rows and returns the number
+        of rows affected. Statements are retried on a new connection if the
+        connection drops so they should be safe to repeat.
+        '''
+        return self._execute(sql, params, False)
+
+    def dbTransaction(self, statements):
+        '''
+        dbTransaction runs a list of (sql, params) statements in a single
+        transaction and returns the total number of rows affected. If any
+        statement fails nothing is committed. If the connection drops before
+        the commit the whole transaction is retried on a new connection.
+        '''
+        def work(connection):
+            raw = connection.connection
+            if isinstance(raw, sqlite3.Connection):
+                raw.execute('BEGIN')
+            else:
+                raw.autocommit = False
+            try:
+                count = 0
+                for sql, params in statements:
+                    cursor = connection.cursor(sql)
+                    cursor.execute(sql, tuple(params or ()))
+                    count += max(cursor.rowcount, 0)
+                raw.commit()
+                return count
+            except Exception:
+                try:
+                    raw.rollback()
+                except Exception:
+                    pass
+                raise
+            finally:
+                if not isinstance(raw, sqlite3.Connection):
+                    try:
+                        raw.autocommit = True
+                    except Exception:
+                        pass
+        return self._run(work)
+
+    def _keepalive(self):
+        while not self.stopKeepalive.wait(self.keepaliveInterval):
+            #  ping each idle connection that hasn't been used recently
+            keep = []
+            while True:
+                try:
+                    connection = self.idle.get_nowait()
+                except queue.Empty:
+                    break
+                if time.time() - connection.lastUsed < self.keepaliveInterval or self._alive(connection):
+                    keep.append(connection)
+                else:
+                    self._discard(connection)
+            for connection in keep:
+                self._checkin(connection)
+
+    def close(self):
+        '''
+        close stops the keepalive and closes all idle connections. Connections
+        that are checked out are closed when they are returned.
+        '''
+        self.closed = True
+        self.stopKeepalive.set()
+        self.keepaliveThread = None
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(connection)
+        with _sessionsLock:
+            for key in [k for k, s in _sessions.items() if s is self]:
+                del _sessions[key]
+
+
+#  sessions keyed by (pid, source, username, label)
+_sessions = {}
+_sessionsLock = threading.Lock()
+
+
+def getSession(source, username, password, label='', **kwargs):
+    '''
+    getSession returns the shared DBSession for the calling process, creating
+    it if needed. The session still has to be opened with dbOpen.
+    '''
+    key = (os.getpid(), source, username, label)
+    with _sessionsLock:
+        session = _sessions.get(key)
+        if session is None:
+            session = DBSession(source, username, password, label=label, **kwargs)
+            _sessions[key] = session
+        return session
@@ -0,0 +1,311 @@
+'''
+echoviewWatchdog - watches Echoview's memory and recycles it when it grows.
+
+The Exporter and EVFileMaker quit Echoview after every transect "just in
+case", because Echoview has been seen to leak memory over long sessions.
+That throws away the warm start: Echoview is started again and reloads its
+state for every transect. EchoviewWatchdog samples the resident memory and
+handle count (open file descriptors on Linux) of the Echoview process on a
+background thread while a transect is exported or built, so the usage can
+be logged per transect, and tells the caller to recycle Echoview only when a
+threshold is crossed:
+
+    watchdog = EchoviewWatchdog(max_rss_mb=3000, max_handles=20000)
+    watchdog.watch(ev, 't005')
+    ...export...
+    usage = watchdog.stop()
+    log(formatUsage(usage))
+    if not watchdog.enabled or watchdog.recycleReason(usage):
+        ev.quit()
+
+With no thresholds set the watchdog is disabled and callers keep quitting
+after every transect. psutil is used if it is installed. Otherwise the
+process is read from /proc on Linux and with the Win32 API on Windows. The
+process is found by name (Echoview.exe) unless the backend has a processId
+method, as the stand-in backend does when EV_STANDIN_PROCESS is set, which
+is how the watchdog can be tried out on Linux:
+
+    EV_STANDIN_PROCESS=50 python -m EVFunctions.echoviewWatchdog --max-rss-mb 200
+'''
+
+import os
+import sys
+import time
+import threading
+import subprocess
+from collections import namedtuple
+
+
+#  the image name of the Echoview process
+ECHOVIEW_PROCESS_NAME = 'Echoview.exe'
+
+#  one sample of a process. rss is in bytes, handles is None if it can't be read
+ProcessSample = namedtuple('ProcessSample', ['time', 'rss', 'handles'])
+
+#  the usage of the process while a transect was exported or built
+Usage = namedtuple('Usage', ['name', 'pid', 'samples', 'start', 'peak_rss', 'peak_handles', 'end', 'seconds'])
+
+
+def findProcesses(name):
+    '''
+    findProcesses returns the ids of the running processes with an image name
+    '''
+    try:
+        import psutil
+        return [p.pid for p in psutil.process_iter(['name']) if (p.info['name'] or '').lower() == name.lower()]
+    except ImportError:
+        pass
+    if sys.platform == 'win32':
+        output = subprocess.run(['tasklist', '/FI', 'IMAGENAME eq ' + name, '/FO', 'CSV', '/NH'],
+                capture_output=True, text=True, creationflags=0x08000000).stdout
+        pids = []
+        for line in output.splitlines():
+            fields = [f.strip('"') for f in line.split('","')]
+            if len(fields) > 1 and fields[0].lower() == name.lower():
+                pids.append(int(fields[1]))
+        return pids
+    pids = []
+    #  /proc/<pid>/comm is truncated to 15 characters
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open('/proc/' + entry + '/comm', 'r') as f:
+                    if f.read().strip() == name[:15]:
+                        pids.append(int(entry))
+            except (IOError, OSError):
+                continue
+    return pids
+
+
+def _sampleWindows(pid):
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+    #  PROCESS_QUERY_LIMITED_INFORMATION | PROCESS_VM_READ
+    handle = kernel32.OpenProcess(0x1000 | 0x0010, False, pid)
+    if not handle:
+        return None
+    try:
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if not ctypes.WinDLL('psapi').GetProcessMemoryInfo(wintypes.HANDLE(handle), ctypes.byref(counters),
+                counters.cb):
+            return None
+        count = wintypes.DWORD()
+        handles = None
+        if kernel32.GetProcessHandleCount(wintypes.HANDLE(handle), ctypes.byref(count)):
+            handles = count.value
+        return ProcessSample(time.time(), counters.WorkingSetSize, handles)
+    finally:
+        kernel32.CloseHandle(wintypes.HANDLE(handle))
+
+
+def sampleProcess(pid):
+    '''
+    sampleProcess returns a ProcessSample of a process or None if it isn't running
+    '''
+    try:
+        import psutil
+        try:
+            process = psutil.Process(pid)
+            rss = process.memory_info().rss
+            if hasattr(process, 'num_handles'):
+                handles = process.num_handles()
+            else:
+                handles = process.num_fds()
+            return ProcessSample(time.time(), rss, handles)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return None
+    except ImportError:
+        pass
+    if sys.platform == 'win32':
+        return _sampleWindows(pid)
+    try:
+        rss = None
+        with open('/proc/' + str(pid) + '/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+        try:
+            handles = len(os.listdir('/proc/' + str(pid) + '/fd'))
+        except OSError:
+            handles = None
+        if rss is None:
+            return None
+        return ProcessSample(time.time(), rss, handles)
+    except (IOError, OSError):
+        return None
+
+
+def backendProcessId(backend, process_name=ECHOVIEW_PROCESS_NAME):
+    '''
+    backendProcessId returns the id of the Echoview process a backend drives,
+    or None if it can't be found. Wrapping backends (MeteredBackend,
+    RecordingBackend) keep the backend they wrap in their backend attribute.
+    '''
+    while getattr(backend, 'backend', None) is not None:
+        backend = backend.backend
+    processId = getattr(backend, 'processId', None)
+    if processId is not None:
+        return processId()
+    pids = findProcesses(process_name)
+    return pids[0] if pids else None
+
+
+def formatUsage(usage):
+    '''
+    formatUsage returns a one line description of a Usage
+    '''
+    if usage is None or usage.end is None:
+        return 'Echoview memory: the Echoview process could not be sampled'
+    mb = lambda value: str(int(round(value / 1048576.0))) + ' MB'
+    text = 'Echoview memory after ' + str(usage.name) + ': ' + mb(usage.end.rss) + ' resident (peak ' + \
+            mb(usage.peak_rss)
+    if usage.start is not None:
+        change = usage.end.rss - usage.start.rss
+        text += ', ' + ('+' if change >= 0 else '-') + mb(abs(change))
+    text += ')'
+    if usage.end.handles is not None:
+        text += ', ' + str(usage.end.handles) + ' handles (peak ' + str(usage.peak_handles) + ')'
+    return text
+
+
+class EchoviewWatchdog(object):
+    '''
+    EchoviewWatchdog samples the Echoview process every interval seconds
+    between watch and stop. max_rss_mb and max_handles are the recycle
+    thresholds, 0 or None to not use one. The watchdog is enabled if either
+    is set.
+    '''
+
+    def __init__(self, max_rss_mb=None, max_handles=None, interval=2.0, process_name=ECHOVIEW_PROCESS_NAME):
+        self.maxRss = int(float(max_rss_mb) * 1048576) if max_rss_mb else None
+        self.maxHandles = int(max_handles) if max_handles else None
+        self.interval = interval
+        self.processName = process_name
+        self.name = None
+        self.pid = None
+        self.samples = []
+        self.started = None
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    @property
+    def enabled(self):
+        return self.maxRss is not None or self.maxHandles is not None
+
+    def watch(self, backend, name):
+        '''
+        watch starts sampling the process of a started backend for the named
+        transect. A watch that is still running is stopped first.
+        '''
+        if self.thread is not None:
+            self.stop()
+        self.name = name
+        self.samples = []
+        self.started = time.time()
+        try:
+            self.pid = backendProcessId(backend, self.processName)
+        except (IOError, OSError):
+            self.pid = None
+        if self.pid is None:
+            return
+        self._sample()
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=self._run, name='echoview-watchdog', daemon=True)
+        self.thread.start()
+
+    def _sample(self):
+        sample = sampleProcess(self.pid)
+        if sample is not None:
+            with self.lock:
+                self.samples.append(sample)
+        return sample
+
+    def _run(self):
+        while not self.stopEvent.wait(self.interval):
+            if self._sample() is None:
+                #  the process has gone
+                break
+
+    def stop(self):
+        '''
+        stop takes a last sample, stops sampling and returns the Usage, or
+        None if nothing was watched
+        '''
+        if self.started is None:
+            return None
+        if self.thread is not None:
+            self.stopEvent.set()
+            self.thread.join()
+            self.thread = None
+        if self.pid is not None:
+            self._sample()
+        with self.lock:
+            samples = list(self.samples)
+        self.started, started = None, self.started
+        if not samples:
+            return Usage(self.name, self.pid, 0, None, None, None, None, time.time() - started)
+        handles = [s.handles for s in samples if s.handles is not None]
+        return Usage(self.name, self.pid, len(samples), samples[0], max([s.rss for s in samples]),
+                max(handles) if handles else None, samples[-1], time.time() - started)
+
+    def recycleReason(self, usage):
+        '''
+        recycleReason returns why Echoview should be recycled after a transect,
+        or None if it can be kept running
+        '''
+        if usage is None or usage.end is None:
+            return None
+        if self.maxRss is not None and usage.end.rss >= self.maxRss:
+            return 'resident memory ' + str(usage.end.rss // 1048576) + ' MB has reached the ' + \
+                    str(self.maxRss // 1048576) + ' MB limit'
+        if self.maxHandles is not None and usage.end.handles is not None and \
+                usage.end.handles >= self.maxHandles:
+            return 'handle count ' + str(usage.end.handles) + ' has reached the limit of ' + str(self.maxHandles)
+        return None
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from EVFunctions import evBackend
+
+    parser = argparse.ArgumentParser(description='Open EV files with a backend and show when the ' +
+            'watchdog would recycle Echoview')
+    parser.add_argument("files", nargs='*', help="EV files to open. The stand-in backend opens any path.")
+    parser.add_argument("--backend", default='standin', help="The Echoview backend.")
+    parser.add_argument("-n", "--transects", type=int, default=10, help="The number of transects without files.")
+    parser.add_argument("--max-rss-mb", type=float, default=None, help="The resident memory limit in MB.")
+    parser.add_argument("--max-handles", type=int, default=None, help="The handle count limit.")
+    parser.add_argument("--interval", type=float, default=0.5, help="The sampling interval in seconds.")
+    args = parser.parse_args()
+
+    watchdog = EchoviewWatchdog(args.max_rss_mb, args.max_handles, args.interval)
+    files = args.files or [__file__] * args.transects
+    ev = evBackend.getBackend(args.backend)
+    for i, path in enumerate(files):
+        if not ev.start():
+            print('No Scripting Module Found')
+            break
+        watchdog.watch(ev, 'transect ' + str(i + 1))
+        ev.closeFile(ev.openFile(path))
+        usage = watchdog.stop()
+        print(formatUsage(usage))
+        reason = watchdog.recycleReason(usage)
+        if not watchdog.enabled or reason:
+            if reason:
+                print('Recycling Echoview: ' + reason)
+            ev.quit()
+    ev.quit()
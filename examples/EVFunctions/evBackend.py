@@ -0,0 +1,372 @@
+'''
+evBackend - a small interface to Echoview shared by EchoviewExport.py and
+            EVFileMaker.py.
+
+Both tools used to call win32com.client.Dispatch inline and then talk to the
+raw COM objects throughout their methods. They now talk to an EchoviewBackend
+which covers the operations they use: opening, creating, saving and closing
+files, filesets and calibration, variables and their grid/analysis
+properties, lines, regions, import and export. File, fileset, variable and
+line objects returned by a backend are opaque handles that are only ever
+passed back to the same backend.
+
+Win32ComBackend is the production implementation. Other implementations
+(pooled, remote, tracing or fake backends for testing) are registered with
+registerBackend and selected by name with getBackend, so they can be layered
+on without touching the export and build logic.
+'''
+
+import os
+import abc
+import importlib
+
+
+#  the environment variable that can be used to select a backend
+BACKEND_ENV_VAR = 'EV_BACKEND'
+
+#  the default backend
+DEFAULT_BACKEND = 'win32com'
+
+#  registered backend classes keyed by name
+_backends = {}
+
+#  modules that register additional backends when they are imported
+_backendModules = {'record': 'EVFunctions.comTrace', 'replay': 'EVFunctions.comTrace',
+        'standin': 'EVFunctions.standInBackend'}
+
+
+class EchoviewBackend(abc.ABC):
+    '''
+    EchoviewBackend defines the operations the Exporter and EVFileMaker use.
+    Subclasses must implement all of them, a backend that doesn't can't be
+    created.
+    '''
+
+    #  application
+    @abc.abstractmethod
+    def start(self):
+        '''
+        start starts (or connects to) Echoview, minimizes it and returns True if
+        the scripting module is licensed. If it isn't, Echoview is shut down and
+        False is returned.
+        '''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def quit(self):
+        raise NotImplementedError
+
+    #  files
+    @abc.abstractmethod
+    def openFile(self, path):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def newFile(self, template):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def saveFileAs(self, evFile, path):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def closeFile(self, evFile):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def preReadDataFiles(self, evFile):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def addDataPath(self, evFile, path):
+        raise NotImplementedError
+
+    #  filesets and calibration
+    @abc.abstractmethod
+    def findFileset(self, evFile, name):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def addDataFile(self, evFile, path, fileset_index=0):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def setCalibrationFile(self, fileset, path):
+        '''
+        setCalibrationFile returns True if the calibration file was set
+        '''
+        raise NotImplementedError
+
+    #  variables
+    @abc.abstractmethod
+    def findVariable(self, evFile, name):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def listVariables(self, evFile):
+        '''
+        listVariables returns a list of (name, variable) tuples for all variables in the file
+        '''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def setThresholds(self, evVar, apply_min, min_value=None, apply_max=0, max_value=None):
+        '''
+        setThresholds sets the minimum/maximum threshold flags and, if applied,
+        the values.
+        '''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def setTimeDistanceGrid(self, evVar, grid_class, length):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def setDepthRangeGrid(self, evVar, mode, thickness):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def setDepthRangeReferenceLine(self, evVar, evLine):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def setExcludeAboveLine(self, evVar, name):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def setExcludeBelowLine(self, evVar, name):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def enableExportVariables(self, evFile, names):
+        raise NotImplementedError
+
+    #  lines
+    @abc.abstractmethod
+    def findLine(self, evFile, name):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def listLines(self, evFile):
+        '''
+        listLines returns a list of (name, line) tuples for all lines in the file
+        '''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def createOffsetLinear(self, evFile, evLine, multiplier, offset, span_gaps=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def createFixedDepth(self, evFile, depth):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def overwriteLine(self, evLine, source):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def deleteLine(self, evFile, evLine):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def renameLine(self, evLine, name):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def isLineEditable(self, evLine):
+        raise NotImplementedError
+
+    #  import and export
+    @abc.abstractmethod
+    def importFile(self, evFile, path):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def exportRegionsLog(self, evVar, path):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def exportIntegrationByRegionsByCells(self, evVar, path):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def exportLine(self, evVar, evLine, path, start_ping=-1, end_ping=-1):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def exportRegionDefinitions(self, evFile, path):
+        raise NotImplementedError
+
+
+class Win32ComBackend(EchoviewBackend):
+    '''
+    Win32ComBackend talks to Echoview through the EchoviewCom COM interface
+    using pywin32. win32com is only imported when the backend is started.
+    '''
+
+    PROG_ID = 'EchoviewCom.EvApplication'
+
+    def __init__(self, prog_id=None):
+        self.progId = prog_id or self.PROG_ID
+        self.evApp = None
+
+    def start(self):
+        import pythoncom
+        import win32com.client
+        #  COM has to be initialized on each thread that uses it
+        pythoncom.CoInitialize()
+        self.evApp = win32com.client.Dispatch(self.progId)
+        if self.evApp.IsLicensed() == 0:
+            self.evApp.Quit()
+            self.evApp = None
+            return False
+        self.evApp.Minimize()
+        return True
+
+    def quit(self):
+        if self.evApp is not None:
+            self.evApp.Quit()
+            self.evApp = None
+
+    def openFile(self, path):
+        return self.evApp.OpenFile(path)
+
+    def newFile(self, template):
+        return self.evApp.NewFile(template)
+
+    def saveFileAs(self, evFile, path):
+        return evFile.SaveAs(path)
+
+    def closeFile(self, evFile):
+        return self.evApp.CloseFile(evFile)
+
+    def preReadDataFiles(self, evFile):
+        return evFile.PreReadDataFiles()
+
+    def addDataPath(self, evFile, path):
+        return evFile.Properties.DataPaths.Add(path)
+
+    def findFileset(self, evFile, name):
+        return evFile.Filesets.FindByName(name)
+
+    def addDataFile(self, evFile, path, fileset_index=0):
+        return evFile.Filesets.Item(fileset_index).DataFiles.Add(path)
+
+    def setCalibrationFile(self, fileset, path):
+        return fileset.SetCalibrationFile(path) == 1
+
+    def findVariable(self, evFile, name):
+        return evFile.Variables.FindByName(name)
+
+    def listVariables(self, evFile):
+        variables = []
+        for ind in range(0, evFile.Variables.Count):
+            evVar = evFile.Variables.Item(ind)
+            variables.append((evVar.Name, evVar))
+        return variables
+
+    def setThresholds(self, evVar, apply_min, min_value=None, apply_max=0, max_value=None):
+        data = evVar.Properties.Data
+        data.ApplyMinimumThreshold = apply_min
+        if apply_min == 1 and min_value is not None:
+            data.MinimumThreshold = min_value
+        data.ApplyMaximumThreshold = apply_max
+        if apply_max == 1 and max_value is not None:
+            data.MaximumThreshold = max_value
+
+    def setTimeDistanceGrid(self, evVar, grid_class, length):
+        return evVar.Properties.Grid.SetTimeDistanceGrid(grid_class, length)
+
+    def setDepthRangeGrid(self, evVar, mode, thickness):
+        return evVar.Properties.Grid.SetDepthRangeGrid(mode, thickness)
+
+    def setDepthRangeReferenceLine(self, evVar, evLine):
+        evVar.Properties.Grid.DepthRangeReferenceLine = evLine
+
+    def setExcludeAboveLine(self, evVar, name):
+        evVar.Properties.Analysis.ExcludeAboveLine = name
+
+    def setExcludeBelowLine(self, evVar, name):
+        evVar.Properties.Analysis.ExcludeBelowLine = name
+
+    def enableExportVariables(self, evFile, names):
+        for name in names:
+            evFile.Properties.Export.Variables.Item(name).Enabled = 1
+
+    def findLine(self, evFile, name):
+        return evFile.Lines.FindByName(name)
+
+    def listLines(self, evFile):
+        lines = []
+        for ind in range(0, evFile.Lines.Count):
+            evLine = evFile.Lines(ind)
+            lines.append((evLine.Name, evLine))
+        return lines
+
+    def createOffsetLinear(self, evFile, evLine, multiplier, offset, span_gaps=None):
+        if span_gaps is None:
+            return evFile.Lines.CreateOffsetLinear(evLine, multiplier, offset)
+        return evFile.Lines.CreateOffsetLinear(evLine, multiplier, offset, span_gaps)
+
+    def createFixedDepth(self, evFile, depth):
+        return evFile.Lines.CreateFixedDepth(depth)
+
+    def overwriteLine(self, evLine, source):
+        return evLine.OverwriteWith(source)
+
+    def deleteLine(self, evFile, evLine):
+        return evFile.Lines.Delete(evLine)
+
+    def renameLine(self, evLine, name):
+        evLine.Name = name
+
+    def isLineEditable(self, evLine):
+        return bool(evLine.AsLineEditable())
+
+    def importFile(self, evFile, path):
+        return evFile.Import(path)
+
+    def exportRegionsLog(self, evVar, path):
+        return evVar.ExportRegionsLogAll(path)
+
+    def exportIntegrationByRegionsByCells(self, evVar, path):
+        return evVar.ExportIntegrationByRegionsByCellsAll(path)
+
+    def exportLine(self, evVar, evLine, path, start_ping=-1, end_ping=-1):
+        return evVar.ExportLine(evLine, path, start_ping, end_ping)
+
+    def exportRegionDefinitions(self, evFile, path):
+        return evFile.Regions.ExportDefinitionsAll(path)
+
+
+def registerBackend(name, backend_class):
+    '''
+    registerBackend makes a backend class available to getBackend by name
+    '''
+    _backends[name] = backend_class
+
+
+def backendNames():
+    return sorted(_backends.keys())
+
+
+def getBackend(name=None, **kwargs):
+    '''
+    getBackend returns a new backend instance. The backend is selected by name,
+    then by the EV_BACKEND environment variable and finally defaults to win32com.
+    Keyword arguments are passed to the backend's constructor.
+    '''
+    if not name:
+        name = os.environ.get(BACKEND_ENV_VAR, DEFAULT_BACKEND)
+    if name not in _backends and name in _backendModules:
+        importlib.import_module(_backendModules[name])
+    try:
+        backend_class = _backends[name]
+    except KeyError:
+        raise ValueError('Unknown Echoview backend "' + str(name) + '". Available backends are: ' +
+                ', '.join(backendNames()))
+    return backend_class(**kwargs)
+
+
+registerBackend('win32com', Win32ComBackend)
@@ -0,0 +1,107 @@
+'''
+evRegistry - name lookups for the lines and variables of an open EV file.
+
+export_py_MB2 looks up the same lines and variables by name over and over:
+the reference line once per zone per variable and each exclusion line for
+every zone, every lookup a COM round trip to Lines.FindByName or
+Variables.FindByName. For non-surface references it also called
+Lines.CreateOffsetLinear once per zone, adding another "-offset" line to the
+file for every zone.
+
+An EvRegistry enumerates the file's lines and variables once after the file
+is opened and then resolves names from dictionaries, falling back to the
+backend for names it hasn't seen (lines imported later, for example).
+offsetLine() memoises the derived offset lines by (source line, multiplier,
+offset) for the session, reusing a line of the same name if the file already
+has one, and the registry tracks the lines it created so they can be
+excluded from exports.
+'''
+
+
+class EvRegistry(object):
+    '''
+    EvRegistry caches the line and variable objects of an open EV file. ev is
+    an evBackend backend and evFile the open file.
+    '''
+
+    def __init__(self, ev, evFile):
+        self.ev = ev
+        self.evFile = evFile
+        #  lines are kept in file order for listLines
+        self.lineNames = []
+        self.lines = {}
+        self.variables = {}
+        self.offsetLines = {}
+        self.created = []
+        for name, evLine in ev.listLines(evFile):
+            self._addLine(name, evLine)
+        for name, evVar in ev.listVariables(evFile):
+            self.variables[name] = evVar
+
+    def _addLine(self, name, evLine):
+        if name not in self.lines:
+            self.lineNames.append(name)
+        self.lines[name] = evLine
+
+    def line(self, name):
+        '''
+        line returns the line with the given name or None if the file doesn't
+        have one
+        '''
+        name = str(name)
+        if name in self.lines:
+            return self.lines[name]
+        evLine = self.ev.findLine(self.evFile, name)
+        if evLine:
+            self._addLine(name, evLine)
+        return evLine
+
+    def variable(self, name):
+        '''
+        variable returns the variable with the given name or None if the file
+        doesn't have one
+        '''
+        name = str(name)
+        if name in self.variables:
+            return self.variables[name]
+        evVar = self.ev.findVariable(self.evFile, name)
+        if evVar:
+            self.variables[name] = evVar
+        return evVar
+
+    def listLines(self):
+        '''
+        listLines returns (name, line) tuples for the lines in the file
+        '''
+        return [(name, self.lines[name]) for name in self.lineNames]
+
+    def offsetLine(self, source, offset, multiplier=1, span_gaps=None, name=None):
+        '''
+        offsetLine returns a linear offset of the named source line, creating
+        it the first time it is asked for. The new line is named
+        "<source>-offset<offset>" unless a name is given. Returns None if the
+        source line doesn't exist.
+        '''
+        source = str(source)
+        key = (source, multiplier, offset, span_gaps)
+        if key in self.offsetLines:
+            return self.offsetLines[key]
+        if name is None:
+            name = source + '-offset' + str(offset)
+        evLine = self.lines.get(name)
+        if evLine is None:
+            sourceLine = self.line(source)
+            if not sourceLine:
+                return None
+            evLine = self.ev.createOffsetLinear(self.evFile, sourceLine, multiplier, offset, span_gaps)
+            self.ev.renameLine(evLine, name)
+            self._addLine(name, evLine)
+            self.created.append(name)
+        self.offsetLines[key] = evLine
+        return evLine
+
+    def isCreated(self, name):
+        '''
+        isCreated returns True if the registry created the named line
+        '''
+        return name in self.created
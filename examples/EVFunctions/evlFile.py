@@ -0,0 +1,252 @@
+'''
+evlFile - streaming reader for Echoview EVL (line) files and local validation
+          of exported Lines/Regions trees before they are imported.
+
+EVFileMaker imports every .evl and .evr file it finds for a transect and then
+uses FindByName to find out if anything was actually imported. Empty or
+malformed files (which apparently happen) each cost a round trip to Echoview.
+The functions here check the files locally so bad ones can be skipped without
+touching Echoview.
+
+EVL layout:
+
+    EVBD 3 <echoview version>
+    <number of points>
+    <date> <time> <depth> <status>
+    ...
+
+Dates are YYYYMMDD and times are HHmmssssss (tenths of a millisecond).
+'''
+
+import os
+import glob
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from EVFunctions import evrFile
+
+
+#  result of validating a single file. kind is 'line' or 'region', name is the
+#  line name Echoview will assign to an imported .evl file, count is the number
+#  of points (lines) or regions read and problems is a list of strings. A file
+#  is ok to import if problems is empty.
+Validation = namedtuple('Validation', ['path', 'kind', 'name', 'count', 'start', 'end', 'problems'])
+
+
+class EVLError(Exception):
+    '''
+    EVLError is raised when an EVL file can't be parsed
+    '''
+    def __init__(self, msg, line_number=None):
+        self.error = msg
+        self.line_number = line_number
+        if line_number is not None:
+            msg = 'line ' + str(line_number) + ': ' + msg
+        super(EVLError, self).__init__(msg)
+
+
+def importedLineName(path):
+    '''
+    importedLineName returns the name Echoview gives a line imported from path.
+    Echoview strips the path and the '.evl' and, if there is a decimal in the
+    name, only uses the string before the decimal (it assumes that's the
+    extension).
+    '''
+    name = os.path.basename(path.replace('\\', os.sep))
+    if name.lower().endswith('.evl'):
+        name = name[:-4]
+    return name.split('.')[0]
+
+
+def iterEVL(f):
+    '''
+    iterEVL is a generator that parses an open EVL file (or any iterable of lines)
+    and yields (datetime, depth, status) tuples as they are read. The first item
+    yielded is a tuple (header, point_count) so callers can check the declared
+    count. Raises EVLError if the file is malformed.
+    '''
+    lineNo = 0
+    lines = iter(f)
+
+    try:
+        header = next(lines).strip()
+        lineNo += 1
+    except StopIteration:
+        raise EVLError('file is empty', lineNo)
+    if not header.startswith('EVBD'):
+        raise EVLError('not an EVL file (missing EVBD header)', lineNo)
+    try:
+        count = int(next(lines).strip())
+        lineNo += 1
+    except (StopIteration, ValueError):
+        raise EVLError('invalid point count', lineNo + 1)
+    yield (header, count)
+
+    for line in lines:
+        lineNo += 1
+        tokens = line.split()
+        if not tokens:
+            continue
+        if len(tokens) < 3:
+            raise EVLError('invalid point', lineNo)
+        try:
+            t = evrFile.parseEvrDateTime(tokens[0], tokens[1])
+            depth = float(tokens[2])
+            status = int(tokens[3]) if len(tokens) > 3 else 0
+        except ValueError:
+            raise EVLError('invalid point', lineNo)
+        yield (t, depth, status)
+
+
+def validateEVL(path, time_range=None):
+    '''
+    validateEVL checks an EVL file without loading it into memory. It checks
+    that the file parses, contains at least one point, that the declared and
+    actual point counts match and that the point times increase. If time_range
+    is provided as a (start, end) tuple of datetimes, lines that lie entirely
+    outside of it are flagged.
+    '''
+    problems = []
+    count = 0
+    start = None
+    end = None
+    declared = None
+    name = importedLineName(path)
+
+    try:
+        with open(path, 'r') as f:
+            parser = iterEVL(f)
+            header, declared = next(parser)
+            last = None
+            for t, depth, status in parser:
+                if last is not None and t < last:
+                    problems.append('point times are not increasing at point ' + str(count + 1))
+                    break
+                if start is None:
+                    start = t
+                last = t
+                end = t
+                count += 1
+    except EVLError as e:
+        problems.append(str(e))
+    except (OSError, UnicodeDecodeError) as e:
+        problems.append('unable to read file: ' + str(e))
+
+    if not problems:
+        if count == 0:
+            problems.append('file contains no points')
+        elif declared != count:
+            problems.append('header declares ' + str(declared) + ' points but file contains ' +
+                    str(count))
+    if not name:
+        problems.append('file name does not produce a valid line name')
+    if not problems and time_range is not None:
+        if end < time_range[0] or start > time_range[1]:
+            problems.append('line lies outside of the transect time span')
+
+    return Validation(path, 'line', name, count, start, end, problems)
+
+
+def validateEVR(path, time_range=None):
+    '''
+    validateEVR checks an EVR file in the same way validateEVL checks line files.
+    It checks that the file parses, contains at least one region and that the
+    declared region count matches.
+    '''
+    problems = []
+    count = 0
+    start = None
+    end = None
+    declared = None
+
+    try:
+        with open(path, 'r', newline='') as f:
+            parser = evrFile.iterEVR(f)
+            header, declared = next(parser)
+            for region in parser:
+                times = [p[0] for p in region.points]
+                if times:
+                    start = min(times) if start is None else min(start, min(times))
+                    end = max(times) if end is None else max(end, max(times))
+                count += 1
+    except evrFile.EVRError as e:
+        problems.append(str(e))
+    except (OSError, UnicodeDecodeError) as e:
+        problems.append('unable to read file: ' + str(e))
+
+    if not problems:
+        if count == 0:
+            problems.append('file contains no regions')
+        elif declared != count:
+            problems.append('header declares ' + str(declared) + ' regions but file contains ' +
+                    str(count))
+    if not problems and time_range is not None and start is not None:
+        if end < time_range[0] or start > time_range[1]:
+            problems.append('regions lie outside of the transect time span')
+
+    return Validation(path, 'region', None, count, start, end, problems)
+
+
+def validateFile(path, time_range=None):
+    '''
+    validateFile validates a .evl or .evr file based on its extension
+    '''
+    if path.lower().endswith('.evr'):
+        return validateEVR(path, time_range=time_range)
+    else:
+        return validateEVL(path, time_range=time_range)
+
+
+def validateFiles(paths, time_range=None, workers=8):
+    '''
+    validateFiles validates a list of line and region files in parallel and
+    returns a list of Validation tuples in the same order as paths.
+    '''
+    paths = list(paths)
+    if len(paths) < 2 or workers < 2:
+        return [validateFile(path, time_range=time_range) for path in paths]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda p: validateFile(p, time_range=time_range), paths))
+
+
+def validateTree(root, workers=8):
+    '''
+    validateTree validates every file in the Lines and Regions directories below
+    root (the directory the Exporter writes to) and returns a list of Validation
+    tuples.
+    '''
+    root = os.path.normpath(str(root))
+    paths = (sorted(glob.glob(os.path.join(root, 'Lines', '*.evl'))) +
+            sorted(glob.glob(os.path.join(root, 'Regions', '*.evr'))))
+    return validateFiles(paths, workers=workers)
+
+
+def formatReport(results, show_ok=False):
+    '''
+    formatReport returns a text report for a list of Validation tuples
+    '''
+    lines = []
+    bad = 0
+    for r in results:
+        if r.problems:
+            bad += 1
+            lines.append('BAD  ' + r.path + ': ' + '; '.join(r.problems))
+        elif show_ok:
+            lines.append('OK   ' + r.path + ' (' + str(r.count) + ' ' +
+                    ('points' if r.kind == 'line' else 'regions') + ', ' + str(r.start) +
+                    ' to ' + str(r.end) + ')')
+    lines.append(str(len(results)) + ' files checked, ' + str(bad) + ' with problems')
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Validate exported Lines/Regions files')
+    parser.add_argument("root", help="The directory containing the Lines and Regions directories.")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="Number of files to check in parallel.")
+    parser.add_argument("-v", "--verbose", action='store_true', help="List the files that passed as well.")
+    args = parser.parse_args()
+
+    print(formatReport(validateTree(args.root, workers=args.workers), show_ok=args.verbose))
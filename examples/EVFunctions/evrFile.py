@@ -0,0 +1,305 @@
+'''
+evrFile - pure python writer and streaming parser for Echoview EVR (region
+          definition) files.
+
+EVFileMaker used to write its transect marker regions one token at a time
+through a QTextStream into a temp file on the destination share. Here the
+complete file is built in memory and written with a single call, so files for
+many transects (or one file holding an entire survey) can be produced without
+any per-token I/O. The parser reads a file line by line and yields regions as
+it goes so round trips can be checked on survey sized files.
+
+EVR layout (Echoview region file version 13):
+
+    EVRG 7 <echoview version>
+    <number of regions>
+    <blank>
+    13 <n points> <id> 0 <creation type> -1 1 <left date> <left time> <top> <right date> <right time> <bottom>
+    <n note lines>
+    <note lines...>
+    <n detection setting lines>
+    <detection setting lines...>
+    <classification>
+    <date time depth triplets for each point> <region type>
+    <region name>
+    <blank>
+
+Dates are YYYYMMDD and times are HHmmssssss (tenths of a millisecond).
+'''
+
+import os
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+
+#  the EVRG header used by EVFileMaker
+EVRG_HEADER = 'EVRG 7 7.1.34.30284'
+
+#  region file version written in each region header
+REGION_VERSION = 13
+
+#  region types
+REGION_TYPE_BAD = 0
+REGION_TYPE_ANALYSIS = 1
+REGION_TYPE_MARKER = 2
+
+#  the depth used for the top and bottom of time-only regions
+MAX_DEPTH = 9999.99
+
+#  Echoview uses CRLF line endings
+EOL = '\r\n'
+
+#  the default width of our event marker regions in milliseconds
+MARKER_WIDTH_MS = 1003
+
+#  points are (datetime, depth) tuples
+Region = namedtuple('Region', ['id', 'name', 'classification', 'region_type', 'notes',
+        'detection_settings', 'points', 'creation_type'])
+
+
+class EVRError(Exception):
+    '''
+    EVRError is raised when an EVR file can't be parsed
+    '''
+    def __init__(self, msg, line_number=None):
+        self.error = msg
+        self.line_number = line_number
+        if line_number is not None:
+            msg = 'line ' + str(line_number) + ': ' + msg
+        super(EVRError, self).__init__(msg)
+
+
+def evrDate(t):
+    '''
+    evrDate returns the EVR YYYYMMDD date string for a datetime
+    '''
+    return t.strftime('%Y%m%d')
+
+
+def evrTime(t):
+    '''
+    evrTime returns the EVR HHmmssssss time string (tenths of a ms) for a datetime
+    '''
+    return t.strftime('%H%M%S') + '%04i' % (t.microsecond // 100)
+
+
+def parseEvrDateTime(date_str, time_str):
+    '''
+    parseEvrDateTime converts EVR date and time strings to a datetime
+    '''
+    t = datetime.strptime(date_str + time_str[:6], '%Y%m%d%H%M%S')
+    if len(time_str) > 6:
+        t = t.replace(microsecond=int(time_str[6:10].ljust(4, '0')) * 100)
+    return t
+
+
+def markerRegion(region_id, name, event_time, width_ms=MARKER_WIDTH_MS, note=None,
+        classification='Unclassified'):
+    '''
+    markerRegion returns a full depth marker Region starting at event_time that
+    is width_ms wide. This is what EVFileMaker uses to mark transect events.
+    '''
+    end_time = event_time + timedelta(milliseconds=width_ms)
+    points = [(event_time, -MAX_DEPTH), (event_time, MAX_DEPTH),
+            (end_time, MAX_DEPTH), (end_time, -MAX_DEPTH)]
+    if note is None:
+        note = name
+    return Region(region_id, name, classification, REGION_TYPE_MARKER, [note], [],
+            points, 6)
+
+
+def eventRegions(rows, time_format='%m/%d/%Y %H:%M:%S.%f', start_id=1):
+    '''
+    eventRegions converts transect_events rows into marker regions. rows is an
+    iterable of (transect, transect_event_type, time) where time is either a
+    datetime or a TO_CHAR(time) string. Regions are named <event>_<transect>
+    which is the naming EVFileMaker has always used.
+    '''
+    regions = []
+    region_id = start_id
+    for transect, event_type, event_time in rows:
+        if not isinstance(event_time, datetime):
+            event_time = datetime.strptime(str(event_time), time_format)
+        name = str(event_type) + '_' + str(transect)
+        regions.append(markerRegion(region_id, name, event_time))
+        region_id += 1
+    return regions
+
+
+def formatRegion(region):
+    '''
+    formatRegion returns the EVR text for a single region
+    '''
+    times = [p[0] for p in region.points]
+    depths = [p[1] for p in region.points]
+    left = min(times)
+    right = max(times)
+
+    lines = ['%i %i %i 0 %i -1 1 %s %s  %.2f %s %s  %.2f' % (REGION_VERSION,
+            len(region.points), region.id, region.creation_type, evrDate(left), evrTime(left),
+            min(depths), evrDate(right), evrTime(right), max(depths))]
+    lines.append(str(len(region.notes)))
+    lines.extend(region.notes)
+    lines.append(str(len(region.detection_settings)))
+    lines.extend(region.detection_settings)
+    lines.append(region.classification)
+    lines.append(' '.join(['%s %s %.10f' % (evrDate(t), evrTime(t), d)
+            for t, d in region.points]) + ' ' + str(region.region_type) + ' ')
+    lines.append(region.name)
+    lines.append('')
+
+    return EOL.join(lines) + EOL
+
+
+def formatEVR(regions, header=EVRG_HEADER):
+    '''
+    formatEVR returns the complete contents of an EVR file for the provided
+    regions. The region count in the header always matches the regions written.
+    '''
+    regions = list(regions)
+    parts = [header + EOL, str(len(regions)) + EOL, EOL]
+    parts.extend([formatRegion(region) for region in regions])
+    return ''.join(parts)
+
+
+def writeEVR(regions, path, header=EVRG_HEADER):
+    '''
+    writeEVR writes the regions to path with a single buffered write and returns
+    the path.
+    '''
+    data = formatEVR(regions, header=header)
+    with open(path, 'w', newline='') as f:
+        f.write(data)
+    return path
+
+
+def writeTransectEVRs(rows, path, prefix='Transect_'):
+    '''
+    writeTransectEVRs writes one EVR file per transect for a whole survey's
+    worth of transect_events rows (see eventRegions) and returns a dict keyed by
+    transect containing the file paths. Files are named <prefix><transect>.evr
+    '''
+    byTransect = {}
+    for row in rows:
+        byTransect.setdefault(str(row[0]), []).append(row)
+
+    files = {}
+    for transect, transect_rows in byTransect.items():
+        filename = os.path.join(os.path.normpath(str(path)), prefix + transect + '.evr')
+        files[transect] = writeEVR(eventRegions(transect_rows), filename)
+    return files
+
+
+def iterEVR(f):
+    '''
+    iterEVR is a generator that parses an open EVR file (or any iterable of
+    lines) and yields Region tuples as they are read. The first item yielded is
+    a tuple (header, region_count) so callers can check the declared count.
+    Raises EVRError if the file is malformed.
+    '''
+    lines = (line.rstrip('\r\n') for line in f)
+    lineNo = 0
+
+    def nextLine(what):
+        nonlocal lineNo
+        try:
+            line = next(lines)
+        except StopIteration:
+            raise EVRError('unexpected end of file reading ' + what, lineNo)
+        lineNo += 1
+        return line
+
+    header = nextLine('header')
+    if not header.startswith('EVRG'):
+        raise EVRError('not an EVR file (missing EVRG header)', lineNo)
+    try:
+        count = int(nextLine('region count').strip())
+    except ValueError:
+        raise EVRError('invalid region count', lineNo)
+    yield (header, count)
+
+    for line in lines:
+        lineNo += 1
+        if line.strip() == '':
+            continue
+
+        #  region header
+        tokens = line.split()
+        if len(tokens) < 13:
+            raise EVRError('invalid region header', lineNo)
+        try:
+            nPoints = int(tokens[1])
+            region_id = int(tokens[2])
+            creation_type = int(tokens[4])
+        except ValueError:
+            raise EVRError('invalid region header', lineNo)
+
+        try:
+            nNotes = int(nextLine('note count').strip())
+            notes = [nextLine('notes') for i in range(nNotes)]
+            nDetect = int(nextLine('detection setting count').strip())
+        except ValueError:
+            raise EVRError('invalid note or detection setting count', lineNo)
+        detection = [nextLine('detection settings') for i in range(nDetect)]
+        classification = nextLine('classification')
+
+        tokens = nextLine('points').split()
+        if len(tokens) != nPoints * 3 + 1:
+            raise EVRError('expected ' + str(nPoints) + ' points', lineNo)
+        try:
+            points = [(parseEvrDateTime(tokens[i], tokens[i + 1]), float(tokens[i + 2]))
+                    for i in range(0, nPoints * 3, 3)]
+            region_type = int(tokens[-1])
+        except ValueError:
+            raise EVRError('invalid point data', lineNo)
+
+        name = nextLine('region name')
+        yield Region(region_id, name, classification, region_type, notes, detection,
+                points, creation_type)
+
+
+def readEVR(path):
+    '''
+    readEVR reads an EVR file and returns a tuple (header, declared_count, regions).
+    '''
+    with open(path, 'r', newline='') as f:
+        parser = iterEVR(f)
+        header, count = next(parser)
+        regions = list(parser)
+    return header, count, regions
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import tempfile
+
+    #  simple survey scale round trip benchmark
+    parser = argparse.ArgumentParser(description='EVR writer/parser round trip benchmark')
+    parser.add_argument("-t", "--transects", type=int, default=300, help="Number of transects.")
+    parser.add_argument("-e", "--events", type=int, default=6, help="Number of events per transect.")
+    args = parser.parse_args()
+
+    #  generate a survey's worth of events
+    rows = []
+    t0 = datetime(2024, 6, 1)
+    event_types = ['ST'] + ['BT', 'RT'] * max((args.events - 2) // 2, 0) + ['ET']
+    for transect in range(1, args.transects + 1):
+        for e, event_type in enumerate(event_types):
+            rows.append((str(transect), event_type, t0 + timedelta(minutes=transect * 120 + e * 10)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        filename = writeEVR(eventRegions(rows), os.path.join(tmp, 'survey.evr'))
+        writeTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        header, count, regions = readEVR(filename)
+        readTime = time.perf_counter() - start
+
+        size = os.path.getsize(filename)
+
+    ok = count == len(rows) == len(regions)
+    print('%i regions (%i bytes) written in %.3f s, parsed in %.3f s, round trip %s' %
+            (len(rows), size, writeTime, readTime, 'OK' if ok else 'FAILED'))
@@ -0,0 +1,327 @@
+'''
+exportDaemon - exports EV files as soon as they are built or edited.
+
+At sea a scrutinised EV file used to sit until someone opened the Exporter
+and typed in its transect number, so exports often only happened at the end
+of the leg. exportDaemon is a headless service that watches the input
+directory for new or modified .EV files named the way EVFileMaker.makeFile
+names them (v{ship}-s{survey}-...-t{NNN}-z0.ev) and exports them for
+Macebase2 a few minutes after they were last saved:
+
+    python -m EVFunctions.exportDaemon <input dir> <output dir> <ECS file>
+            <odbc connection> <username> <password> -s <ship> -v <survey> -d <data set>
+
+The directory is polled. A file is queued once its size and modification
+time haven't changed for the debounce interval, so a file that is still
+being saved (or is saved repeatedly while scrutinising) is only exported
+once it settles. Each export reads the data set's current parameters from
+the database (exportParameters.fromDatabase) and runs on a bounded worker
+pool. A file that changes while it is being exported is queued again when it
+settles. The EV file identity (size and modification time) of each completed
+export is kept in a state file in the output directory so restarting the
+daemon doesn't re-export unchanged files. Each export is recorded as a run
+in the run ledger (runLedger).
+
+Only single variable exports are supported. The staging, calibration store
+and line export cache are used as they are by the Exporter. With more than
+one worker the workers share the Echoview instance, so Echoview is only shut
+down when the daemon stops.
+'''
+
+import os
+import re
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from EVFunctions import evBackend, exportParameters, transectExport, calibrationStore, runLedger
+from EVFunctions import exportMetrics
+
+
+#  EV files made by EVFileMaker.makeFile e.g. v157-s202407-x2-f38-t005-z0.ev
+EV_FILE_PATTERN = re.compile(r'^v(?P<ship>\d+)-s(?P<survey>\d+)-.*-t(?P<transect>[\d.]+)-z0\.ev$',
+        re.IGNORECASE)
+
+#  the state file written to the output directory
+STATE_NAME = '.exportDaemon.json'
+
+
+def fileIdentity(path):
+    '''
+    fileIdentity returns the (size, modification time) of a file or None if it
+    can't be read
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime]
+
+
+class FolderWatcher(object):
+    '''
+    FolderWatcher finds EV files for a ship and survey in a directory that are
+    new or have changed since they were last exported and haven't changed for
+    debounce seconds.
+    '''
+
+    def __init__(self, directory, ship, survey, debounce=60, state_file=None):
+        self.directory = directory
+        self.ship = str(ship)
+        self.survey = str(survey)
+        self.debounce = debounce
+        self.stateFile = state_file
+        #  path -> [identity, time the identity was first seen]
+        self.seen = {}
+        #  path -> identity of the last completed export
+        self.done = {}
+        self.lock = threading.Lock()
+        if state_file and os.path.exists(state_file):
+            try:
+                with open(state_file, 'r') as f:
+                    self.done = json.load(f)
+            except ValueError:
+                self.done = {}
+
+    def matches(self, name):
+        match = EV_FILE_PATTERN.match(name)
+        return match is not None and match.group('ship') == self.ship and \
+                match.group('survey') == self.survey
+
+    def poll(self, now=None):
+        '''
+        poll scans the directory and returns a list of (path, identity) for the
+        files that are ready to export
+        '''
+        if now is None:
+            now = time.time()
+        ready = []
+        present = set()
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or not self.matches(entry.name):
+                continue
+            path = entry.path
+            present.add(path)
+            identity = fileIdentity(path)
+            if identity is None:
+                continue
+            seen = self.seen.get(path)
+            if seen is None or seen[0] != identity:
+                #  new or changed, start the debounce again
+                self.seen[path] = [identity, now]
+                continue
+            with self.lock:
+                exported = self.done.get(path)
+            if exported != identity and now - seen[1] >= self.debounce:
+                ready.append((path, identity))
+        for path in list(self.seen.keys()):
+            if path not in present:
+                del self.seen[path]
+        return ready
+
+    def markDone(self, path, identity):
+        '''
+        markDone records that a file was exported and saves the state file
+        '''
+        with self.lock:
+            self.done[path] = identity
+            if self.stateFile:
+                with open(self.stateFile, 'w') as f:
+                    json.dump(self.done, f, indent=1, sort_keys=True)
+
+    def markAllDone(self):
+        '''
+        markAllDone marks every matching file in the directory as exported
+        '''
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and self.matches(entry.name):
+                self.markDone(entry.path, fileIdentity(entry.path))
+
+
+class ExportDaemon(object):
+    '''
+    ExportDaemon polls a FolderWatcher and runs exportFile for each file that
+    is ready on a pool of workers. exportFile(path) is called on a worker
+    thread and returns True if the export succeeded.
+    '''
+
+    def __init__(self, watcher, exportFile, workers=1, poll_interval=10, log=print):
+        self.watcher = watcher
+        self.exportFile = exportFile
+        self.pollInterval = poll_interval
+        self.log = log
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.lock = threading.Lock()
+        self.running = {}
+        self.stop = threading.Event()
+
+    def queueReady(self):
+        '''
+        queueReady queues the files that are ready and aren't already being
+        exported. Returns the number queued.
+        '''
+        count = 0
+        for path, identity in self.watcher.poll():
+            with self.lock:
+                if path in self.running:
+                    continue
+                self.running[path] = self.executor.submit(self._export, path, identity)
+            self.log('Queued ' + os.path.basename(path))
+            count += 1
+        return count
+
+    def _export(self, path, identity):
+        name = os.path.basename(path)
+        start = time.time()
+        try:
+            if self.exportFile(path):
+                self.log('Exported ' + name + ' in ' + str(round(time.time() - start, 1)) + ' s')
+            else:
+                self.log('Export of ' + name + ' failed, it will be retried when it changes')
+        except Exception as e:
+            self.log('Export of ' + name + ' failed: ' + str(e))
+        finally:
+            #  failed exports are marked too so they aren't retried until the file is saved again
+            self.watcher.markDone(path, identity)
+            with self.lock:
+                self.running.pop(path, None)
+
+    def run(self):
+        '''
+        run polls until shutdown is called
+        '''
+        while not self.stop.is_set():
+            try:
+                self.queueReady()
+            except OSError as e:
+                self.log('Unable to scan ' + self.watcher.directory + ': ' + str(e))
+            self.stop.wait(self.pollInterval)
+
+    def shutdown(self, wait=True):
+        self.stop.set()
+        self.executor.shutdown(wait=wait)
+
+
+class TransectExporter(object):
+    '''
+    TransectExporter exports an EV file with the data set's current database
+    parameters. It is the exportFile function used by the daemon.
+    '''
+
+    def __init__(self, db, ship, survey, dataSet, output_dir, ecs_file, fileset='Fileset 1',
+            backend=None, uploader=None, calibration_store=None, quit_echoview=True, ledger=None,
+            log=print):
+        self.db = db
+        self.ship = ship
+        self.survey = survey
+        self.dataSet = dataSet
+        self.outputDir = output_dir
+        self.ecsFile = ecs_file
+        self.fileset = fileset
+        self.backend = backend
+        self.uploader = uploader
+        if calibration_store is None:
+            calibration_store = calibrationStore.CalibrationStore(os.path.join(output_dir,
+                    calibrationStore.STORE_DIRNAME))
+        self.calStore = calibration_store
+        self.quitEchoview = quit_echoview
+        self.ledger = ledger
+        self.log = log
+
+    def __call__(self, path):
+        params = exportParameters.fromDatabase(self.db, self.ship, self.survey, self.dataSet)
+        params.input_dir = os.path.dirname(path)
+        params.output_dir_mb2 = self.outputDir
+        params.ECSfilename = self.ecsFile
+        params.Fileset = self.fileset
+        params.transect_name = EV_FILE_PATTERN.match(os.path.basename(path)).group('transect')
+        params.calibration = self.calStore.add(self.ecsFile)
+
+        ev = evBackend.getBackend(self.backend)
+        if not ev.start():
+            raise RuntimeError('No Scripting Module Found')
+        name = os.path.basename(path)
+        log = lambda msg: self.log(name + ': ' + msg.strip())
+        lineOffset = exportParameters.lineOffsetLookup(self.db, self.ship, self.survey, self.dataSet)
+        run = runLedger.Run(tool='exportDaemon')
+        if self.ledger is not None:
+            run = self.ledger.startRun('exportDaemon', self.ship, self.survey, self.dataSet, params)
+        status = 'error'
+        try:
+            zones = transectExport.exportTransect(ev, [path], params, log, lineOffset,
+                    uploader=self.uploader, calibration_store=self.calStore,
+                    quit_echoview=self.quitEchoview, run=run)
+            status = 'ok' if len(zones) > 0 and sum(zones) == len(zones) else 'failed'
+        finally:
+            run.finish(status)
+        return status == 'ok'
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from EVFunctions import dbSession, stagingUpload
+
+    parser = argparse.ArgumentParser(description='Export EV files as they are built or edited')
+    parser.add_argument("input_dir", help="The directory the EV files are saved in.")
+    parser.add_argument("output_dir", help="The Macebase2 output directory.")
+    parser.add_argument("ecs_file", help="The calibration (.ecs) file.")
+    parser.add_argument("odbc_connection", help="The name of the ODBC connection used to connect to the database.")
+    parser.add_argument("username", help="The username used to log into the database.")
+    parser.add_argument("password", help="The password for the specified username.")
+    parser.add_argument("-s", "--ship", required=True, help="The ship number.")
+    parser.add_argument("-v", "--survey", required=True, help="The survey number.")
+    parser.add_argument("-d", "--data-set", required=True, help="The data set id.")
+    parser.add_argument("-f", "--fileset", default='Fileset 1', help="The fileset name.")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="The number of exports run at once.")
+    parser.add_argument("--debounce", type=float, default=60,
+            help="Export a file once it hasn't changed for this many seconds.")
+    parser.add_argument("--poll", type=float, default=10, help="The polling interval in seconds.")
+    parser.add_argument("--staging", default='', help="Stage the exports in this directory and upload them.")
+    parser.add_argument("--backend", default=None, help="The Echoview backend.")
+    parser.add_argument("--ledger", default=None, help="The run ledger file.")
+    parser.add_argument("--metrics-file", default=None, help="Write metrics to this textfile collector file.")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve metrics on this local port.")
+    parser.add_argument("--skip-existing", action='store_true',
+            help="Don't export the files that are already in the input directory.")
+    args = parser.parse_args()
+
+    db = dbSession.getSession(args.odbc_connection, args.username, args.password, 'exportDaemon')
+    db.dbOpen()
+
+    metrics = None
+    if args.metrics_file or args.metrics_port:
+        metrics = exportMetrics.enable(textfile=args.metrics_file, port=args.metrics_port)
+
+    uploader = None
+    if args.staging:
+        uploader = stagingUpload.Uploader(args.staging, on_status=print)
+        uploader.recover()
+
+    watcher = FolderWatcher(args.input_dir, args.ship, args.survey, debounce=args.debounce,
+            state_file=os.path.join(args.output_dir, STATE_NAME))
+    if args.skip_existing:
+        watcher.markAllDone()
+    exporter = TransectExporter(db, args.ship, args.survey, args.data_set, args.output_dir,
+            args.ecs_file, fileset=args.fileset, backend=args.backend, uploader=uploader,
+            quit_echoview=args.workers == 1, ledger=runLedger.RunLedger(args.ledger))
+    daemon = ExportDaemon(watcher, exporter, workers=args.workers, poll_interval=args.poll)
+
+    print('Watching ' + args.input_dir + ' for ship ' + args.ship + ' survey ' + args.survey +
+            ' EV files. Press Ctrl-C to stop.')
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        print('Stopping, waiting for the exports in progress to finish...')
+    daemon.shutdown()
+    if args.workers > 1:
+        ev = evBackend.getBackend(args.backend)
+        if ev.start():
+            ev.quit()
+    if uploader is not None:
+        uploader.wait()
+        uploader.shutdown()
+    if metrics is not None:
+        metrics.shutdown()
+    db.close()
@@ -0,0 +1,114 @@
+'''
+exportFiles - works out which EV files the Exporter should process.
+
+This logic used to live in Exporter.export and the module level
+transect_string function in EchoviewExport.py, which meant it could only be
+used by importing the GUI (and with it PyQt6 and the generated UI). It only
+needs the standard library so it can be imported and run headless:
+
+    python -m EVFunctions.exportFiles <input dir> -v <survey> -t <transects>
+
+where transects is entered the same way as in the Exporter: a single
+transect, a comma or space separated list, a range (e.g. 3-7) or ALL.
+'''
+
+import os
+import glob
+from collections import namedtuple
+
+
+#  the EV files found for one transect. transect is the 't###' name
+TransectFiles = namedtuple('TransectFiles', ['transect', 'files'])
+
+
+class parameterSetup:
+    '''
+    parameterSetup is the container the Exporter fills with the export
+    parameters collected from the GUI.
+    '''
+    setup = True
+
+
+def transect_string(transect_names):
+    '''
+    transect_string changes a transect number to the 't###' format used in the
+    .EV file names. Any decimal part is kept, e.g. '5.1' -> 't005.1'
+    '''
+    transect_names = str(transect_names).strip()
+    if '.' in transect_names:
+        transect, part = transect_names.split('.', 1)
+        return 't' + transect.zfill(3) + '.' + part
+    return 't' + transect_names.zfill(3)
+
+
+def parseTransects(transect_text):
+    '''
+    parseTransects splits the transect field of the Exporter into a list of
+    transect numbers. Returns None if the text is 'ALL'.
+    '''
+    transect_text = str(transect_text).strip()
+    if transect_text == 'ALL':
+        return None
+    if ',' in transect_text:
+        return [t.strip() for t in transect_text.split(',') if t.strip()]
+    if ' ' in transect_text:
+        return [t for t in transect_text.split(' ') if t]
+    if '-' in transect_text:
+        first, last = transect_text.split('-')[0:2]
+        return [str(i) for i in range(int(first), int(last) + 1)]
+    return [transect_text]
+
+
+def transectFromFileName(path):
+    '''
+    transectFromFileName returns the 't###' transect name from an EV file name
+    e.g. v157-s202407-x2-f38-t005-z0.ev -> t005
+    '''
+    name = os.path.basename(path)
+    return 't' + name[name.find('-t') + 2:name.find('-z')]
+
+
+def findTransectFiles(input_dir, survey, transect_name):
+    '''
+    findTransectFiles returns the sorted list of .EV files in input_dir
+    containing the survey and 't###' transect name.
+    '''
+    pattern = os.path.join(str(input_dir), '*' + str(survey) + '*' + str(transect_name) + '*.EV')
+    return sorted(glob.glob(pattern))
+
+
+def exportJobs(input_dir, survey, transect_text):
+    '''
+    exportJobs returns a list of TransectFiles, one per requested transect. A
+    transect with no EV files has an empty file list so the caller can report
+    it.
+    '''
+    transects = parseTransects(transect_text)
+    if transects is None:
+        allFiles = sorted(glob.glob(os.path.join(str(input_dir), '*.EV')))
+        #  there can be more than one file per transect
+        names = []
+        for name in [transectFromFileName(f) for f in allFiles]:
+            if name not in names:
+                names.append(name)
+    else:
+        names = [transect_string(t) for t in transects]
+
+    return [TransectFiles(name, findTransectFiles(input_dir, survey, name)) for name in names]
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='List the EV files the Exporter would process')
+    parser.add_argument("input_dir", help="The directory containing the EV files.")
+    parser.add_argument("-v", "--survey", required=True, help="The survey number.")
+    parser.add_argument("-t", "--transects", default='ALL', help="The transects to export.")
+    args = parser.parse_args()
+
+    for job in exportJobs(args.input_dir, args.survey, args.transects):
+        if job.files:
+            print(job.transect[1:] + ': ' + ', '.join([os.path.basename(f) for f in job.files]))
+        else:
+            print(job.transect[1:] + ': no .EV files found')
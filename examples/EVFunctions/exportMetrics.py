@@ -0,0 +1,410 @@
+'''
+exportMetrics - Prometheus metrics for the export and EV file build tools.
+
+The ops dashboard had no way to tell whether the export and build workers
+were healthy or slow. When metrics are enabled the tools keep counters and
+histograms and expose them in the Prometheus text format, either on a local
+HTTP endpoint (http://127.0.0.1:<port>/metrics) or in a file for the node
+exporter's textfile collector that is rewritten every few seconds, or both:
+
+    evfunctions_transects_total{tool,status}          transects (EV files) finished
+    evfunctions_transect_seconds{tool}                 transect export/build time
+    evfunctions_zone_export_seconds{tool}              zone (and variable) export time
+    evfunctions_stage_seconds{tool,stage}              time per stage; the EV file
+                                                       build's raw file indexing wait
+                                                       is stage="pre-read"
+    evfunctions_com_call_seconds{method}               Echoview backend call latency
+    evfunctions_com_call_errors_total{method}          backend calls that raised
+    evfunctions_output_bytes_total{tool}               bytes written
+    evfunctions_last_transect_timestamp_seconds{tool}  when the last transect finished
+
+The transect, zone, stage and byte metrics come from the runLedger units the
+tools already record (this module adds a runLedger listener) and the backend
+call metrics from wrapping the backend with meterBackend. The Exporter and
+EVFileMaker enable metrics with the metrics_file and metrics_port settings,
+the export daemon and job board workers with --metrics-file and
+--metrics-port.
+
+An endpoint or file can be checked by scraping and parsing it:
+
+    python -m EVFunctions.exportMetrics check http://127.0.0.1:9464/metrics
+'''
+
+import os
+import abc
+import time
+import threading
+
+from EVFunctions import evBackend, runLedger
+
+
+#  histogram buckets in seconds
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+CALL_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+#  the metrics enabled by enable(), None if metrics are off
+_metrics = None
+_metricsLock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labelText(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join([name + '="' + _escape(value) + '"' for name, value in pairs]) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric(object):
+    '''
+    Metric is the base of the metric types. Samples are kept per tuple of
+    label values.
+    '''
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple([str(labels.get(name, '')) for name in self.labels])
+
+    def render(self):
+        lines = ['# HELP ' + self.name + ' ' + self.help, '# TYPE ' + self.name + ' ' + self.kind]
+        with self.lock:
+            for key in sorted(self.values):
+                lines += self._sampleLines(key, self.values[key])
+        return lines
+
+    def _sampleLines(self, key, value):
+        return [self.name + _labelText(self.labels, key) + ' ' + _number(value)]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def _sampleLines(self, key, value):
+        counts, total = value
+        lines = [self.name + '_bucket' + _labelText(self.labels, key, ('le', _number(bound))) + ' ' +
+                str(count) for bound, count in zip(self.buckets, counts)]
+        lines.append(self.name + '_sum' + _labelText(self.labels, key) + ' ' + _number(total))
+        lines.append(self.name + '_count' + _labelText(self.labels, key) + ' ' + str(counts[-1]))
+        return lines
+
+
+class MetricsRegistry(object):
+    '''
+    MetricsRegistry holds the metrics and renders them in the Prometheus text format
+    '''
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+class ExportMetrics(object):
+    '''
+    ExportMetrics is the set of metrics the tools maintain
+    '''
+
+    def __init__(self, registry=None):
+        if registry is None:
+            registry = MetricsRegistry()
+        self.registry = registry
+        self.transects = registry.add(Counter('evfunctions_transects_total',
+                'Transects exported or EV files built, by status.', ('tool', 'status')))
+        self.transectSeconds = registry.add(Histogram('evfunctions_transect_seconds',
+                'Time to export a transect or build its EV file.', ('tool',)))
+        self.zoneSeconds = registry.add(Histogram('evfunctions_zone_export_seconds',
+                'Time to export a zone (and variable) of a transect.', ('tool',)))
+        self.stageSeconds = registry.add(Histogram('evfunctions_stage_seconds',
+                'Time spent in each stage of an export or build.', ('tool', 'stage')))
+        self.callSeconds = registry.add(Histogram('evfunctions_com_call_seconds',
+                'Echoview backend call latency.', ('method',), CALL_BUCKETS))
+        self.callErrors = registry.add(Counter('evfunctions_com_call_errors_total',
+                'Echoview backend calls that raised an exception.', ('method',)))
+        self.outputBytes = registry.add(Counter('evfunctions_output_bytes_total',
+                'Bytes written to export and build outputs.', ('tool',)))
+        self.lastTransect = registry.add(Gauge('evfunctions_last_transect_timestamp_seconds',
+                'Unix time the last transect finished.', ('tool',)))
+
+    def observeUnit(self, run, unit, status):
+        '''
+        observeUnit is the runLedger listener. Units without a parent are
+        transects, the rest zones.
+        '''
+        tool = run.tool or 'unknown'
+        seconds = time.time() - unit.started
+        if unit.parent is None:
+            self.transects.inc(tool=tool, status=status)
+            self.transectSeconds.observe(seconds, tool=tool)
+            self.lastTransect.set(time.time(), tool=tool)
+        else:
+            self.zoneSeconds.observe(seconds, tool=tool)
+        for stage, stageSeconds in unit.stages:
+            self.stageSeconds.observe(stageSeconds, tool=tool, stage=stage)
+        written = sum([size for path, size in unit.outputs if size])
+        if written:
+            self.outputBytes.inc(written, tool=tool)
+
+
+class MeteredBackend(evBackend.EchoviewBackend):
+    '''
+    MeteredBackend passes every call through to another backend instance and
+    records its latency
+    '''
+
+    def __init__(self, backend, metrics):
+        self.backend = backend
+        self.metrics = metrics
+
+    def _call(self, method, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return getattr(self.backend, method)(*args, **kwargs)
+        except Exception:
+            self.metrics.callErrors.inc(method=method)
+            raise
+        finally:
+            self.metrics.callSeconds.observe(time.perf_counter() - start, method=method)
+
+
+def _makeMethod(name):
+    def method(self, *args, **kwargs):
+        return self._call(name, args, kwargs)
+    method.__name__ = name
+    return method
+
+
+for _name in [n for n in dir(evBackend.EchoviewBackend) if not n.startswith('_')]:
+    setattr(MeteredBackend, _name, _makeMethod(_name))
+del _name
+abc.update_abstractmethods(MeteredBackend)
+
+
+def meterBackend(backend):
+    '''
+    meterBackend returns the backend wrapped in a MeteredBackend if metrics
+    are enabled, otherwise the backend
+    '''
+    if _metrics is None or isinstance(backend, MeteredBackend):
+        return backend
+    return MeteredBackend(backend, _metrics)
+
+
+class TextfileWriter(object):
+    '''
+    TextfileWriter rewrites a textfile collector file every interval seconds.
+    The file is replaced atomically so the collector never reads a partial file.
+    '''
+
+    def __init__(self, registry, path, interval=15):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics-textfile', daemon=True)
+        self.thread.start()
+
+    def write(self):
+        temp = self.path + '.' + str(os.getpid()) + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(self.registry.render())
+        os.replace(temp, self.path)
+
+    def _run(self):
+        while True:
+            try:
+                self.write()
+            except (IOError, OSError):
+                pass
+            if self.stop.wait(self.interval):
+                break
+
+    def shutdown(self):
+        '''
+        shutdown stops the writer after writing the file one last time
+        '''
+        self.stop.set()
+        self.thread.join()
+        try:
+            self.write()
+        except (IOError, OSError):
+            pass
+
+
+def serveHttp(registry, port, host='127.0.0.1'):
+    '''
+    serveHttp serves the metrics at http://host:port/metrics on a background
+    thread and returns the server. Use port 0 to pick a free port
+    (server.server_address has the port used).
+    '''
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+class _Exposure(object):
+    def __init__(self, metrics, writer, server):
+        self.metrics = metrics
+        self.writer = writer
+        self.server = server
+
+    def shutdown(self):
+        if self.writer is not None:
+            self.writer.shutdown()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def enable(textfile=None, port=None, interval=15, host='127.0.0.1'):
+    '''
+    enable turns metrics on for this process and exposes them in textfile
+    and/or on port. Returns an object with the ExportMetrics (.metrics), the
+    TextfileWriter (.writer), the HTTP server (.server) and a shutdown method.
+    Metrics are only enabled once per process, later calls just add the
+    exposures.
+    '''
+    global _metrics
+    with _metricsLock:
+        if _metrics is None:
+            _metrics = ExportMetrics()
+            runLedger.addListener(_metrics.observeUnit)
+        metrics = _metrics
+    writer = None
+    if textfile:
+        writer = TextfileWriter(metrics.registry, textfile, interval)
+    server = None
+    if port is not None:
+        server = serveHttp(metrics.registry, port, host)
+    return _Exposure(metrics, writer, server)
+
+
+def parseMetrics(text):
+    '''
+    parseMetrics parses the Prometheus text format and returns a dict of
+    sample name with labels -> value. Raises ValueError on a malformed line.
+    '''
+    samples = {}
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if '}' in line:
+            name, value = line.rsplit('}', 1)
+            name += '}'
+        else:
+            name, value = line.split(None, 1) if ' ' in line else (line, '')
+        try:
+            samples[name.strip()] = float(value.split()[0])
+        except (ValueError, IndexError):
+            raise ValueError('Line ' + str(number) + ' is not a valid sample: ' + line)
+    return samples
+
+
+def scrape(source, timeout=10):
+    '''
+    scrape reads metrics from a URL or textfile and returns parseMetrics of them
+    '''
+    if source.startswith('http://') or source.startswith('https://'):
+        from urllib.request import urlopen
+        with urlopen(source, timeout=timeout) as response:
+            text = response.read().decode('utf-8')
+    else:
+        with open(source, 'r') as f:
+            text = f.read()
+    return parseMetrics(text)
+
+
+if __name__ == "__main__":
+
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check an export metrics endpoint or textfile')
+    parser.add_argument("command", choices=['check'], help="Scrape and parse the metrics.")
+    parser.add_argument("source", help="The metrics URL or textfile.")
+    args = parser.parse_args()
+
+    try:
+        samples = scrape(args.source)
+    except (IOError, OSError, ValueError) as e:
+        print('Unable to scrape ' + args.source + ': ' + str(e))
+        sys.exit(1)
+    for name in sorted(samples):
+        print(name + ' ' + _number(samples[name]))
+    print(str(len(samples)) + ' sample(s)')
@@ -0,0 +1,176 @@
+'''
+exportParameters - reads a data set's export parameters from the database.
+
+The Exporter fills its parameter widgets from the data_sets, zones and
+exclusion_lines tables when a data set is selected and checksAndSetup turns
+the (possibly edited) widget values into the params structure used by the
+export. The queries, the interval type to Echoview grid class mapping and
+the exclusion line offset lookup live here so the Exporter and headless
+tools (exportDaemon) share them. fromDatabase builds a complete params
+structure from the database values alone, as the Exporter would with none of
+the parameters edited.
+'''
+
+from EVFunctions.exportFiles import parameterSetup
+
+
+#  the layer reference name used for surface referenced data sets
+SURFACE_REFERENCE = 'Surface (depth of zero)'
+
+
+def queryExportVariable(db, ship, survey, dataSet):
+    return db.dbQuery("SELECT source_name FROM "+db.acousticSchema+".data_sets" +
+           " INNER JOIN "+db.acousticSchema+".acoustic_data_sources ON "+db.acousticSchema+".data_sets.source_id = "+db.acousticSchema+".acoustic_data_sources.source_id" +
+           " WHERE ship = ? AND survey = ? AND data_set_id = ?", (ship, survey, dataSet))
+
+
+def queryLayerReference(db, ship, survey, dataSet):
+    return db.dbQuery("SELECT layer_reference, layer_reference_name FROM "+db.acousticSchema+".data_sets" +
+           " WHERE ship = ? AND survey = ? AND data_set_id = ?", (ship, survey, dataSet))
+
+
+def queryReferenceOffset(db, ship, survey, dataSet, layerReferenceName):
+    '''
+    queryReferenceOffset returns the offset of a bottom referenced data set's
+    reference line as a string, or None if it isn't defined. For now bottom
+    referenced data sets are assumed to have one zone.
+    '''
+    query = db.dbQuery("SELECT lower_exclusion_line FROM "+db.acousticSchema+".zones" +
+           " WHERE ship = ? AND survey = ? AND data_set_id = ? AND lower_exclusion_name = ?",
+           (ship, survey, dataSet, layerReferenceName))
+    excl_num = query.first()[0]
+    if excl_num == '' or excl_num is None:
+        return None
+    query = db.dbQuery("SELECT exclusion_line_offset FROM "+db.acousticSchema+".exclusion_lines" +
+            " WHERE exclusion_line_id = ?", (excl_num,))
+    return str(-float(query.first()[0]))
+
+
+def queryThresholds(db, ship, survey, dataSet):
+    return db.dbQuery("SELECT minimum_threshold_applied as min_bool, minimum_threshold as min_val, maximum_threshold_applied as max_bool, maximum_threshold as max_val FROM "+db.acousticSchema+".data_sets" +
+           " WHERE ship = ? AND survey = ? AND data_set_id = ?", (ship, survey, dataSet))
+
+
+def queryZones(db, ship, survey, dataSet):
+    return db.dbQuery("SELECT zone, lower_exclusion_name as low_name, upper_exclusion_name as " +
+            "up_name, layer_thickness as thickness FROM "+db.acousticSchema+".zones" +
+           " WHERE ship = ? AND survey = ? AND data_set_id = ?", (ship, survey, dataSet))
+
+
+def queryIntervalType(db, ship, survey, dataSet):
+    return db.dbQuery("SELECT interval_type, interval_units, interval_length FROM "+db.acousticSchema+".data_sets" +
+           " WHERE ship = ? AND survey = ? AND data_set_id = ?", (ship, survey, dataSet))
+
+
+def lineOffset(db, line_name, line_type, ship, survey, dataSet):
+    '''
+    lineOffset returns the (layer reference, offset) of a zone's upper or lower
+    exclusion line. line_type is 'upper' or 'lower'.
+    '''
+    query = db.dbQuery("SELECT layer_reference, exclusion_line_offset FROM "+db.acousticSchema+".exclusion_lines a" +
+                " JOIN zones b ON a.exclusion_line_id = b."+line_type+"_exclusion_line WHERE b."+line_type+"_exclusion_name = ?" +
+                " AND b.ship = ? AND b.survey = ? AND b.data_set_id = ?", (line_name, ship, survey, dataSet))
+    return query.first()
+
+
+def lineOffsetLookup(db, ship, survey, dataSet):
+    '''
+    lineOffsetLookup returns a function of (line name, line type) that returns
+    lineOffset for the data set
+    '''
+    return lambda line_name, line_type: lineOffset(db, line_name, line_type, ship, survey, dataSet)
+
+
+def intervalClass(type, unit, length):
+    '''
+    intervalClass returns the Echoview time/distance grid class and the grid
+    length in the grid's units for an interval type, unit and length. Raises
+    ValueError if the unit doesn't fit the type.
+
+    1 is time (in minutes), 2 is GPS distance (nmi), 3 is vessel log (nmi),
+    4 is distance (pings), 5 is GPS distance (m), 6 is vessel log (m)
+    '''
+    length = float(length)
+    if type == 'Time':
+        if unit == 'minutes':
+            return 1, length
+        elif unit == 'hours':
+            return 1, length*60
+        elif unit == 'days':
+            return 1, length*24*60
+    elif type == 'GPS distance':
+        if unit == 'm':
+            return 5, length
+        elif unit == 'nmi':
+            return 2, length
+    elif type == 'Vessel log distance':
+        if unit == 'm':
+            return 6, length
+        elif unit == 'nmi':
+            return 3, length
+    elif type == 'Ping number':
+        if unit == 'pings':
+            return 4, length
+    raise ValueError('Interval units do not fit with the interval type.')
+
+
+def fromDatabase(db, ship, survey, dataSet, params=None):
+    '''
+    fromDatabase fills a params structure (a new parameterSetup by default)
+    with a data set's single variable export parameters. The directories,
+    transects, fileset and calibration file are left to the caller. Raises
+    ValueError if a required parameter isn't defined in the database.
+    '''
+    if params is None:
+        params = parameterSetup()
+    params.survey_no = survey
+    params.export_type = 0
+
+    params.Variable_for_export = queryExportVariable(db, ship, survey, dataSet).first()[0]
+    if not params.Variable_for_export:
+        raise ValueError('No export variable is defined for data set ' + str(dataSet))
+
+    type, unit, length = queryIntervalType(db, ship, survey, dataSet).first()
+    if length is None:
+        raise ValueError('No interval is defined for data set ' + str(dataSet))
+    params.int_class, params.EDSU_length = intervalClass(type, unit, length)
+
+    min_bool, min_val, max_bool, max_val = queryThresholds(db, ship, survey, dataSet).first()
+    params.apply_min_thresh = 1 if min_bool == '1' else 0
+    params.apply_max_thresh = 1 if max_bool == '1' else 0
+    if params.apply_min_thresh:
+        if not min_val:
+            raise ValueError('The minimum threshold is applied but not defined for data set ' + str(dataSet))
+        params.min_int_threshold = float(min_val)
+    if params.apply_max_thresh:
+        if not max_val:
+            raise ValueError('The maximum threshold is applied but not defined for data set ' + str(dataSet))
+        params.max_int_threshold = float(max_val)
+
+    layerReference, layerReferenceName = queryLayerReference(db, ship, survey, dataSet).first()
+    params.reference_label = layerReference
+    params.reference_offset = 0
+    if not layerReferenceName:
+        if layerReference != 'Surface':
+            raise ValueError('No layer reference name is defined for data set ' + str(dataSet))
+        layerReferenceName = SURFACE_REFERENCE
+    elif layerReference != 'Surface':
+        referenceOffset = queryReferenceOffset(db, ship, survey, dataSet, layerReferenceName)
+        if referenceOffset is not None:
+            params.reference_offset = float(referenceOffset)
+    params.layerReferenceName = layerReferenceName
+
+    params.zone = []
+    params.exclude_above_line = []
+    params.exclude_below_line = []
+    params.layer_thickness = []
+    for zone, low_name, up_name, thickness in queryZones(db, ship, survey, dataSet):
+        if not low_name or not up_name or thickness is None:
+            raise ValueError('The exclusion lines or layer thickness are not defined for zone ' + str(zone))
+        params.zone.append(zone)
+        params.exclude_below_line.append(low_name)
+        params.exclude_above_line.append(up_name)
+        params.layer_thickness.append(float(thickness))
+    if not params.zone:
+        raise ValueError('No zones are defined for data set ' + str(dataSet))
+    return params
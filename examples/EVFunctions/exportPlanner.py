@@ -0,0 +1,335 @@
+'''
+exportPlanner - works out what an export run will do and how long it will take.
+
+An export can tie up a workstation for hours, and the only way to find out
+what Exporter.export() would do was to run it. A dry run resolves the
+transect expression against the input directory the same way the export
+does, without starting Echoview, and lists every (file, variable, zone)
+export unit with the files it will write. Problems are flagged before
+anything is exported:
+
+    conflict          two units write the same file, e.g. the multi-frequency
+                      Autokrill and Autopollock exports write the same k1/p1
+                      file for every zone so only the last zone is kept
+    ignored           a transect has more than one EV file, only the first
+                      is exported
+    missing           a transect has no EV files or a zone's exclusion line
+                      has no offset in the database
+    unknown variable  a multi-frequency variable that the export doesn't know
+                      how to export
+    overwrite         output files that already exist
+
+The runtime is estimated from the run ledger (runLedger). Each transect's
+time is split into its zones' time and the rest (opening, grid setup, region
+and line exports), and both are scaled by the size of the EV file plus the
+raw files EVFileMaker built it from, as recorded in the ledger. With no size
+history the mean times are used.
+
+    python -m EVFunctions.exportPlanner <input dir> <output dir> <odbc connection>
+            <username> <password> -s <ship> -v <survey> -d <data set> [-t <transects>]
+'''
+
+import os
+import json
+from collections import namedtuple
+
+from EVFunctions import exportFiles, transectExport, runLedger
+
+
+#  one export of a variable for a zone. zone and variable are None for the
+#  transect's own outputs (run metadata, regions)
+PlannedUnit = namedtuple('PlannedUnit', ['transect', 'ev_file', 'variable', 'zone', 'outputs'])
+
+#  a transect of the plan and its units
+PlannedTransect = namedtuple('PlannedTransect', ['transect', 'ev_file', 'units'])
+
+#  kind is one of 'conflict', 'ignored', 'missing', 'unknown variable' or 'overwrite'
+Problem = namedtuple('Problem', ['kind', 'message'])
+
+#  seconds is the estimated run time, transects the estimate for each transect,
+#  history the number of ledger transects it is based on and scaled is True if
+#  the times were scaled by file size
+Estimate = namedtuple('Estimate', ['seconds', 'transects', 'history', 'scaled'])
+
+#  the tools whose ledger runs are exports
+EXPORT_TOOLS = ('EchoviewExport', 'exportDaemon', 'jobBoard')
+
+#  the number of recent transects the estimate is based on
+HISTORY_LENGTH = 200
+
+#  the Echoview bottom line every EV file has. Single frequency exports write
+#  it to Lines with the other lines no zone exported
+BOTTOM_LINE = 'Mean of all sounder-detected bottom lines'
+
+
+class ExportPlan(object):
+    '''
+    ExportPlan holds the transects and units of a planned export and the
+    problems found with it
+    '''
+
+    def __init__(self, export_type):
+        self.exportType = export_type
+        self.transects = []
+        self.problems = []
+
+    def units(self):
+        return [unit for transect in self.transects for unit in transect.units]
+
+    def outputs(self):
+        return [path for unit in self.units() for path in unit.outputs]
+
+
+def _lineOutputs(params, export_name, line_dir, zone, k, line_offset, problems):
+    outputs = []
+    for line_type, lines in (('upper', params.exclude_above_line), ('lower', params.exclude_below_line)):
+        line = str(lines[k])
+        try:
+            ref, offset = line_offset(line, line_type)
+            ref_string = transectExport.lineReference(line_type, ref, offset)
+        except Exception:
+            problems.append(Problem('missing', 'No ' + line_type + ' exclusion line offset for ' + line +
+                    ' (' + export_name + ' zone ' + str(zone) + '), the zone will fail to export'))
+            continue
+        outputs.append(transectExport.lineFileName(line_dir, export_name, line, ref_string, zone, line_type))
+    return outputs
+
+
+def planExport(params, jobs, line_offset=None, link_calibration=False):
+    '''
+    planExport returns the ExportPlan for exporting jobs, the list of
+    exportFiles.TransectFiles, with params. line_offset is the exclusion line
+    offset lookup passed to exportTransect. Without it the zones' exclusion
+    line files aren't listed. link_calibration is True if exportTransect is
+    given a calibration store and no uploader, so the calibration file is
+    linked into the output directory.
+    '''
+    plan = ExportPlan(getattr(params, 'export_type', 0))
+    outDir = params.output_dir_mb2
+    lineDir = outDir + os.sep + 'Lines'
+    known = [transectExport.MF_LINE_VARIABLE] + [v[0] for v in transectExport.MF_VARIABLES]
+    if plan.exportType != 0:
+        for variable in params.variable_export_list:
+            if variable not in known:
+                plan.problems.append(Problem('unknown variable', variable + " isn't one of the " +
+                        "multi-frequency export variables (" + ', '.join(known) + ") and won't be exported"))
+
+    for job in jobs:
+        if len(job.files) == 0:
+            plan.problems.append(Problem('missing', 'No .EV files found for transect ' + job.transect[1:]))
+            continue
+        evFile = job.files[0]
+        for ignored in job.files[1:]:
+            plan.problems.append(Problem('ignored', 'Transect ' + job.transect[1:] + ' has more than one EV ' +
+                    'file, only ' + os.path.basename(evFile) + ' is exported, not ' + os.path.basename(ignored)))
+        name = transectExport.exportName(evFile)
+        outputs = [outDir + os.sep + name + '-run.json',
+                outDir + os.sep + 'Regions' + os.sep + name + '-regions.evr']
+        if link_calibration:
+            outputs.append(outDir + os.sep + name + '-calibration-.ecs')
+        if plan.exportType == 0:
+            outputs.insert(1, outDir + os.sep + name + '- (regions).csv')
+            outputs.append(lineDir + os.sep + name + '-' + BOTTOM_LINE + '.evl')
+        units = [PlannedUnit(job.transect, evFile, None, None, outputs)]
+
+        if plan.exportType == 0:
+            for k, zone in enumerate(params.zone):
+                outputs = [transectExport.integrationFileName(outDir, name, zone)]
+                if line_offset is not None:
+                    outputs += _lineOutputs(params, name, lineDir, zone, k, line_offset, plan.problems)
+                units.append(PlannedUnit(job.transect, evFile, params.Variable_for_export, zone, outputs))
+        else:
+            if transectExport.MF_LINE_VARIABLE in params.variable_export_list:
+                for k, zone in enumerate(params.zone):
+                    outputs = [transectExport.integrationFileName(outDir, name, zone, 'z')]
+                    if line_offset is not None:
+                        outputs += _lineOutputs(params, name, lineDir, zone, k, line_offset, plan.problems)
+                    units.append(PlannedUnit(job.transect, evFile, transectExport.MF_LINE_VARIABLE, zone,
+                            outputs))
+            for variable, label, applyThresh, minAttr, maxAttr, suffix in transectExport.MF_VARIABLES:
+                if variable not in params.variable_export_list:
+                    continue
+                for zone in params.zone:
+                    units.append(PlannedUnit(job.transect, evFile, variable, zone,
+                            [transectExport.integrationFileName(outDir, name, zone, suffix)]))
+        plan.transects.append(PlannedTransect(job.transect, evFile, units))
+
+    #  find the files written by more than one unit
+    writers = {}
+    for unit in plan.units():
+        for path in unit.outputs:
+            writers.setdefault(os.path.normcase(path), []).append(unit)
+    for path, units in sorted(writers.items()):
+        if len(units) > 1:
+            plan.problems.append(Problem('conflict', os.path.basename(path) + ' is written by ' +
+                    str(len(units)) + ' units (' + ', '.join([_unitName(u) for u in units]) +
+                    '), only the last one is kept'))
+
+    existing = [path for path in writers if os.path.exists(path)]
+    if existing:
+        plan.problems.append(Problem('overwrite', str(len(existing)) + ' output file(s) already exist and ' +
+                'will be overwritten, e.g. ' + os.path.basename(existing[0])))
+    return plan
+
+
+def _unitName(unit):
+    if unit.zone is None:
+        return unit.transect[1:]
+    return unit.transect[1:] + ' ' + str(unit.variable) + ' zone ' + str(unit.zone)
+
+
+def _key(path):
+    return os.path.normcase(os.path.normpath(str(path)))
+
+
+def rawBytes(ledger):
+    '''
+    rawBytes returns a dict of EV file path (normalised) -> the size of the raw
+    files its latest EVFileMaker build used
+    '''
+    rows = ledger.query("SELECT o.path, SUM(i.bytes) FROM outputs o " +
+            "JOIN units u ON u.unit_id = o.unit_id JOIN runs r ON r.run_id = u.run_id " +
+            "JOIN inputs i ON i.unit_id = o.unit_id WHERE r.tool = 'EVFileMaker' AND u.status = 'ok' " +
+            "GROUP BY o.unit_id, o.path ORDER BY o.unit_id")
+    sizes = {}
+    for path, size in rows:
+        if path.lower().endswith('.ev') and size:
+            sizes[_key(path)] = size
+    return sizes
+
+
+def transectSize(ev_file, raw_sizes):
+    '''
+    transectSize returns the size of an EV file plus its raw files, 0 if it's
+    not known
+    '''
+    return (runLedger.fileSize(ev_file) or 0) + raw_sizes.get(_key(ev_file), 0)
+
+
+def history(ledger, export_type=None, raw_sizes=None, limit=HISTORY_LENGTH):
+    '''
+    history returns a list of (seconds, zone units, zone unit seconds, size) for
+    the most recent transects exported successfully with the export type
+    '''
+    if raw_sizes is None:
+        raw_sizes = rawBytes(ledger)
+    rows = ledger.query("SELECT u.unit_id, u.ev_file, u.finished - u.started, r.params, " +
+            "(SELECT COUNT(*) FROM units c WHERE c.parent_id = u.unit_id), " +
+            "(SELECT SUM(c.finished - c.started) FROM units c WHERE c.parent_id = u.unit_id), " +
+            "(SELECT SUM(i.bytes) FROM inputs i WHERE i.unit_id = u.unit_id) " +
+            "FROM units u JOIN runs r ON r.run_id = u.run_id WHERE u.parent_id IS NULL AND " +
+            "u.status = 'ok' AND r.tool IN (" + ','.join(['?'] * len(EXPORT_TOOLS)) + ") " +
+            "ORDER BY u.unit_id DESC LIMIT ?", EXPORT_TOOLS + (limit,))
+    transects = []
+    for unitId, evFile, seconds, params, zones, zoneSeconds, evBytes in rows:
+        try:
+            runType = (json.loads(params) or {}).get('export_type')
+        except ValueError:
+            runType = None
+        if export_type is not None and runType is not None and str(runType) != str(export_type):
+            continue
+        size = (evBytes or 0) + raw_sizes.get(_key(evFile), 0)
+        transects.append((seconds or 0, zones, zoneSeconds or 0, size))
+    return transects
+
+
+def estimate(plan, ledger):
+    '''
+    estimate returns the Estimate of a plan's run time from the ledger's
+    history, or None if there is none
+    '''
+    raw_sizes = rawBytes(ledger)
+    past = history(ledger, plan.exportType, raw_sizes)
+    if not past:
+        return None
+    overhead = sum([seconds - zoneSeconds for seconds, zones, zoneSeconds, size in past])
+    zoneTime = sum([zoneSeconds for seconds, zones, zoneSeconds, size in past])
+    zoneCount = sum([zones for seconds, zones, zoneSeconds, size in past])
+    sizes = sum([size for seconds, zones, zoneSeconds, size in past])
+    zoneSizes = sum([zones * size for seconds, zones, zoneSeconds, size in past])
+    scaled = all([size > 0 for seconds, zones, zoneSeconds, size in past])
+
+    transects = []
+    for transect in plan.transects:
+        zones = len(transect.units) - 1
+        size = transectSize(transect.ev_file, raw_sizes)
+        if scaled and size > 0:
+            seconds = size * overhead / sizes
+            if zoneSizes > 0:
+                seconds += zones * size * zoneTime / zoneSizes
+        else:
+            seconds = overhead / len(past)
+            if zoneCount > 0:
+                seconds += zones * zoneTime / zoneCount
+        transects.append((transect.transect, seconds))
+    return Estimate(sum([seconds for name, seconds in transects]), transects, len(past), scaled)
+
+
+def formatDuration(seconds):
+    '''
+    formatDuration returns a duration as e.g. 1 h 05 min or 42 s
+    '''
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return str(seconds) + ' s'
+    if seconds < 3600:
+        return str(seconds // 60) + ' min ' + '%02i' % (seconds % 60) + ' s'
+    return str(seconds // 3600) + ' h ' + '%02i' % ((seconds % 3600) // 60) + ' min'
+
+
+def formatPlan(plan, run_estimate=None):
+    '''
+    formatPlan returns the plan, its problems and estimate as text
+    '''
+    estimates = dict(run_estimate.transects) if run_estimate is not None else {}
+    lines = []
+    for transect in plan.transects:
+        header = 'Transect ' + transect.transect[1:] + ': ' + os.path.basename(transect.ev_file) + \
+                ', ' + str(len(transect.units) - 1) + ' export unit(s)'
+        if transect.transect in estimates:
+            header += ', about ' + formatDuration(estimates[transect.transect])
+        lines.append(header)
+        for unit in transect.units:
+            label = '  transect' if unit.zone is None else '  ' + str(unit.variable) + ' zone ' + str(unit.zone)
+            lines.append(label + ': ' + ', '.join([os.path.basename(p) for p in unit.outputs]))
+    lines.append(str(len(plan.transects)) + ' transect(s), ' + str(len(plan.units()) - len(plan.transects)) +
+            ' export unit(s), ' + str(len(plan.outputs())) + ' file(s) plus the EV files\' other lines')
+    for problem in plan.problems:
+        lines.append(problem.kind.upper() + ': ' + problem.message)
+    if run_estimate is None:
+        lines.append('No export history in the run ledger, the run time can\'t be estimated')
+    else:
+        lines.append('Estimated run time ' + formatDuration(run_estimate.seconds) + ' based on ' +
+                str(run_estimate.history) + ' exported transect(s)' +
+                (' scaled by EV and raw file size' if run_estimate.scaled else ''))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from EVFunctions import dbSession, exportParameters
+
+    parser = argparse.ArgumentParser(description='Show what an export run will do and how long it will take')
+    parser.add_argument("input_dir", help="The directory containing the EV files.")
+    parser.add_argument("output_dir", help="The Macebase2 output directory.")
+    parser.add_argument("odbc_connection", help="The name of the ODBC connection used to connect to the database.")
+    parser.add_argument("username", help="The username used to log into the database.")
+    parser.add_argument("password", help="The password for the specified username.")
+    parser.add_argument("-s", "--ship", required=True, help="The ship number.")
+    parser.add_argument("-v", "--survey", required=True, help="The survey number.")
+    parser.add_argument("-d", "--data-set", required=True, help="The data set id.")
+    parser.add_argument("-t", "--transects", default='ALL', help="The transects to export.")
+    parser.add_argument("--ledger", default=None, help="The run ledger file.")
+    args = parser.parse_args()
+
+    db = dbSession.getSession(args.odbc_connection, args.username, args.password, 'exportPlanner')
+    db.dbOpen()
+    params = exportParameters.fromDatabase(db, args.ship, args.survey, args.data_set)
+    params.input_dir = args.input_dir
+    params.output_dir_mb2 = args.output_dir
+    jobs = exportFiles.exportJobs(args.input_dir, args.survey, args.transects)
+    plan = planExport(params, jobs, exportParameters.lineOffsetLookup(db, args.ship, args.survey,
+            args.data_set))
+    db.close()
+    print(formatPlan(plan, estimate(plan, runLedger.RunLedger(args.ledger))))
@@ -0,0 +1,449 @@
+'''
+jobBoard - spreads an export run over several workstations.
+
+Exporter.export() can only use the Echoview licence of the machine it runs
+on. In job board mode an export run is posted as a board directory on shared
+storage instead: a manifest of units, one per EV file, each with the
+complete export parameters. Worker processes on any machine that can see the
+share claim units, export them with transectExport.exportTransect and mark
+them done:
+
+    python -m EVFunctions.jobBoard work <board dir>
+    python -m EVFunctions.jobBoard status <board dir>
+
+Workers claim units in board order. The Exporter posts the largest transects
+first (transectScheduler) with their predicted times, so a long transect
+isn't left until the end, and status compares the predicted makespan for
+the number of workers that took part with the achieved one.
+
+Units are claimed with lease files created with O_EXCL in the board's leases
+directory, so only one worker can hold a unit. The holder rewrites its lease
+with a new expiry time every heartbeat interval. A lease that has expired
+(the worker crashed, or its machine lost the share) is reclaimed by renaming
+it away, which only one worker can do, before the unit is claimed again. A
+worker that finds its lease was taken over stops renewing it and doesn't
+mark the unit done. Lease expiry times are written by the holder's clock so
+the workstations' clocks should be kept in sync; the lease time is long
+compared to the heartbeat to allow for some skew.
+
+Units that fail are retried by another claim up to max_attempts times and
+then left as failed. Everything the workers need is in the manifest: the
+exclusion line offsets are looked up from the database when the run is
+posted, so workers don't need a database connection.
+
+For testing on a single machine run several workers with the stand-in
+backend, e.g. EV_BACKEND=standin.
+
+Each worker records the units it exports as a run in its run ledger
+(runLedger), so a board's throughput can be compared with local exports.
+'''
+
+import os
+import json
+import time
+import socket
+import threading
+
+from EVFunctions import evBackend, transectExport, calibrationStore, runLedger, exportMetrics
+from EVFunctions import exportPlanner, transectScheduler
+from EVFunctions.exportFiles import parameterSetup
+
+
+MANIFEST_NAME = 'manifest.json'
+LEASE_DIR = 'leases'
+DONE_DIR = 'done'
+FAILED_DIR = 'failed'
+
+
+def _writeJson(path, data):
+    #  write to a temporary file and rename so readers never see a partial file
+    temp = path + '.tmp-' + socket.gethostname() + '-' + str(os.getpid()) + '-' + str(threading.get_ident())
+    with open(temp, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(temp, path)
+
+
+def _readJson(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def workerId():
+    '''
+    workerId returns an id for this worker process that is unique across hosts
+    '''
+    return socket.gethostname() + '-' + str(os.getpid())
+
+
+def paramsToDict(params):
+    '''
+    paramsToDict returns a JSON serializable copy of a params structure
+    '''
+    values = dict(vars(params))
+    calibration = values.get('calibration')
+    if calibration is not None:
+        values['calibration'] = dict(calibration._asdict())
+    return values
+
+
+def paramsFromDict(values):
+    '''
+    paramsFromDict rebuilds a params structure from paramsToDict
+    '''
+    params = parameterSetup()
+    for key, value in values.items():
+        setattr(params, key, value)
+    if values.get('calibration') is not None:
+        params.calibration = calibrationStore.CalibrationFile(**values['calibration'])
+    return params
+
+
+def lineOffsetTable(params, line_offset):
+    '''
+    lineOffsetTable looks up the offsets of the exclusion lines used by params
+    so they can be stored with the units. Returns {'upper': {name: [reference,
+    offset]}, 'lower': {...}}.
+    '''
+    table = {'upper': {}, 'lower': {}}
+    for name in params.exclude_above_line:
+        table['upper'][name] = list(line_offset(name, 'upper'))
+    for name in params.exclude_below_line:
+        table['lower'][name] = list(line_offset(name, 'lower'))
+    return table
+
+
+class Lease(object):
+    '''
+    Lease is a claim on a unit held by this worker. It is renewed by a
+    heartbeat thread until it is released. lost is set if another worker took
+    the unit over.
+    '''
+
+    def __init__(self, board, unit, worker):
+        self.board = board
+        self.unit = unit
+        self.worker = worker
+        self.path = board.leasePath(unit['id'])
+        self.lost = False
+        self.started = time.time()
+        self.stop = threading.Event()
+        self.thread = None
+
+    def _record(self):
+        return {'unit': self.unit['id'], 'worker': self.worker, 'host': socket.gethostname(),
+                'pid': os.getpid(), 'expires': time.time() + self.board.leaseTime}
+
+    def start(self):
+        self.thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self.thread.start()
+
+    def renew(self):
+        '''
+        renew extends the lease. Returns False if the lease is no longer ours.
+        '''
+        current = _readJson(self.path)
+        if current is None or current.get('worker') != self.worker:
+            self.lost = True
+            return False
+        _writeJson(self.path, self._record())
+        return True
+
+    def _heartbeat(self):
+        while not self.stop.wait(self.board.heartbeat):
+            if not self.renew():
+                break
+
+    def release(self):
+        '''
+        release stops the heartbeat and removes the lease file if it is still ours
+        '''
+        self.stop.set()
+        current = _readJson(self.path)
+        if current is not None and current.get('worker') == self.worker:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class JobBoard(object):
+    '''
+    JobBoard is an export run's board directory. lease_time is how long a
+    lease is valid without a heartbeat and heartbeat how often it is renewed.
+    '''
+
+    def __init__(self, path, lease_time=120, heartbeat=30, max_attempts=2):
+        self.path = path
+        self.leaseTime = lease_time
+        self.heartbeat = heartbeat
+        self.maxAttempts = max_attempts
+        self.manifest = _readJson(os.path.join(path, MANIFEST_NAME))
+        if self.manifest is None:
+            raise ValueError('There is no job board manifest in ' + str(path))
+
+    @classmethod
+    def post(cls, path, units, description='', **kwargs):
+        '''
+        post creates a board for a run. units is a list of dicts with the keys
+        ev_file and params (a params structure), and optionally line_offsets
+        (see lineOffsetTable), size and predicted_seconds. Units are claimed
+        in the order they are given.
+        '''
+        for name in (LEASE_DIR, DONE_DIR, FAILED_DIR):
+            os.makedirs(os.path.join(path, name), exist_ok=True)
+        manifest = {'description': description, 'posted': time.time(), 'host': socket.gethostname(),
+                'units': []}
+        for n, unit in enumerate(units):
+            name = os.path.splitext(os.path.basename(unit['ev_file']))[0]
+            manifest['units'].append({'id': '%04i-%s' % (n + 1, name), 'ev_file': unit['ev_file'],
+                    'params': paramsToDict(unit['params']),
+                    'line_offsets': unit.get('line_offsets', {'upper': {}, 'lower': {}}),
+                    'size': unit.get('size'), 'predicted_seconds': unit.get('predicted_seconds')})
+        _writeJson(os.path.join(path, MANIFEST_NAME), manifest)
+        return cls(path, **kwargs)
+
+    def units(self):
+        return self.manifest['units']
+
+    def leasePath(self, unit_id):
+        return os.path.join(self.path, LEASE_DIR, unit_id + '.lease')
+
+    def _donePath(self, unit_id):
+        return os.path.join(self.path, DONE_DIR, unit_id + '.json')
+
+    def _failedPath(self, unit_id):
+        return os.path.join(self.path, FAILED_DIR, unit_id + '.json')
+
+    def attempts(self, unit_id):
+        failed = _readJson(self._failedPath(unit_id))
+        return 0 if failed is None else failed.get('attempts', 0)
+
+    def state(self, unit_id, now=None):
+        '''
+        state returns 'done', 'failed', 'leased', 'expired' or 'pending'
+        '''
+        if os.path.exists(self._donePath(unit_id)):
+            return 'done'
+        leasePath = self.leasePath(unit_id)
+        if os.path.exists(leasePath):
+            lease = _readJson(leasePath)
+            if now is None:
+                now = time.time()
+            if lease is None:
+                #  just created and not written yet, or unreadable. Go by its age.
+                try:
+                    age = now - os.path.getmtime(leasePath)
+                except OSError:
+                    return 'pending'
+                return 'expired' if age > self.leaseTime else 'leased'
+            return 'expired' if lease.get('expires', 0) < now else 'leased'
+        if self.attempts(unit_id) >= self.maxAttempts:
+            return 'failed'
+        return 'pending'
+
+    def status(self):
+        '''
+        status returns a dict of the number of units in each state
+        '''
+        counts = {'done': 0, 'failed': 0, 'leased': 0, 'expired': 0, 'pending': 0}
+        now = time.time()
+        for unit in self.units():
+            counts[self.state(unit['id'], now)] += 1
+        return counts
+
+    def finished(self):
+        status = self.status()
+        return status['leased'] == 0 and status['expired'] == 0 and status['pending'] == 0
+
+    def makespan(self):
+        '''
+        makespan returns (predicted seconds, achieved seconds, workers) for the
+        done units. predicted is the largest first makespan of the units'
+        predicted times on the workers that did them, or None if a unit has no
+        prediction. achieved is None if no unit is done.
+        '''
+        done = []
+        for unit in self.units():
+            record = _readJson(self._donePath(unit['id']))
+            if record is not None:
+                done.append((unit, record))
+        if not done:
+            return None, None, 0
+        workers = len(set([record['worker'] for unit, record in done]))
+        predicted = None
+        if all([unit.get('predicted_seconds') is not None for unit in self.units()]):
+            predicted = transectScheduler.lptMakespan([unit['predicted_seconds'] for unit in self.units()],
+                    [0.0] * workers)
+        started = [record.get('started', record['finished']) for unit, record in done]
+        achieved = max([record['finished'] for unit, record in done]) - min(started)
+        return predicted, achieved, workers
+
+    def _reclaim(self, unit_id, worker):
+        #  rename the expired lease away. Only one worker's rename can succeed.
+        leasePath = self.leasePath(unit_id)
+        stale = leasePath + '.stale-' + worker
+        try:
+            os.rename(leasePath, stale)
+        except OSError:
+            return False
+        lease = _readJson(stale)
+        os.remove(stale)
+        if lease is not None and lease.get('expires', 0) >= time.time():
+            #  it was renewed between our check and the rename. Put it back if we can.
+            try:
+                fd = os.open(leasePath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(lease, f)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def claim(self, worker):
+        '''
+        claim leases the next pending (or expired) unit for a worker and returns
+        the started Lease, or None if there is nothing to claim
+        '''
+        for unit in self.units():
+            state = self.state(unit['id'])
+            if state == 'expired':
+                if not self._reclaim(unit['id'], worker):
+                    continue
+            elif state != 'pending':
+                continue
+            lease = Lease(self, unit, worker)
+            try:
+                fd = os.open(lease.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                #  another worker got there first
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump(lease._record(), f)
+            if os.path.exists(self._donePath(unit['id'])):
+                #  finished while we were looking
+                lease.release()
+                continue
+            lease.start()
+            return lease
+        return None
+
+    def complete(self, lease, result):
+        '''
+        complete marks a leased unit done. Returns False (and doesn't mark it)
+        if the lease was lost.
+        '''
+        if lease.lost or not lease.renew():
+            lease.release()
+            return False
+        _writeJson(self._donePath(lease.unit['id']), {'worker': lease.worker, 'started': lease.started,
+                'finished': time.time(), 'result': result})
+        lease.release()
+        return True
+
+    def fail(self, lease, error):
+        '''
+        fail records a failed attempt at a unit and releases it
+        '''
+        if not lease.lost:
+            attempts = self.attempts(lease.unit['id']) + 1
+            _writeJson(self._failedPath(lease.unit['id']), {'worker': lease.worker, 'attempts': attempts,
+                    'error': str(error), 'failed': time.time()})
+        lease.release()
+
+
+def exportUnit(unit, backend=None, log=print, run=None):
+    '''
+    exportUnit exports a unit with transectExport.exportTransect and returns
+    the list of zone results. backend is a backend name or instance and run
+    an optional runLedger.Run to record it in.
+    '''
+    params = paramsFromDict(unit['params'])
+    offsets = unit['line_offsets']
+    lineOffset = lambda line_name, line_type: offsets[line_type][line_name]
+    store = None
+    if getattr(params, 'calibration', None) is not None:
+        store = calibrationStore.CalibrationStore(os.path.dirname(params.calibration.path))
+    if isinstance(backend, evBackend.EchoviewBackend):
+        ev = backend
+    else:
+        ev = evBackend.getBackend(backend)
+    if not ev.start():
+        raise RuntimeError('No Scripting Module Found')
+    return transectExport.exportTransect(ev, [unit['ev_file']], params, log, lineOffset,
+            calibration_store=store, raw_dir=getattr(params, 'raw_dir', None), run=run)
+
+
+def work(board, worker=None, backend=None, wait=False, poll_interval=5, log=print, run=None):
+    '''
+    work claims and exports units until there are none left to claim. If wait
+    is True it keeps polling until every unit is done or failed, so it picks
+    up units whose leases expire. Returns the number of units exported. The
+    exports are recorded in run, an optional runLedger.Run.
+    '''
+    if worker is None:
+        worker = workerId()
+    count = 0
+    while True:
+        lease = board.claim(worker)
+        if lease is None:
+            if not wait or board.finished():
+                return count
+            time.sleep(poll_interval)
+            continue
+        unitId = lease.unit['id']
+        log(worker + ' exporting ' + unitId)
+        try:
+            zones = exportUnit(lease.unit, backend=backend,
+                    log=lambda msg: log(unitId + ': ' + msg.strip()), run=run)
+        except Exception as e:
+            log(worker + ' failed ' + unitId + ': ' + str(e))
+            board.fail(lease, e)
+            continue
+        if board.complete(lease, zones):
+            count += 1
+        else:
+            log(worker + ' lost the lease on ' + unitId + ', another worker has taken it over')
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export job board worker')
+    parser.add_argument("command", choices=['work', 'status'], help="Run a worker or show the board status.")
+    parser.add_argument("board", help="The job board directory.")
+    parser.add_argument("--backend", default=None, help="The Echoview backend.")
+    parser.add_argument("--wait", action='store_true',
+            help="Keep running until every unit is done, reclaiming abandoned units.")
+    parser.add_argument("--lease", type=float, default=120, help="The lease time in seconds.")
+    parser.add_argument("--heartbeat", type=float, default=30, help="The heartbeat interval in seconds.")
+    parser.add_argument("--ledger", default=None, help="The run ledger file.")
+    parser.add_argument("--metrics-file", default=None, help="Write metrics to this textfile collector file.")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve metrics on this local port.")
+    args = parser.parse_args()
+
+    board = JobBoard(args.board, lease_time=args.lease, heartbeat=args.heartbeat)
+    if args.command == 'work':
+        metrics = None
+        if args.metrics_file or args.metrics_port:
+            metrics = exportMetrics.enable(textfile=args.metrics_file, port=args.metrics_port)
+        units = board.units()
+        survey = units[0]['params'].get('survey_no') if units else None
+        run = runLedger.RunLedger(args.ledger).startRun('jobBoard', survey=survey,
+                params={'board':args.board, 'worker':workerId(), 'backend':args.backend})
+        try:
+            exported = work(board, backend=args.backend, wait=args.wait, run=run)
+        finally:
+            run.finish()
+            if metrics is not None:
+                metrics.shutdown()
+        print(workerId() + ' exported ' + str(exported) + ' unit(s)')
+    status = board.status()
+    print(', '.join([str(v) + ' ' + k for k, v in sorted(status.items())]))
+    predicted, achieved, workers = board.makespan()
+    if achieved is not None:
+        print('Makespan on ' + str(workers) + ' worker(s): achieved ' + exportPlanner.formatDuration(achieved) +
+                (', predicted ' + exportPlanner.formatDuration(predicted) if predicted is not None else ''))
@@ -0,0 +1,57 @@
+'''
+lazyImport - defers importing heavy modules until they are first used.
+
+The EVFunctions modules are imported at the top of the GUI apps and by the
+headless command line tools. Importing numpy (or PyQt6/win32com) at module
+level makes every one of those imports pay for it even when the function
+that needs it is never called. Modules in this package get their heavy
+dependencies with:
+
+    from EVFunctions.lazyImport import lazyImport
+    numpy = lazyImport('numpy')
+
+and the real import happens on the first attribute access.
+'''
+
+import importlib
+import threading
+
+
+class LazyModule(object):
+    '''
+    LazyModule is a stand-in for a module that imports it on first attribute
+    access.
+    '''
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return '<lazy module ' + self._name + ' (' + state + ')>'
+
+
+def lazyImport(name):
+    '''
+    lazyImport returns a LazyModule for the named module. If the module has
+    already been imported it is returned directly.
+    '''
+    import sys
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
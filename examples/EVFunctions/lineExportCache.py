@@ -0,0 +1,131 @@
+'''
+lineExportCache - avoids exporting the same EV line more than once.
+
+export_py_MB2 exports the exclude above and below lines for every zone and
+then every other line in the file, each one a slow COM ExportLine call. Lines
+shared across zones (surface_exclusion, bottom_exclusion) are exported again
+for every zone under a different file name, and re-running an export
+re-exports every line even when the EV file hasn't changed.
+
+A LineExportCache sits in front of the backend's exportLine for one EV file.
+Exports are keyed by (EV file identity, line name, reference/offset), where
+the identity is the EV file's path, size and modification time. Within a run
+a line that has already been exported is copied to its new file name instead
+of being exported again. Across runs each transect keeps an index of the
+lines it exported in the output Lines directory, and an EVL that the index
+shows was exported from the same EV file (and is still the same size) is
+skipped. The export re-saves the EV file when it resets the raw data path, so
+the identity is taken before that save and the index records the identity
+the file has afterwards, which is what the next run will see if nobody has
+edited the file in between. summary() reports the COM time saved, using the time the original
+export of each copied or skipped line took.
+'''
+
+import os
+import json
+import time
+import shutil
+
+
+def fileIdentity(path):
+    '''
+    fileIdentity returns a string identifying a file's path and contents
+    version (size and modification time)
+    '''
+    stat = os.stat(path)
+    return os.path.normcase(os.path.abspath(path)) + '|' + str(stat.st_size) + '|' + str(int(stat.st_mtime))
+
+
+class LineExportCache(object):
+    '''
+    LineExportCache exports the lines of one EV file. index_name is the name of
+    the index file, which is read from final_dir (the directory the EVL files
+    end up in) and written to the directory they are exported to. ev_id is the
+    EV file's identity before this run saved it, by default its identity now.
+    '''
+
+    def __init__(self, ev, ev_file_name, index_name, final_dir, ev_id=None):
+        self.ev = ev
+        self.evFileName = ev_file_name
+        self.evId = ev_id if ev_id is not None else fileIdentity(ev_file_name)
+        self.indexName = index_name
+        self.finalDir = final_dir
+        self.index = {}
+        indexPath = os.path.join(final_dir, index_name)
+        if os.path.exists(indexPath):
+            try:
+                with open(indexPath, 'r') as f:
+                    self.index = json.load(f)
+            except ValueError:
+                self.index = {}
+        #  (line, reference) -> (path, export time) of the files exported this run
+        self.runExports = {}
+        self.exported = 0
+        self.copied = 0
+        self.current = 0
+        self.exportTime = 0.0
+        self.savedTime = 0.0
+
+    def _entry(self, name, reference, path, seconds):
+        return {'ev': self.evId, 'line': name, 'reference': reference,
+                'size': os.path.getsize(path), 'seconds': round(seconds, 3)}
+
+    def _upToDate(self, name, reference, filename):
+        entry = self.index.get(filename)
+        if entry is None or entry.get('ev') != self.evId:
+            return False
+        if entry.get('line') != name or entry.get('reference') != reference:
+            return False
+        final = os.path.join(self.finalDir, filename)
+        return os.path.exists(final) and os.path.getsize(final) == entry.get('size')
+
+    def exportLine(self, evVar, evLine, name, path, reference=''):
+        '''
+        exportLine exports a line to path unless it is already up to date in
+        the final directory or was exported earlier in the run. reference
+        describes the reference/offset the line was exported with. Returns
+        True if the EVL is available.
+        '''
+        filename = os.path.basename(path)
+        key = (name, reference)
+        if self._upToDate(name, reference, filename):
+            self.current += 1
+            self.savedTime += self.index[filename].get('seconds', 0.0)
+            return True
+
+        previous = self.runExports.get(key)
+        if previous is not None and os.path.exists(previous[0]):
+            if os.path.normcase(previous[0]) != os.path.normcase(path):
+                shutil.copyfile(previous[0], path)
+            self.index[filename] = self._entry(name, reference, path, previous[1])
+            self.copied += 1
+            self.savedTime += previous[1]
+            return True
+
+        start = time.time()
+        result = self.ev.exportLine(evVar, evLine, path, -1, -1)
+        seconds = time.time() - start
+        self.exportTime += seconds
+        self.exported += 1
+        if result and os.path.exists(path):
+            self.runExports[key] = (path, seconds)
+            self.index[filename] = self._entry(name, reference, path, seconds)
+        return result
+
+    def save(self, directory):
+        '''
+        save writes the index to the directory the EVL files were exported to
+        '''
+        #  record the lines of this version of the EV file with the identity it has
+        #  now, after any save by this run
+        saved = fileIdentity(self.evFileName)
+        for entry in self.index.values():
+            if entry.get('ev') == self.evId:
+                entry['ev'] = saved
+        with open(os.path.join(directory, self.indexName), 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+
+    def summary(self):
+        return (str(self.exported) + ' line(s) exported, ' + str(self.copied) + ' copied, ' +
+                str(self.current) + ' already up to date. Saved about ' +
+                str(round(self.savedTime, 1)) + ' s of Echoview time')
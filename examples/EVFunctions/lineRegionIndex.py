@@ -0,0 +1,176 @@
+'''
+lineRegionIndex - one pass index of the Lines and Regions directories written
+                  by the Exporter, keyed by transect and line name.
+
+When importing lines and regions, EVFileMaker used to glob the Lines and
+Regions directories for every transect and re-derive the target line name by
+splitting each file name on '-'. The index here lists each directory once,
+parses the Exporter's naming convention once and is cached until a file in
+one of the directories is added, removed or rewritten.
+
+The Exporter (EchoviewExport.export_py_MB2) writes:
+
+    Lines/<EvExportName>-<line>-<offset string>-z<zone>-upper.evl
+    Lines/<EvExportName>-<line>-<offset string>-z<zone>-lower.evl
+    Lines/<EvExportName>-<line>.evl
+    Regions/<EvExportName>-regions.evr
+
+where EvExportName is the EV file name up to the '-z', i.e.
+v<ship>-s<survey>-x2-f38-t<NNN>, and the offset string is something like
+'0.5 below surface' or '-2.0 below bottom'.
+'''
+
+import os
+import re
+import threading
+from collections import namedtuple
+
+
+#  the transect token in Exporter/EVFileMaker file names, i.e. t001, t001.2 or t1001
+TRANSECT_REGEX = re.compile('^t[0-9]{3,}(\\.[0-9]+)?$')
+
+#  the part of a line file name after the transect token
+LINE_REGEX = re.compile('^(?P<line>.+?)(?:-(?P<offset>-?[0-9.]+ (?:above|below) .+?)' +
+        '-z(?P<zone>[^-]+)-(?P<side>upper|lower))?$')
+
+#  a single exported line file. zone, side and offset are None for lines that
+#  were exported without a zone
+LineFile = namedtuple('LineFile', ['path', 'name', 'mtime', 'zone', 'side', 'offset'])
+
+#  index entry for a transect. lines is a dict keyed by line name containing the
+#  newest LineFile for that name, regions is a list of region file paths.
+TransectFiles = namedtuple('TransectFiles', ['lines', 'regions'])
+
+#  cache of indexes keyed by normalised root path
+_cache = {}
+_cacheLock = threading.Lock()
+
+
+def transectToken(transect):
+    '''
+    transectToken returns the t### token used in file names for a transect number
+    in the same way EVFileMaker.makeFile does.
+    '''
+    return 't%03i' % float(transect)
+
+
+def parseName(filename):
+    '''
+    parseName splits an exported line or region file name into a tuple
+    (transect token, line name, zone, side, offset). Returns None if the file
+    name doesn't contain a transect token. For region files the line name is
+    the remainder of the name after the transect (usually 'regions').
+    '''
+    base = os.path.basename(filename)
+    base = os.path.splitext(base)[0]
+
+    #  find the transect token - everything after it is the line name and options
+    tokens = base.split('-')
+    for i, token in enumerate(tokens):
+        if TRANSECT_REGEX.match(token):
+            break
+    else:
+        return None
+    transect = tokens[i].split('.')[0]
+    rest = '-'.join(tokens[i + 1:])
+
+    match = LINE_REGEX.match(rest)
+    if not match:
+        return None
+    return (transect, match.group('line'), match.group('zone'), match.group('side'),
+            match.group('offset'))
+
+
+def _scan(directory, extension):
+    '''
+    _scan lists a directory once and returns a sorted list of (path, mtime, size)
+    tuples for the files with the provided extension.
+    '''
+    files = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(extension):
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_mtime, stat.st_size))
+    except FileNotFoundError:
+        pass
+    return sorted(files)
+
+
+def _scanRoot(root):
+    return (_scan(os.path.join(root, 'Lines'), '.evl'), _scan(os.path.join(root, 'Regions'), '.evr'))
+
+
+def buildIndex(root, scanned=None):
+    '''
+    buildIndex builds the index for the Lines and Regions directories below root
+    and returns a dict keyed by transect token containing TransectFiles tuples.
+    scanned is the directories' listing if they have already been listed.
+    '''
+    root = os.path.normpath(str(root))
+    if scanned is None:
+        scanned = _scanRoot(root)
+    lineFiles, regionFiles = scanned
+    index = {}
+
+    for path, mtime, size in lineFiles:
+        parsed = parseName(path)
+        if parsed is None:
+            continue
+        transect, name, zone, side, offset = parsed
+        entry = index.setdefault(transect, TransectFiles({}, []))
+        lineFile = LineFile(path, name, mtime, zone, side, offset)
+        current = entry.lines.get(name)
+        if current is None or lineFile.mtime > current.mtime:
+            entry.lines[name] = lineFile
+
+    for path, mtime, size in regionFiles:
+        parsed = parseName(path)
+        if parsed is None:
+            continue
+        entry = index.setdefault(parsed[0], TransectFiles({}, []))
+        entry.regions.append(path)
+
+    for entry in index.values():
+        entry.regions.sort()
+
+    return index
+
+
+def getIndex(root):
+    '''
+    getIndex returns the cached index for root, rebuilding it if a file in the
+    Lines or Regions directory has been added, removed or rewritten since it
+    was built. A file overwritten in place doesn't change its directory's
+    mtime, so the files' sizes and mtimes are compared.
+    '''
+    root = os.path.normpath(str(root))
+    scanned = _scanRoot(root)
+
+    with _cacheLock:
+        cached = _cache.get(root)
+        if cached is not None and cached[0] == scanned:
+            return cached[1]
+
+    index = buildIndex(root, scanned)
+    with _cacheLock:
+        _cache[root] = (scanned, index)
+    return index
+
+
+def transectFiles(root, transect):
+    '''
+    transectFiles returns the TransectFiles for a transect number (or t### token)
+    from the cached index. Transects with no files return empty lists.
+    '''
+    token = transect if str(transect).startswith('t') else transectToken(transect)
+    return getIndex(root).get(token, TransectFiles({}, []))
+
+
+def clearCache():
+    '''
+    clearCache discards all cached indexes
+    '''
+    with _cacheLock:
+        _cache.clear()
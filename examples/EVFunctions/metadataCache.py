@@ -0,0 +1,234 @@
+'''
+metadataCache - an on-disk snapshot of the database metadata the apps need
+                at startup.
+
+Exporter.applicationInit queries ships, surveys, data_sets, interval_types
+and interval_units and EVFileMaker queries application_configuration,
+data_sets and transect_events before either app is usable. Over the ship to
+shore link that takes seconds, and when the database can't be reached the
+apps can't start at all.
+
+A MetadataCache stores the result of each metadata query in a local SQLite
+file keyed by the statement and its parameters. query() returns the stored
+result immediately when there is one and queues a background refresh of it.
+When there is no snapshot yet the query is run against the database and
+stored. A refresh thread re-runs the queries used in the session on an
+interval, reconnecting the session if it is offline, and compares each
+result with its snapshot so the app is only told about the snapshots that
+actually changed.
+
+While the database hasn't confirmed the snapshots in use (offline, or the
+first refresh hasn't finished) the cache is stale and statusText() returns
+a message the apps show so users know the lists may be out of date.
+'''
+
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+
+from EVFunctions import dbSession
+
+
+#  the directory the snapshot files are kept in
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.EVFunctions')
+
+
+class MetadataCache(object):
+    '''
+    MetadataCache stores query results in a SQLite file. on_update is called
+    from the refresh thread after every refresh with the list of keys that
+    changed, so GUI apps should relay it to the GUI thread with a signal.
+    '''
+
+    def __init__(self, label, path=None, on_update=None, interval=300):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, label + '_metadata.sqlite')
+        self.path = path
+        self.onUpdate = on_update
+        self.interval = interval
+        self.lock = threading.Lock()
+
+        #  keys of the snapshots used this session and those confirmed by the database
+        self.used = {}
+        self.confirmed = set()
+        self.offline = False
+        self.lastError = ''
+        self.lastRefresh = None
+
+        self.db = None
+        self.wake = threading.Event()
+        self.stop = threading.Event()
+        self.thread = None
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._open() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS snapshots (key TEXT PRIMARY KEY, ' +
+                    'sql TEXT, params TEXT, columns TEXT, rows TEXT, digest TEXT, refreshed REAL)')
+
+    def _open(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def key(sql, params=None):
+        '''
+        key returns the snapshot key for a statement and its parameters
+        '''
+        params = [] if params is None else [str(p) for p in params]
+        return hashlib.sha1(json.dumps([sql, params]).encode('utf-8')).hexdigest()
+
+    def get(self, sql, params=None):
+        '''
+        get returns the stored dbSession.Query for a statement or None
+        '''
+        with self.lock, self._open() as connection:
+            row = connection.execute('SELECT columns, rows FROM snapshots WHERE key=?',
+                    (self.key(sql, params),)).fetchone()
+        if row is None:
+            return None
+        return dbSession.Query(json.loads(row[0]), [tuple(r) for r in json.loads(row[1])])
+
+    def put(self, sql, params, query):
+        '''
+        put stores a query result and returns True if it differs from the stored
+        snapshot.
+        '''
+        rows = [list(r) for r in query]
+        data = json.dumps(rows)
+        digest = hashlib.sha1(data.encode('utf-8')).hexdigest()
+        key = self.key(sql, params)
+        params = [] if params is None else [str(p) for p in params]
+        with self.lock, self._open() as connection:
+            old = connection.execute('SELECT digest FROM snapshots WHERE key=?', (key,)).fetchone()
+            if old is not None and old[0] == digest:
+                connection.execute('UPDATE snapshots SET refreshed=? WHERE key=?', (time.time(), key))
+                return False
+            connection.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, sql, json.dumps(params), json.dumps(list(query.columns)), data, digest,
+                    time.time()))
+        return True
+
+    def hasSnapshots(self):
+        with self.lock, self._open() as connection:
+            count, = connection.execute('SELECT COUNT(*) FROM snapshots').fetchone()
+        return count > 0
+
+    def snapshotTime(self):
+        '''
+        snapshotTime returns the time of the oldest snapshot used this session
+        '''
+        keys = list(self.used.keys())
+        if not keys:
+            return None
+        with self.lock, self._open() as connection:
+            times = [connection.execute('SELECT refreshed FROM snapshots WHERE key=?', (k,)).fetchone()
+                    for k in keys]
+        times = [t[0] for t in times if t is not None]
+        return min(times) if times else None
+
+    def query(self, db, sql, params=None):
+        '''
+        query returns the snapshot of a metadata query if there is one, queuing
+        a background refresh, otherwise it runs the query and stores the result.
+        If the database can't be reached and there is no snapshot an empty
+        Query is returned and the cache is marked offline.
+        '''
+        key = self.key(sql, params)
+        self.used[key] = (sql, params)
+        cached = self.get(sql, params)
+        if cached is not None:
+            if key not in self.confirmed:
+                self.wake.set()
+            return cached
+
+        try:
+            result = db.dbQuery(sql, params)
+        except dbSession.DBError as e:
+            self.offline = True
+            self.lastError = e.error
+            return dbSession.Query([], [])
+        self.put(sql, params, result)
+        self.confirmed.add(key)
+        return result
+
+    def invalidate(self, sql=None, params=None):
+        '''
+        invalidate marks a snapshot (or all snapshots) as needing a refresh. Call
+        this after writing to tables the snapshots are based on.
+        '''
+        if sql is None:
+            self.confirmed.clear()
+        else:
+            self.confirmed.discard(self.key(sql, params))
+        self.wake.set()
+
+    def refresh(self, db):
+        '''
+        refresh re-runs the queries used this session and returns the list of
+        keys whose results changed. The session is reopened if it is closed.
+        '''
+        changed = []
+        try:
+            if db.closed:
+                db.dbOpen()
+            for key, (sql, params) in list(self.used.items()):
+                if self.put(sql, params, db.dbQuery(sql, params)):
+                    changed.append(key)
+                self.confirmed.add(key)
+            self.offline = False
+            self.lastError = ''
+            self.lastRefresh = time.time()
+        except dbSession.DBError as e:
+            self.offline = True
+            self.lastError = e.error
+        return changed
+
+    def isStale(self):
+        '''
+        isStale returns True if any snapshot in use hasn't been confirmed by the
+        database this session.
+        '''
+        return self.offline or any([k not in self.confirmed for k in self.used])
+
+    def statusText(self):
+        '''
+        statusText returns a short description of the cache state for the apps
+        to display, or an empty string when the metadata is current.
+        '''
+        if not self.isStale():
+            return ''
+        stamp = self.snapshotTime()
+        when = time.strftime('%Y-%m-%d %H:%M', time.localtime(stamp)) if stamp else 'unknown'
+        if self.offline:
+            return 'OFFLINE - using metadata cached ' + when
+        return 'Checking metadata cached ' + when
+
+    def start(self, db):
+        '''
+        start starts the background refresh thread for a database session
+        '''
+        self.db = db
+        if self.thread is None:
+            self.stop.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.wake.set()
+
+    def _run(self):
+        while not self.stop.is_set():
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if self.stop.is_set():
+                break
+            changed = self.refresh(self.db)
+            if self.onUpdate is not None:
+                self.onUpdate(changed)
+
+    def close(self):
+        self.stop.set()
+        self.wake.set()
+        self.thread = None
@@ -0,0 +1,174 @@
+'''
+preflight - checks every selected transect before EVFileMaker starts Echoview.
+
+In do-all mode EVFileMaker used to discover problems one transect at a time,
+often after Echoview had been started and with the run stopped by a modal
+dialog. The preflight pulls everything it needs from the database in a few
+bulk queries, checks each transect concurrently against the raw file index
+and returns one consolidated report. Only the transects that pass are handed
+to the builder.
+
+Checks performed:
+    - the data set has a numeric surface_exclusion depth and bottom_exclusion offset
+    - the transect has usable ST/BT/RT/ET events
+    - there are raw files for every on-effort segment
+    - there are no misnamed raw files in the raw directory
+    - whether the EV file already exists. This is a warning, unless overwriting,
+      so the caller can ask once whether to replace the existing files.
+'''
+
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from EVFunctions import transectSegments
+
+
+#  result of checking one transect. problems prevent the transect from being
+#  built, warnings don't.
+TransectCheck = namedtuple('TransectCheck', ['transect', 'ev_file', 'files', 'problems', 'warnings'])
+
+#  the data set parameters makeFile needs
+DatasetCheck = namedtuple('DatasetCheck', ['surface_exclusion_depth', 'bottom_line_offset', 'problems'])
+
+
+def evFileName(ship, survey, transect):
+    '''
+    evFileName returns the name of the EV file EVFileMaker creates for a transect
+    '''
+    return ('v' + str(ship) + '-s' + str(survey) + '-x2-f38-t' + '%03i' % float(transect) +
+            '-z0.ev')
+
+
+def checkDataset(db, ship, survey, dataset):
+    '''
+    checkDataset queries the surface exclusion line depth and bottom exclusion
+    line offset for the data set and returns a DatasetCheck.
+    '''
+    problems = []
+    values = []
+    for line_name, position, label in [('surface_exclusion', 'upper', 'surface exclusion line depth'),
+            ('bottom_exclusion', 'lower', 'bottom exclusion line offset')]:
+        sql = ("SELECT b.exclusion_line_offset from zones a, exclusion_lines b " +
+                "WHERE ship=? AND survey=? AND a.data_set_id=? AND " +
+                "a." + position + "_exclusion_name=? AND " +
+                "a." + position + "_exclusion_line=b.exclusion_line_id")
+        query = db.dbQuery(sql, (str(ship), str(survey), str(dataset), line_name))
+        value, = query.first()
+        if value is None:
+            problems.append("Unable to find the " + label + ". Have you created your zone(s) " +
+                    "for this dataset and is the " + position + "_exclusion_name set to '" +
+                    line_name + "'?")
+            values.append(None)
+            continue
+        try:
+            values.append(float(value))
+        except ValueError:
+            problems.append("Invalid (non-numeric) " + label + " found.")
+            values.append(None)
+
+    return DatasetCheck(values[0], values[1], problems)
+
+
+def surveyEvents(db, ship, survey, transects=None):
+    '''
+    surveyEvents returns the transect_events rows (transect, event type, time
+    string) for a survey with a single query. If transects is provided only
+    those transects are returned.
+    '''
+    sql = ("SELECT transect, transect_event_type, TO_CHAR(time) FROM transect_events " +
+            "WHERE ship=? AND survey=? ORDER BY transect, time ASC")
+    query = db.dbQuery(sql, (str(ship), str(survey)))
+    wanted = None if transects is None else set([str(t) for t in transects])
+    return [(str(t), e, tm) for t, e, tm in query if wanted is None or str(t) in wanted]
+
+
+def checkTransect(transect, segments, anomalies, raw_index, dest_dir, ship, survey,
+        overwrite=False, just_missed=300):
+    '''
+    checkTransect checks a single transect given its segments and anomalies from
+    transectSegments.buildSegments and returns a TransectCheck.
+    '''
+    problems = []
+    warnings = [a.message for a in anomalies]
+    files = []
+
+    evFile = os.path.join(os.path.normpath(str(dest_dir)), evFileName(ship, survey, transect))
+    if os.path.exists(evFile) and not overwrite:
+        warnings.append('The EV file ' + os.path.basename(evFile) + ' already exists.')
+
+    if len(segments.start) == 0:
+        problems.append('Unable to determine any on-effort time spans from the transect events.')
+    elif len(raw_index) == 0:
+        problems.append('No .raw files found in raw file directory.')
+    else:
+        files, missing = raw_index.files(segments.start, segments.end, just_missed=just_missed)
+        for i in missing:
+            problems.append('There are no data files for the transect segment that starts at ' +
+                    str(segments.start[i]) + '.')
+
+    return TransectCheck(str(transect), evFile, files, problems, warnings)
+
+
+def runPreflight(transects, rows, raw_index, dest_dir, ship, survey, dataset_check=None,
+        overwrite=False, just_missed=300, workers=8):
+    '''
+    runPreflight checks all of the provided transects and returns a list of
+    TransectCheck tuples in the same order as transects.
+
+    rows are the transect_events rows from surveyEvents, raw_index is a
+    rawIndex.RawIndex and dataset_check is the optional result of checkDataset.
+    Data set and misnamed raw file problems apply to every transect.
+    '''
+    transects = [str(t) for t in transects]
+    wanted = set(transects)
+    rows = [r for r in rows if r[0] in wanted]
+
+    #  build every transect's segments in one pass
+    segments, anomalies = transectSegments.buildSegments([r[0] for r in rows],
+            [r[1] for r in rows], transectSegments.eventTimes([r[2] for r in rows]))
+
+    #  problems that apply to every transect
+    common = []
+    if dataset_check is not None:
+        common.extend(dataset_check.problems)
+    for name in raw_index.badNames:
+        common.append('The raw file ' + os.path.basename(name) + ' is misnamed. Raw files must ' +
+                'have the date and time in the name in the form DYYYYMMDD-Thhmmss.')
+
+    def check(transect):
+        mask = segments.transect == transect
+        transectSegs = transectSegments.Segments(segments.transect[mask], segments.start[mask],
+                segments.end[mask])
+        result = checkTransect(transect, transectSegs, [a for a in anomalies if a.transect == transect],
+                raw_index, dest_dir, ship, survey, overwrite=overwrite, just_missed=just_missed)
+        return result._replace(problems=common + result.problems)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(check, transects))
+
+
+def existingFiles(results):
+    '''
+    existingFiles returns the transects of the TransectCheck tuples without
+    problems whose EV file already exists
+    '''
+    return [r.transect for r in results if not r.problems and os.path.exists(r.ev_file)]
+
+
+def formatReport(results):
+    '''
+    formatReport returns a text report for a list of TransectCheck tuples
+    '''
+    lines = []
+    nBad = 0
+    for r in results:
+        if r.problems:
+            nBad += 1
+            lines.append('Transect ' + r.transect + ': SKIPPED')
+            lines.extend(['    ' + p for p in r.problems])
+        else:
+            lines.append('Transect ' + r.transect + ': OK (' + str(len(r.files)) + ' raw files)')
+        lines.extend(['    Warning- ' + w for w in r.warnings])
+    lines.append(str(len(results) - nBad) + ' of ' + str(len(results)) + ' transects are ready to build.')
+    return '\n'.join(lines)
@@ -0,0 +1,247 @@
+'''
+rawCoverage - raw data coverage and gap report for transect segments.
+
+Nobody used to know a transect was missing data until EVFileMaker complained
+that there were no data files for a segment. This module compares the
+on-effort segments from transect_events with the raw file time index and
+reports, for every segment and transect, the percentage of time covered by
+raw data, the gaps longer than a threshold and the number of bytes of raw
+data. Everything is vectorised so a survey with tens of thousands of raw
+files is analysed in well under a second.
+
+Raw file names only give the start time of a file, so the end of each file
+is estimated. By default a file is assumed to run until the next file starts
+unless that is longer than its size implies at the median recording rate
+(bytes per second) of the survey, in which case the recording is assumed to
+have stopped and the difference is reported as a gap. If the rate can't be
+estimated (the sizes aren't known) files run until the next file starts and
+the last file for the median file length. With a single raw file there is
+nothing to estimate its length from, so the coverage of the segments it
+would cover is reported as unknown rather than 0%.
+
+Run from the command line:
+
+    python -m EVFunctions.rawCoverage <raw dir> <odbc> <user> <password> -s <ship> -v <survey>
+'''
+
+from collections import namedtuple
+
+from EVFunctions.lazyImport import lazyImport
+numpy = lazyImport('numpy')
+
+from EVFunctions import transectSegments
+
+
+#  per segment coverage. gaps is a list of (start, end) datetime64 tuples, percent is nan if unknown
+SegmentCoverage = namedtuple('SegmentCoverage', ['transect', 'start', 'end', 'percent', 'gaps', 'bytes'])
+
+#  per transect coverage summary
+TransectCoverage = namedtuple('TransectCoverage', ['transect', 'duration', 'covered', 'percent',
+        'gaps', 'bytes', 'n_files', 'segments'])
+
+
+def fileSpans(times, sizes, rate_factor=1.5):
+    '''
+    fileSpans returns the estimated (start, end) datetime64[ms] arrays for sorted
+    raw file start times and sizes. If rate_factor is None files are assumed to
+    run until the next file starts. The last file is always assumed to be
+    recorded at the median rate. If there is no rate, files run until the next
+    file starts and the last one for the median file length. If the lengths
+    can't be estimated at all (see lengthsKnown) the ends are the starts.
+    '''
+    times = numpy.asarray(times, dtype='datetime64[ms]')
+    sizes = numpy.asarray(sizes, dtype=numpy.float64)
+    n = times.size
+    if n == 0:
+        return times, times.copy()
+
+    start = times.astype(numpy.int64)
+    nextStart = numpy.empty(n, dtype=numpy.int64)
+    nextStart[:-1] = start[1:]
+
+    #  estimate the recording rate in bytes per ms from consecutive files
+    interval = (nextStart[:-1] - start[:-1]).astype(numpy.float64)
+    valid = interval > 0
+    if numpy.any(valid):
+        rate = numpy.median(sizes[:-1][valid] / interval[valid])
+    else:
+        rate = 0
+    if rate > 0:
+        expected = (sizes / rate).astype(numpy.int64)
+    elif numpy.any(valid):
+        #  no usable sizes, so go by the time between files
+        expected = numpy.full(n, int(numpy.median(interval[valid])), dtype=numpy.int64)
+        rate_factor = None
+    else:
+        expected = numpy.zeros(n, dtype=numpy.int64)
+
+    if rate_factor is None:
+        end = nextStart
+        end[-1] = start[-1] + expected[-1]
+    else:
+        end = numpy.minimum(nextStart, start + (expected * rate_factor).astype(numpy.int64))
+        end[-1] = start[-1] + expected[-1]
+    end = numpy.maximum(end, start)
+
+    return start.astype('datetime64[ms]'), end.astype('datetime64[ms]')
+
+
+def lengthsKnown(times):
+    '''
+    lengthsKnown returns True if the lengths of raw files can be estimated from
+    their start times, i.e. there are at least two distinct start times
+    '''
+    times = numpy.asarray(times, dtype='datetime64[ms]')
+    return times.size > 1 and bool(numpy.any(times[1:] > times[:-1]))
+
+
+def segmentCoverage(seg_start, seg_end, file_start, file_end, sizes, gap_threshold=60):
+    '''
+    segmentCoverage computes the coverage of each segment by the file spans. File
+    spans must be sorted and non overlapping (see fileSpans). Returns a tuple
+    (percent, gaps, bytes) where percent and bytes are arrays with one element
+    per segment and gaps is a list (one element per segment) of lists of
+    (start, end) gaps longer than gap_threshold seconds.
+    '''
+    ss = numpy.asarray(seg_start, dtype='datetime64[ms]').astype(numpy.int64)
+    se = numpy.asarray(seg_end, dtype='datetime64[ms]').astype(numpy.int64)
+    fs = numpy.asarray(file_start, dtype='datetime64[ms]').astype(numpy.int64)
+    fe = numpy.asarray(file_end, dtype='datetime64[ms]').astype(numpy.int64)
+    sizes = numpy.asarray(sizes, dtype=numpy.int64)
+    nSeg = ss.size
+
+    if fs.size == 0:
+        gaps = [[(s.astype('datetime64[ms]'), e.astype('datetime64[ms]'))] if (e - s) > gap_threshold * 1000
+                else [] for s, e in zip(ss, se)]
+        return numpy.zeros(nSeg), gaps, numpy.zeros(nSeg, dtype=numpy.int64)
+
+    #  cumulative covered time at the start of each file
+    dur = fe - fs
+    cumDur = numpy.concatenate(([0], numpy.cumsum(dur)))
+
+    def covered(t):
+        k = numpy.searchsorted(fs, t, side='right') - 1
+        kk = numpy.maximum(k, 0)
+        c = cumDur[kk] + numpy.clip(t - fs[kk], 0, dur[kk])
+        return numpy.where(k < 0, 0, c)
+
+    length = se - ss
+    cov = covered(se) - covered(ss)
+    percent = numpy.where(length > 0, 100.0 * cov / numpy.maximum(length, 1), 0.0)
+
+    #  bytes of the files that overlap each segment
+    cumSize = numpy.concatenate(([0], numpy.cumsum(sizes)))
+    firstFile = numpy.searchsorted(fe, ss, side='right')
+    lastFile = numpy.searchsorted(fs, se, side='left')
+    nbytes = cumSize[numpy.maximum(lastFile, firstFile)] - cumSize[firstFile]
+
+    #  the uncovered intervals, including before the first and after the last file
+    gs = numpy.concatenate(([numpy.iinfo(numpy.int64).min], fe))
+    ge = numpy.concatenate((fs, [numpy.iinfo(numpy.int64).max]))
+    keep = ge > gs
+    gs = gs[keep]
+    ge = ge[keep]
+    g0 = numpy.searchsorted(ge, ss, side='right')
+    g1 = numpy.searchsorted(gs, se, side='left')
+    threshold = int(gap_threshold * 1000)
+    gaps = []
+    for i in range(nSeg):
+        a = numpy.maximum(gs[g0[i]:g1[i]], ss[i])
+        b = numpy.minimum(ge[g0[i]:g1[i]], se[i])
+        isLong = (b - a) > threshold
+        gaps.append([(x, y) for x, y in zip(a[isLong].astype('datetime64[ms]'),
+                b[isLong].astype('datetime64[ms]'))])
+
+    return percent, gaps, nbytes
+
+
+def surveyCoverage(rows, raw_index, gap_threshold=60, rate_factor=1.5):
+    '''
+    surveyCoverage computes the coverage of every transect in the transect_events
+    rows ((transect, event type, time string) tuples, see preflight.surveyEvents)
+    using a rawIndex.RawIndex. Returns a list of TransectCoverage tuples sorted
+    by transect.
+    '''
+    segments, anomalies = transectSegments.buildSegments([r[0] for r in rows],
+            [r[1] for r in rows], transectSegments.eventTimes([r[2] for r in rows]))
+
+    fs, fe = fileSpans(raw_index.times, raw_index.sizes, rate_factor=rate_factor)
+    percent, gaps, nbytes = segmentCoverage(segments.start, segments.end, fs, fe,
+            raw_index.sizes, gap_threshold=gap_threshold)
+    if fs.size > 0 and not lengthsKnown(raw_index.times):
+        #  the coverage of segments after the files start is unknown, not 0, and
+        #  there is no gap after them that we know of
+        unknown = segments.end > fs[-1]
+        percent = numpy.where(unknown, numpy.nan, percent)
+        gaps = [[g for g in segGaps if g[0] < fs[-1]] if unknown[i] else segGaps
+                for i, segGaps in enumerate(gaps)]
+
+    #  files touching each segment, so we can count each file once per transect
+    firstFile = numpy.searchsorted(fe, segments.start, side='right')
+    lastFile = numpy.searchsorted(fs, segments.end, side='left')
+
+    results = []
+    for transect in numpy.unique(segments.transect):
+        idx = numpy.flatnonzero(segments.transect == transect)
+        segs = [SegmentCoverage(str(transect), segments.start[i], segments.end[i], percent[i],
+                gaps[i], int(nbytes[i])) for i in idx]
+        length = (segments.end[idx] - segments.start[idx]).astype(numpy.int64)
+        covered = numpy.sum(length * percent[idx] / 100.0)
+        duration = numpy.sum(length)
+        touched = numpy.zeros(len(raw_index), dtype=bool)
+        for i in idx:
+            touched[firstFile[i]:lastFile[i]] = True
+        results.append(TransectCoverage(str(transect), duration / 1000.0, covered / 1000.0,
+                100.0 * covered / duration if duration > 0 else 0.0,
+                [g for s in segs for g in s.gaps], int(numpy.sum(raw_index.sizes[touched])),
+                int(numpy.sum(touched)), segs))
+
+    return sorted(results, key=lambda r: float(r.transect))
+
+
+def formatReport(results, show_gaps=True):
+    '''
+    formatReport returns a text report for a list of TransectCoverage tuples
+    '''
+    lines = ['%-10s %10s %8s %6s %8s %12s' % ('Transect', 'Duration', 'Covered', 'Gaps', 'Files', 'MB')]
+    for r in results:
+        covered = 'unknown' if numpy.isnan(r.percent) else '%7.1f%%' % r.percent
+        lines.append('%-10s %9.1fm %8s %6i %8i %12.1f' % (r.transect, r.duration / 60.0,
+                covered, len(r.gaps), r.n_files, r.bytes / 1048576.0))
+        if show_gaps:
+            for start, end in r.gaps:
+                lines.append('    gap %s to %s (%.1f min)' % (start, end,
+                        (end - start).astype(numpy.int64) / 60000.0))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import time
+    from EVFunctions import rawIndex, preflight, dbSession
+
+    parser = argparse.ArgumentParser(description='Raw data coverage report')
+    parser.add_argument("raw_dir", help="The raw data directory.")
+    parser.add_argument("odbc_connection", help="The name of the ODBC connection used to connect to the database.")
+    parser.add_argument("username", help="The username used to log into the database.")
+    parser.add_argument("password", help="The password for the specified username.")
+    parser.add_argument("-s", "--ship", required=True, help="The ship number.")
+    parser.add_argument("-v", "--survey", required=True, help="The survey number.")
+    parser.add_argument("-g", "--gap", type=float, default=60, help="Report gaps longer than this many seconds.")
+    parser.add_argument("-q", "--quiet", action='store_true', help="Don't list the individual gaps.")
+    args = parser.parse_args()
+
+    db = dbSession.getSession(args.odbc_connection, args.username, args.password, 'rawCoverage',
+            keepalive=0)
+    db.dbOpen()
+    rows = preflight.surveyEvents(db, args.ship, args.survey)
+    db.close()
+
+    start = time.perf_counter()
+    index = rawIndex.getIndex(args.raw_dir)
+    results = surveyCoverage(rows, index, gap_threshold=args.gap)
+    elapsed = time.perf_counter() - start
+
+    print(formatReport(results, show_gaps=not args.quiet))
+    print('%i raw files, %i transects analysed in %.2f s' % (len(index), len(results), elapsed))
@@ -0,0 +1,127 @@
+'''
+rawIndex - a time index of the .raw files in a raw data directory.
+
+The directory is listed once with os.scandir, the DYYYYMMDD-Thhmmss time
+stamp of every file is parsed and the files are sorted by time. Indexes are
+cached per directory and rebuilt when the directory is modified, so the
+preflight checks, coverage reports and EVFileMaker can all share one listing
+of what can be a very large directory.
+'''
+
+import os
+import threading
+
+from EVFunctions.lazyImport import lazyImport
+numpy = lazyImport('numpy')
+
+from EVFunctions import transectSegments
+
+
+#  cache of indexes keyed by normalised directory path
+_cache = {}
+_cacheLock = threading.Lock()
+
+
+class RawIndex(object):
+    '''
+    RawIndex holds the raw files in a directory sorted by their time stamps.
+
+    paths  - list of full paths, sorted by time
+    times  - datetime64[ms] array of file start times
+    sizes  - int64 array of file sizes in bytes
+    badNames - list of the paths of files without a valid time stamp
+    '''
+
+    def __init__(self, directory, paths, times, sizes, badNames):
+        self.directory = directory
+        self.paths = paths
+        self.times = times
+        self.sizes = sizes
+        self.badNames = badNames
+
+    def __len__(self):
+        return len(self.paths)
+
+    def select(self, seg_start, seg_end, just_missed=300):
+        '''
+        select returns the (first, last) index arrays of the files covering the
+        provided segments. See transectSegments.selectRawFiles.
+        '''
+        return transectSegments.selectRawFiles(seg_start, seg_end, self.times,
+                just_missed=just_missed)
+
+    def files(self, seg_start, seg_end, just_missed=300):
+        '''
+        files returns a tuple (paths, missing) where paths is the sorted list of
+        unique files covering the segments and missing is a list of the indexes
+        of segments that have no files.
+        '''
+        first, last = self.select(seg_start, seg_end, just_missed=just_missed)
+        keep = numpy.zeros(len(self.paths), dtype=bool)
+        missing = []
+        for i in range(len(first)):
+            if first[i] < 0:
+                missing.append(i)
+            else:
+                keep[first[i]:last[i] + 1] = True
+        return [self.paths[i] for i in numpy.flatnonzero(keep)], missing
+
+
+def buildIndex(directory, extension='.raw'):
+    '''
+    buildIndex lists the directory once and returns a RawIndex
+    '''
+    directory = os.path.normpath(str(directory))
+    paths = []
+    sizes = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(extension):
+                    paths.append(entry.path)
+                    sizes.append(entry.stat().st_size)
+    except FileNotFoundError:
+        pass
+
+    #  sort by name first so files with the same time stamp are in a stable order
+    byName = sorted(range(len(paths)), key=lambda i: paths[i])
+    paths = [paths[i] for i in byName]
+    sizes = numpy.array([sizes[i] for i in byName], dtype=numpy.int64)
+
+    #  then sort the files with valid time stamps by time
+    times, badNames = transectSegments.rawFileTimes(paths)
+    good = numpy.flatnonzero(~numpy.isnat(times))
+    order = good[numpy.argsort(times[good], kind='stable')]
+    paths = [paths[i] for i in order]
+
+    return RawIndex(directory, paths, times[order], sizes[order], badNames)
+
+
+def getIndex(directory, extension='.raw'):
+    '''
+    getIndex returns the cached RawIndex for a directory, rebuilding it if the
+    directory has been modified since the index was built.
+    '''
+    directory = os.path.normpath(str(directory))
+    try:
+        stamp = os.stat(directory).st_mtime
+    except OSError:
+        stamp = None
+
+    with _cacheLock:
+        cached = _cache.get((directory, extension))
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+    index = buildIndex(directory, extension=extension)
+    with _cacheLock:
+        _cache[(directory, extension)] = (stamp, index)
+    return index
+
+
+def clearCache():
+    '''
+    clearCache discards all cached indexes
+    '''
+    with _cacheLock:
+        _cache.clear()
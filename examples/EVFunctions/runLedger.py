@@ -0,0 +1,344 @@
+'''
+runLedger - a machine readable record of export and build runs.
+
+The only record of a run used to be the text in the Exporter's textBrowser
+or EVFileMaker's status label, and export_py_MB2 only returned a list of 0/1
+flags per zone. A RunLedger is a SQLite file (by default in ~/.EVFunctions,
+or set with the EV_RUN_LEDGER environment variable) that every run writes
+to:
+
+    runs      one row per run: tool, host, ship, survey, data set, the
+              parameters (JSON), start and end time and status
+    units     one row per unit of work: a transect, and for exports each
+              zone (and variable for multi-frequency exports) of a transect,
+              with its start and end time and status
+    stages    the time each unit spent in each stage (open, pre-read, grid
+              setup, integration export, line export, copy, ...)
+    outputs   the files each unit wrote and their sizes
+    inputs    the files each unit read (EV files, raw files) and their sizes,
+              used to scale timings when estimating new runs (exportPlanner)
+
+Code being timed calls unit.begin('stage name') at the start of each stage,
+which ends the previous stage, and unit.finish(status) at the end. A Run or
+Unit created without a ledger isn't written anywhere, so callers don't need
+to check whether a ledger is in use. Functions added with addListener are
+called with each unit as it finishes, whether or not there is a ledger
+(exportMetrics uses this).
+
+The ledger can be queried from the command line for throughput trends:
+
+    python -m EVFunctions.runLedger runs
+    python -m EVFunctions.runLedger throughput [--tool EchoviewExport]
+    python -m EVFunctions.runLedger stages [--survey 202407]
+'''
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+
+
+#  the environment variable that can be used to set the ledger file
+LEDGER_ENV_VAR = 'EV_RUN_LEDGER'
+
+#  the default ledger file
+DEFAULT_LEDGER = os.path.join(os.path.expanduser('~'), '.EVFunctions', 'run_ledger.sqlite')
+
+#  the functions called with (run, unit, status) when a unit finishes
+_listeners = []
+
+_SCHEMA = ['CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY AUTOINCREMENT, tool TEXT, ' +
+        'host TEXT, ship TEXT, survey TEXT, data_set TEXT, params TEXT, started REAL, finished REAL, ' +
+        'status TEXT)',
+        'CREATE TABLE IF NOT EXISTS units (unit_id INTEGER PRIMARY KEY AUTOINCREMENT, run_id INTEGER, ' +
+        'parent_id INTEGER, transect TEXT, zone TEXT, variable TEXT, ev_file TEXT, started REAL, ' +
+        'finished REAL, status TEXT)',
+        'CREATE TABLE IF NOT EXISTS stages (unit_id INTEGER, stage TEXT, seconds REAL)',
+        'CREATE TABLE IF NOT EXISTS outputs (unit_id INTEGER, path TEXT, bytes INTEGER)',
+        'CREATE TABLE IF NOT EXISTS inputs (unit_id INTEGER, path TEXT, bytes INTEGER)',
+        'CREATE INDEX IF NOT EXISTS units_run ON units (run_id)',
+        'CREATE INDEX IF NOT EXISTS stages_unit ON stages (unit_id)',
+        'CREATE INDEX IF NOT EXISTS outputs_unit ON outputs (unit_id)',
+        'CREATE INDEX IF NOT EXISTS outputs_path ON outputs (path)',
+        'CREATE INDEX IF NOT EXISTS inputs_unit ON inputs (unit_id)']
+
+
+class RunLedger(object):
+    '''
+    RunLedger is the ledger file. Runs and units can be recorded from any thread.
+    '''
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.environ.get(LEDGER_ENV_VAR, DEFAULT_LEDGER)
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self.lock, self._open() as connection:
+            for sql in _SCHEMA:
+                connection.execute(sql)
+
+    def _open(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _insert(self, sql, params):
+        with self.lock, self._open() as connection:
+            return connection.execute(sql, params).lastrowid
+
+    def _update(self, sql, params):
+        with self.lock, self._open() as connection:
+            connection.execute(sql, params)
+
+    def startRun(self, tool, ship=None, survey=None, data_set=None, params=None):
+        '''
+        startRun records the start of a run and returns its Run. params is a
+        params structure or dict, stored as JSON.
+        '''
+        if params is not None and not isinstance(params, dict):
+            params = vars(params)
+        runId = self._insert('INSERT INTO runs (tool, host, ship, survey, data_set, params, started, ' +
+                'status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (tool, socket.gethostname(),
+                _text(ship), _text(survey), _text(data_set), json.dumps(params, default=str),
+                time.time(), 'running'))
+        return Run(self, runId, tool)
+
+    def query(self, sql, params=()):
+        with self.lock, self._open() as connection:
+            return connection.execute(sql, params).fetchall()
+
+
+def addListener(listener):
+    '''
+    addListener adds a function that is called with (run, unit, status) when
+    a unit finishes. It is called on the thread that finished the unit.
+    '''
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def removeListener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def fileSize(path):
+    '''
+    fileSize returns the size of a file or None if it can't be read
+    '''
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+class Run(object):
+    '''
+    Run records the units of one run. A Run without a ledger records nothing
+    but its units are still passed to the listeners.
+    '''
+
+    def __init__(self, ledger=None, run_id=None, tool=None):
+        self.ledger = ledger
+        self.id = run_id
+        self.tool = tool
+        self.openUnits = []
+        self.lock = threading.Lock()
+
+    def unit(self, transect=None, zone=None, variable=None, ev_file=None, parent=None):
+        '''
+        unit starts timing a unit of the run and returns it
+        '''
+        unit = Unit(self, transect, zone, variable, ev_file, parent)
+        with self.lock:
+            self.openUnits.append(unit)
+        return unit
+
+    def finish(self, status='ok'):
+        '''
+        finish records the end of the run. Units that weren't finished (because
+        of an exception, for example) are recorded with the status 'error'.
+        '''
+        with self.lock:
+            units = list(self.openUnits)
+        for unit in units:
+            unit.finish('error')
+        if self.ledger is not None:
+            self.ledger._update('UPDATE runs SET finished=?, status=? WHERE run_id=?',
+                    (time.time(), status, self.id))
+
+
+class Unit(object):
+    '''
+    Unit times the stages of one unit of work and records its outputs
+    '''
+
+    def __init__(self, run, transect, zone, variable, ev_file, parent):
+        self.run = run
+        self.transect = transect
+        self.zone = zone
+        self.variable = variable
+        self.evFile = ev_file
+        self.parent = parent
+        self.started = time.time()
+        self.stages = []
+        self.outputs = []
+        self.inputs = []
+        self.current = None
+        self.currentStart = None
+        self.id = None
+        self.finished = False
+
+    def begin(self, stage):
+        '''
+        begin ends the current stage, if any, and starts timing the named stage
+        '''
+        now = time.time()
+        if self.current is not None:
+            self.stages.append((self.current, now - self.currentStart))
+        self.current = stage
+        self.currentStart = now
+
+    def end(self):
+        '''
+        end ends the current stage
+        '''
+        if self.current is not None:
+            self.stages.append((self.current, time.time() - self.currentStart))
+            self.current = None
+
+    def output(self, path):
+        '''
+        output records a file written by the unit and its current size
+        '''
+        self.outputs.append((path, fileSize(path)))
+
+    def input(self, path):
+        '''
+        input records a file read by the unit and its current size
+        '''
+        self.inputs.append((path, fileSize(path)))
+
+    def child(self, zone=None, variable=None):
+        '''
+        child starts a unit for a zone and/or variable of this unit's transect
+        '''
+        return self.run.unit(self.transect, zone, variable or self.variable, self.evFile, parent=self)
+
+    def finish(self, status='ok'):
+        '''
+        finish ends the current stage and writes the unit to the ledger
+        '''
+        if self.finished:
+            return
+        self.finished = True
+        self.end()
+        with self.run.lock:
+            if self in self.run.openUnits:
+                self.run.openUnits.remove(self)
+        for listener in list(_listeners):
+            listener(self.run, self, status)
+        ledger = self.run.ledger
+        if ledger is None:
+            return
+        parentId = None
+        if self.parent is not None:
+            #  write the parent first so the child can refer to it
+            if self.parent.id is None:
+                self.parent._write(ledger, 'running')
+            parentId = self.parent.id
+        self._write(ledger, status, parentId)
+
+    def _write(self, ledger, status, parent_id=None):
+        if self.id is None:
+            self.id = ledger._insert('INSERT INTO units (run_id, parent_id, transect, zone, variable, ' +
+                    'ev_file, started, finished, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (self.run.id, parent_id, _text(self.transect), _text(self.zone),
+                    _text(self.variable), _text(self.evFile), self.started, time.time(), status))
+        else:
+            ledger._update('UPDATE units SET finished=?, status=? WHERE unit_id=?',
+                    (time.time(), status, self.id))
+        if not self.finished:
+            return
+        with ledger.lock, ledger._open() as connection:
+            connection.executemany('INSERT INTO stages VALUES (?, ?, ?)',
+                    [(self.id, stage, seconds) for stage, seconds in self.stages])
+            connection.executemany('INSERT INTO outputs VALUES (?, ?, ?)',
+                    [(self.id, path, size) for path, size in self.outputs])
+            connection.executemany('INSERT INTO inputs VALUES (?, ?, ?)',
+                    [(self.id, path, size) for path, size in self.inputs])
+
+
+def formatRows(header, rows):
+    '''
+    formatRows returns rows as a text table
+    '''
+    rows = [['' if v is None else (('%.2f' % v) if isinstance(v, float) else str(v)) for v in row]
+            for row in rows]
+    widths = [max([len(h)] + [len(r[i]) for r in rows]) for i, h in enumerate(header)]
+    lines = ['  '.join([h.ljust(w) for h, w in zip(header, widths)])]
+    for row in rows:
+        lines.append('  '.join([v.ljust(w) for v, w in zip(row, widths)]))
+    return '\n'.join(lines)
+
+
+def _filters(args):
+    where = []
+    params = []
+    if args.tool:
+        where.append('r.tool = ?')
+        params.append(args.tool)
+    if args.survey:
+        where.append('r.survey = ?')
+        params.append(args.survey)
+    return (' WHERE ' + ' AND '.join(where)) if where else '', params
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Query the export and build run ledger')
+    parser.add_argument("report", choices=['runs', 'throughput', 'stages'], help="The report to show.")
+    parser.add_argument("--ledger", default=None, help="The ledger file.")
+    parser.add_argument("--tool", default=None, help="Only include runs of this tool.")
+    parser.add_argument("--survey", default=None, help="Only include runs for this survey.")
+    parser.add_argument("-n", "--limit", type=int, default=20, help="The number of runs to list.")
+    args = parser.parse_args()
+
+    ledger = RunLedger(args.ledger)
+    where, params = _filters(args)
+    if args.report == 'runs':
+        rows = ledger.query("SELECT r.run_id, r.tool, r.host, r.survey, r.data_set, " +
+                "datetime(r.started, 'unixepoch', 'localtime'), r.finished - r.started, " +
+                "(SELECT COUNT(*) FROM units u WHERE u.run_id = r.run_id AND u.parent_id IS NULL), " +
+                "r.status FROM runs r" + where + " ORDER BY r.run_id DESC LIMIT ?", params + [args.limit])
+        print(formatRows(['Run', 'Tool', 'Host', 'Survey', 'Data set', 'Started', 'Seconds',
+                'Transects', 'Status'], rows))
+    elif args.report == 'throughput':
+        #  transect units are the units without a parent
+        rows = ledger.query("SELECT r.tool, r.survey, COUNT(DISTINCT r.run_id), COUNT(u.unit_id), " +
+                "SUM(u.finished - u.started) / 3600.0, " +
+                "COUNT(u.unit_id) * 3600.0 / SUM(u.finished - u.started), " +
+                "AVG(u.finished - u.started), " +
+                "SUM(CASE WHEN u.status = 'ok' THEN 1 ELSE 0 END), " +
+                "(SELECT SUM(o.bytes) FROM outputs o JOIN units u2 ON o.unit_id = u2.unit_id " +
+                "JOIN runs r2 ON u2.run_id = r2.run_id WHERE r2.tool = r.tool AND " +
+                "r2.survey IS r.survey) / 1048576.0 " +
+                "FROM runs r JOIN units u ON u.run_id = r.run_id AND u.parent_id IS NULL" + where +
+                " GROUP BY r.tool, r.survey ORDER BY MIN(r.started)", params)
+        print(formatRows(['Tool', 'Survey', 'Runs', 'Transects', 'Hours', 'Transects/h',
+                'Mean s', 'OK', 'Output MB'], rows))
+    else:
+        rows = ledger.query("SELECT r.tool, r.survey, s.stage, COUNT(*), SUM(s.seconds), AVG(s.seconds) " +
+                "FROM stages s JOIN units u ON s.unit_id = u.unit_id JOIN runs r ON u.run_id = r.run_id" +
+                where + " GROUP BY r.tool, r.survey, s.stage ORDER BY r.tool, r.survey, SUM(s.seconds) DESC",
+                params)
+        print(formatRows(['Tool', 'Survey', 'Stage', 'Count', 'Seconds', 'Mean s'], rows))
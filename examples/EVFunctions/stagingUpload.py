@@ -0,0 +1,222 @@
+'''
+stagingUpload - lets Echoview write exports to a local staging directory and
+                moves the finished transect bundles to the network share in
+                the background.
+
+export_py_MB2 used to point every Echoview export (and the calibration file
+copy) straight at the output directory. When that is a slow share Echoview
+blocks on every remote write. With staging enabled each transect is exported
+into its own bundle directory under a local staging root. When the transect
+is finished the bundle is queued and an Uploader copies it to the final
+location on a small pool of threads while Echoview moves on to the next
+transect.
+
+Each file is copied to a temporary name next to its destination, verified
+(size and SHA-1) and then renamed into place with os.replace, so a partly
+written file never appears under its final name. Uploaded files are removed
+from the bundle. A bundle that can't be uploaded stays in staging with a
+manifest recording its destination, so it can be retried, including after a
+restart, without re-running the export.
+'''
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+#  the manifest written to a bundle when it is complete and ready to upload
+MANIFEST_NAME = '.upload.json'
+
+
+def fileDigest(path, block_size=1048576):
+    '''
+    fileDigest returns the SHA-1 hex digest of a file
+    '''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def uploadFile(source, destination, verify=True):
+    '''
+    uploadFile copies source to a temporary file next to destination, verifies
+    the copy and renames it into place.
+    '''
+    directory = os.path.dirname(destination)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    temp = destination + '.partial-' + str(os.getpid()) + '-' + str(threading.get_ident())
+    try:
+        shutil.copyfile(source, temp)
+        if verify:
+            if os.path.getsize(temp) != os.path.getsize(source):
+                raise IOError('Size mismatch after copying ' + os.path.basename(source))
+            if fileDigest(temp) != fileDigest(source):
+                raise IOError('Checksum mismatch after copying ' + os.path.basename(source))
+        os.replace(temp, destination)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+class Uploader(object):
+    '''
+    Uploader moves staged bundles to their destinations in the background.
+
+    staging_root is the local directory bundles are created in, workers is the
+    number of files copied at once and retries is the number of times a bundle
+    is retried before it is left in staging. on_status is called from the
+    upload threads with a message string.
+    '''
+
+    def __init__(self, staging_root, workers=2, retries=3, retry_delay=10, verify=True,
+            on_status=None):
+        self.stagingRoot = os.path.normpath(str(staging_root))
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.retryDelay = retry_delay
+        self.verify = verify
+        self.onStatus = on_status
+        #  bundles are uploaded one at a time, files within a bundle in parallel
+        self.bundleExecutor = ThreadPoolExecutor(max_workers=1)
+        self.fileExecutor = ThreadPoolExecutor(max_workers=self.workers)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.failed = {}
+        if not os.path.isdir(self.stagingRoot):
+            os.makedirs(self.stagingRoot)
+
+    def _status(self, message):
+        if self.onStatus is not None:
+            self.onStatus(message)
+
+    def stageDir(self, bundle_name):
+        '''
+        stageDir creates (if needed) and returns an empty staging directory for
+        a bundle. Bundles are usually named after the transect's EV file.
+        '''
+        path = os.path.join(self.stagingRoot, bundle_name)
+        #  don't reuse a bundle that is already queued for upload
+        n = 1
+        while os.path.exists(os.path.join(path, MANIFEST_NAME)):
+            n += 1
+            path = os.path.join(self.stagingRoot, bundle_name + '-' + str(n))
+        #  a bundle without a manifest was never submitted, it's what is left of an
+        #  export that crashed and mustn't be uploaded with this one
+        if os.path.isdir(path) and os.listdir(path):
+            shutil.rmtree(path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def submit(self, bundle_dir, destination):
+        '''
+        submit marks a bundle as complete and queues it for upload to the
+        destination directory. Returns the future for the upload.
+        '''
+        with open(os.path.join(bundle_dir, MANIFEST_NAME), 'w') as f:
+            json.dump({'destination': destination, 'created': time.time()}, f)
+        return self._queue(bundle_dir, destination)
+
+    def _queue(self, bundle_dir, destination):
+        with self.lock:
+            self.failed.pop(bundle_dir, None)
+            future = self.bundleExecutor.submit(self._upload, bundle_dir, destination)
+            self.pending[bundle_dir] = future
+        return future
+
+    def _bundleFiles(self, bundle_dir):
+        files = []
+        for root, dirs, names in os.walk(bundle_dir):
+            for name in names:
+                if name != MANIFEST_NAME and '.partial-' not in name:
+                    path = os.path.join(root, name)
+                    files.append((path, os.path.relpath(path, bundle_dir)))
+        return files
+
+    def _upload(self, bundle_dir, destination):
+        name = os.path.basename(bundle_dir)
+        attempt = 0
+        while True:
+            errors = []
+
+            def upload(item):
+                path, relative = item
+                uploadFile(path, os.path.join(destination, relative), verify=self.verify)
+                #  once it is safely at the destination we don't need the staged copy
+                os.remove(path)
+
+            files = self._bundleFiles(bundle_dir)
+            futures = [(item, self.fileExecutor.submit(upload, item)) for item in files]
+            for item, future in futures:
+                error = future.exception()
+                if error is not None:
+                    errors.append(item[1] + ': ' + str(error))
+
+            if not errors:
+                shutil.rmtree(bundle_dir, ignore_errors=True)
+                with self.lock:
+                    self.pending.pop(bundle_dir, None)
+                self._status('Uploaded ' + name + ' (' + str(len(files)) + ' files) to ' + destination)
+                return True
+
+            attempt += 1
+            if attempt > self.retries:
+                with self.lock:
+                    self.pending.pop(bundle_dir, None)
+                    self.failed[bundle_dir] = errors
+                self._status('Upload of ' + name + ' failed, it has been left in ' + bundle_dir +
+                        ' and will be retried later. ' + '; '.join(errors))
+                return False
+            self._status('Upload of ' + name + ' failed, retrying (' + str(attempt) + ' of ' +
+                    str(self.retries) + ')')
+            time.sleep(self.retryDelay * attempt)
+
+    def recover(self):
+        '''
+        recover queues every complete bundle left in the staging directory, for
+        example after a failed upload or a restart. Returns the number queued.
+        '''
+        count = 0
+        for entry in os.scandir(self.stagingRoot):
+            manifest = os.path.join(entry.path, MANIFEST_NAME)
+            if entry.is_dir() and os.path.exists(manifest):
+                with self.lock:
+                    if entry.path in self.pending:
+                        continue
+                with open(manifest, 'r') as f:
+                    destination = json.load(f)['destination']
+                self._queue(entry.path, destination)
+                count += 1
+        return count
+
+    def busy(self):
+        with self.lock:
+            return len(self.pending) > 0
+
+    def failedBundles(self):
+        with self.lock:
+            return dict(self.failed)
+
+    def wait(self, timeout=None):
+        '''
+        wait waits for the queued uploads to finish and returns True if they all
+        succeeded.
+        '''
+        with self.lock:
+            futures = list(self.pending.values())
+        results = [f.result(timeout=timeout) for f in futures]
+        return all(results) and not self.failedBundles()
+
+    def shutdown(self, wait=False):
+        self.bundleExecutor.shutdown(wait=wait)
+        self.fileExecutor.shutdown(wait=wait)
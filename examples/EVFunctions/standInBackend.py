@@ -0,0 +1,255 @@
+'''
+standInBackend - an Echoview stand-in for running the export code without
+                 Echoview.
+
+The export tools can only run on Windows machines with an Echoview scripting
+licence. StandInBackend implements the backend interface in plain Python so
+the export logic, the job board and the daemon can be run (and timed) on any
+machine, including several worker processes on one Linux box:
+
+    EV_BACKEND=standin python -m EVFunctions.jobBoard work <board>
+
+Files, filesets, variables and lines are simple objects. A file has a few
+common lines and any line or variable that is looked up is created on the
+fly, so it works with any data set's parameters. The exports write small
+placeholder files to the requested paths. Each call sleeps for
+EV_STANDIN_DELAY seconds (0 by default) to stand in for COM latency.
+
+If EV_STANDIN_PROCESS is set, start runs a child Python process that stands
+in for the Echoview process. It is shared by every StandInBackend in a
+process, as Echoview is, grows by EV_STANDIN_PROCESS MB and one open file
+handle for every file that is opened or created, and is ended by quit. Its
+id is returned by processId, so the echoviewWatchdog can be run on Linux.
+'''
+
+import os
+import sys
+import time
+import subprocess
+
+from EVFunctions import evBackend
+
+
+#  the environment variable with the per call delay in seconds
+DELAY_ENV_VAR = 'EV_STANDIN_DELAY'
+
+#  the lines every stand-in file starts with
+DEFAULT_LINES = ['surface_exclusion', 'bottom_exclusion', 'Mean of all sounder-detected bottom lines']
+
+#  the environment variable with the MB the stand-in Echoview process leaks per file
+PROCESS_ENV_VAR = 'EV_STANDIN_PROCESS'
+
+#  the stand-in Echoview process. It holds on to a block of memory and a
+#  file handle for every line read from stdin and answers each line when done
+PROCESS_SCRIPT = '''
+import os, sys
+held = []
+print('ready', flush=True)
+for line in sys.stdin:
+    held.append((b'x' * int(float(line) * 1048576), open(os.devnull)))
+    print('ok', flush=True)
+'''
+
+#  the running stand-in Echoview process
+_process = None
+
+
+class StandInObject(object):
+    '''
+    StandInObject is the handle returned for files, filesets, variables and lines
+    '''
+    def __init__(self, kind, name, **attrs):
+        self.kind = kind
+        self.Name = name
+        self.__dict__.update(attrs)
+
+    def __repr__(self):
+        return '<' + self.kind + ' ' + str(self.Name) + '>'
+
+
+class StandInBackend(evBackend.EchoviewBackend):
+    '''
+    StandInBackend implements the backend interface without Echoview
+    '''
+
+    def __init__(self, delay=None, leak_mb=None):
+        if delay is None:
+            delay = float(os.environ.get(DELAY_ENV_VAR, 0))
+        if leak_mb is None and os.environ.get(PROCESS_ENV_VAR):
+            leak_mb = float(os.environ[PROCESS_ENV_VAR])
+        self.delay = delay
+        self.leakMb = leak_mb
+        self.started = False
+
+    def _wait(self):
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+    def _write(self, path, text):
+        self._wait()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            return 0
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+        return 1
+
+    def _leak(self):
+        if _process is not None and _process.poll() is None:
+            _process.stdin.write((str(self.leakMb) + '\n').encode())
+            _process.stdin.flush()
+            _process.stdout.readline()
+
+    def start(self):
+        global _process
+        if self.leakMb is not None and (_process is None or _process.poll() is not None):
+            _process = subprocess.Popen([sys.executable, '-c', PROCESS_SCRIPT], stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE)
+            _process.stdout.readline()
+        self.started = True
+        return True
+
+    def quit(self):
+        global _process
+        if _process is not None:
+            _process.stdin.close()
+            _process.wait()
+            _process.stdout.close()
+            _process = None
+        self.started = False
+
+    def processId(self):
+        '''
+        processId returns the id of the stand-in Echoview process, or None
+        '''
+        if _process is None or _process.poll() is not None:
+            return None
+        return _process.pid
+
+    def openFile(self, path):
+        self._wait()
+        if not os.path.exists(path):
+            return None
+        self._leak()
+        evFile = StandInObject('file', os.path.basename(path), path=path, lines=[], variables={},
+                filesets={}, dataPaths=[], dataFiles=[], calibration=None)
+        for name in DEFAULT_LINES:
+            evFile.lines.append(StandInObject('line', name))
+        return evFile
+
+    def newFile(self, template):
+        self._wait()
+        self._leak()
+        return StandInObject('file', os.path.basename(template), path=template, lines=[],
+                variables={}, filesets={}, dataPaths=[], dataFiles=[], calibration=None)
+
+    def saveFileAs(self, evFile, path):
+        return self._write(path, 'stand-in EV file')
+
+    def closeFile(self, evFile):
+        self._wait()
+
+    def preReadDataFiles(self, evFile):
+        self._wait()
+
+    def addDataPath(self, evFile, path):
+        evFile.dataPaths.append(path)
+
+    def findFileset(self, evFile, name):
+        return evFile.filesets.setdefault(name, StandInObject('fileset', name, calibration=None))
+
+    def addDataFile(self, evFile, path, fileset_index=0):
+        evFile.dataFiles.append(path)
+        return True
+
+    def setCalibrationFile(self, fileset, path):
+        self._wait()
+        fileset.calibration = path
+        return os.path.exists(path)
+
+    def findVariable(self, evFile, name):
+        self._wait()
+        return evFile.variables.setdefault(name, StandInObject('variable', name, evFile=evFile))
+
+    def listVariables(self, evFile):
+        return list(evFile.variables.items())
+
+    def setThresholds(self, evVar, apply_min, min_value=None, apply_max=0, max_value=None):
+        evVar.thresholds = (apply_min, min_value, apply_max, max_value)
+
+    def setTimeDistanceGrid(self, evVar, grid_class, length):
+        evVar.grid = (grid_class, length)
+        return True
+
+    def setDepthRangeGrid(self, evVar, mode, thickness):
+        evVar.depthGrid = (mode, thickness)
+        return True
+
+    def setDepthRangeReferenceLine(self, evVar, evLine):
+        evVar.referenceLine = evLine
+
+    def setExcludeAboveLine(self, evVar, name):
+        evVar.excludeAbove = name
+
+    def setExcludeBelowLine(self, evVar, name):
+        evVar.excludeBelow = name
+
+    def enableExportVariables(self, evFile, names):
+        evFile.exportVariables = list(names)
+
+    def findLine(self, evFile, name):
+        self._wait()
+        for evLine in evFile.lines:
+            if evLine.Name == name:
+                return evLine
+        evLine = StandInObject('line', name)
+        evFile.lines.append(evLine)
+        return evLine
+
+    def listLines(self, evFile):
+        return [(evLine.Name, evLine) for evLine in evFile.lines]
+
+    def createOffsetLinear(self, evFile, evLine, multiplier, offset, span_gaps=None):
+        self._wait()
+        newLine = StandInObject('line', 'Line ' + str(len(evFile.lines) + 1), source=evLine,
+                multiplier=multiplier, offset=offset)
+        evFile.lines.append(newLine)
+        return newLine
+
+    def createFixedDepth(self, evFile, depth):
+        newLine = StandInObject('line', 'Line ' + str(len(evFile.lines) + 1), depth=depth)
+        evFile.lines.append(newLine)
+        return newLine
+
+    def overwriteLine(self, evLine, source):
+        return True
+
+    def deleteLine(self, evFile, evLine):
+        if evLine in evFile.lines:
+            evFile.lines.remove(evLine)
+        return True
+
+    def renameLine(self, evLine, name):
+        evLine.Name = name
+
+    def isLineEditable(self, evLine):
+        return True
+
+    def importFile(self, evFile, path):
+        self._wait()
+        return os.path.exists(path)
+
+    def exportRegionsLog(self, evVar, path):
+        return self._write(path, 'Region_ID,Region_name')
+
+    def exportIntegrationByRegionsByCells(self, evVar, path):
+        return self._write(path, 'Region_ID,Interval,Layer,Sv_mean') == 1
+
+    def exportLine(self, evVar, evLine, path, start_ping=-1, end_ping=-1):
+        return self._write(path, 'EVBD 3 ' + str(evLine.Name)) == 1
+
+    def exportRegionDefinitions(self, evFile, path):
+        return self._write(path, 'EVRG 7 0')
+
+
+evBackend.registerBackend('standin', StandInBackend)
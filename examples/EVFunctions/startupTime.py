@@ -0,0 +1,102 @@
+'''
+startupTime - checks that the core EVFunctions modules stay cheap to import.
+
+Each check runs in a fresh interpreter so nothing is already imported. The
+script imports every core module, runs a headless command (the exportFiles
+listing of a scratch directory of EV files) and fails if that takes longer
+than the target or if PyQt6, win32com or numpy were imported along the way.
+
+Run from the examples directory:
+
+    python -m EVFunctions.startupTime [-t <target seconds>] [-r <repeats>]
+
+The exit status is 0 if the check passes and 1 if it fails.
+'''
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+
+#  the modules that make up the core package
+CORE_MODULES = ['evBackend', 'comTrace', 'evrFile', 'evlFile', 'exportFiles', 'lineRegionIndex',
+        'preflight', 'rawCoverage', 'rawIndex', 'transectSegments']
+
+#  modules the core must not import at import time
+HEAVY_MODULES = ['PyQt6', 'win32com', 'numpy']
+
+#  the default target in seconds for importing the core and running the command
+DEFAULT_TARGET = 0.5
+
+#  the script run in the child interpreter. It prints a JSON result.
+_CHILD = '''
+import sys, json, time
+start = time.perf_counter()
+for name in %(modules)r:
+    __import__('EVFunctions.' + name)
+imported = time.perf_counter()
+from EVFunctions import exportFiles
+exportFiles.exportJobs(%(input_dir)r, '202407', 'ALL')
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'total': done - start,
+        'heavy': [m for m in %(heavy)r if m in sys.modules]}))
+'''
+
+
+def measure(input_dir, package_dir=None):
+    '''
+    measure runs the import and headless command in a new interpreter and
+    returns a dict with the import time, total time and any heavy modules
+    that were imported.
+    '''
+    if package_dir is None:
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = _CHILD % {'modules': CORE_MODULES, 'input_dir': input_dir, 'heavy': HEAVY_MODULES}
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=package_dir)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def checkStartup(target=DEFAULT_TARGET, repeats=5):
+    '''
+    checkStartup measures the startup repeats times and returns a tuple
+    (passed, best result, list of problems). The best of the runs is compared
+    with the target so a busy machine doesn't cause a false failure.
+    '''
+    input_dir = tempfile.mkdtemp(prefix='evstartup')
+    try:
+        for t in range(1, 51):
+            name = 'v157-s202407-x2-f38-t%03i-z0.EV' % t
+            open(os.path.join(input_dir, name), 'w').close()
+        results = [measure(input_dir) for i in range(max(1, repeats))]
+    finally:
+        shutil.rmtree(input_dir, ignore_errors=True)
+
+    best = min(results, key=lambda r: r['total'])
+    problems = []
+    if best['total'] > target:
+        problems.append('Importing the core and listing the export took %.3f s, the target is %.3f s' %
+                (best['total'], target))
+    heavy = sorted(set([m for r in results for m in r['heavy']]))
+    if heavy:
+        problems.append('The core imported ' + ', '.join(heavy) + ' at startup')
+    return len(problems) == 0, best, problems
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check the EVFunctions startup time')
+    parser.add_argument("-t", "--target", type=float, default=DEFAULT_TARGET, help="The target time in seconds.")
+    parser.add_argument("-r", "--repeats", type=int, default=5, help="The number of times to run the check.")
+    args = parser.parse_args()
+
+    passed, best, problems = checkStartup(target=args.target, repeats=args.repeats)
+    print('import %.3f s, import and command %.3f s (target %.3f s)' % (best['import'], best['total'],
+            args.target))
+    for problem in problems:
+        print('FAILED: ' + problem)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,207 @@
+'''
+traceSpans - nested, timed spans that can be opened in a trace viewer.
+
+EVFileMaker.makeFile used to report its progress only by overwriting the
+status label ('Loading template...', 'Adding .raw files...'), so there was
+no way to tell which stage of a survey's build was slow. A Tracer records
+nested spans with start times, durations and attributes (file counts, bytes,
+the indexing wait, the number of lines imported, ...) and writes them as a
+Chrome trace file, which can be opened in chrome://tracing or
+https://ui.perfetto.dev, or as plain JSON.
+
+Spans are used as context managers or ended explicitly:
+
+    tracer = Tracer('EVFileMaker')
+    with tracer.span('makeFile', transect='5') as build:
+        stage = build.stage('add raw files', raw_files=12)
+        ...
+        stage = build.stage('pre-read')   # ends 'add raw files'
+        with stage.child('settle'):
+            ...
+    tracer.writeChromeTrace('build.trace.json')
+
+A trace file can be summarised by span name, slowest first:
+
+    python -m EVFunctions.traceSpans <trace file>
+'''
+
+import os
+import json
+import time
+import threading
+
+
+#  the default directory trace files are written to
+DEFAULT_TRACE_DIR = os.path.join(os.path.expanduser('~'), '.EVFunctions', 'traces')
+
+
+class Span(object):
+    '''
+    Span is a timed, named operation with attributes and child spans
+    '''
+
+    def __init__(self, tracer, name, parent, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attrs = dict(attrs)
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.finish = None
+        self.current = None
+
+    @property
+    def duration(self):
+        end = self.finish if self.finish is not None else time.perf_counter()
+        return end - self.start
+
+    def set(self, **attrs):
+        '''
+        set sets attributes of the span
+        '''
+        self.attrs.update(attrs)
+        return self
+
+    def child(self, name, **attrs):
+        '''
+        child starts a span nested in this one
+        '''
+        return self.tracer._start(name, self, attrs)
+
+    def stage(self, name, **attrs):
+        '''
+        stage ends the current stage of this span, if any, and starts a child
+        span for the next one
+        '''
+        if self.current is not None:
+            self.current.end()
+        self.current = self.child(name, **attrs)
+        return self.current
+
+    def end(self):
+        '''
+        end ends the span and its current stage
+        '''
+        if self.current is not None:
+            self.current.end()
+            self.current = None
+        if self.finish is None:
+            self.finish = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__ + ': ' + str(exc_value)
+        self.end()
+        return False
+
+
+class Tracer(object):
+    '''
+    Tracer collects the spans of a process
+    '''
+
+    def __init__(self, name='trace'):
+        self.name = name
+        self.spans = []
+        self.lock = threading.Lock()
+        #  span times are perf_counter times, origin relates them to the wall clock
+        self.origin = time.perf_counter()
+        self.started = time.time()
+
+    def _start(self, name, parent, attrs):
+        span = Span(self, name, parent, attrs)
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    def span(self, name, **attrs):
+        '''
+        span starts a top level span
+        '''
+        return self._start(name, None, attrs)
+
+    def end(self):
+        '''
+        end ends any spans that are still open, e.g. ones left by an early return
+        '''
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            if span.finish is None:
+                span.end()
+
+    def chromeTrace(self):
+        '''
+        chromeTrace returns the spans in the Chrome trace event format
+        '''
+        pid = os.getpid()
+        with self.lock:
+            spans = list(self.spans)
+        threads = {}
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': self.name}}]
+        for span in spans:
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            events.append({'name': span.name, 'cat': span.parent.name if span.parent else self.name,
+                    'ph': 'X', 'pid': pid, 'tid': tid,
+                    'ts': round((span.start - self.origin) * 1e6, 1),
+                    'dur': round(span.duration * 1e6, 1), 'args': span.attrs})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'name': self.name, 'started': self.started}}
+
+    def spanList(self):
+        '''
+        spanList returns the spans as a list of dicts with the parent's index
+        '''
+        with self.lock:
+            spans = list(self.spans)
+        index = dict([(id(span), i) for i, span in enumerate(spans)])
+        return [{'id': i, 'parent': index.get(id(span.parent)), 'name': span.name,
+                'start': self.started + span.start - self.origin, 'duration': span.duration,
+                'attributes': span.attrs} for i, span in enumerate(spans)]
+
+    def writeChromeTrace(self, path):
+        self._write(path, self.chromeTrace())
+
+    def writeJson(self, path):
+        self._write(path, {'name': self.name, 'started': self.started, 'spans': self.spanList()})
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1, default=str)
+
+
+def summarizeTrace(path):
+    '''
+    summarizeTrace returns a list of (name, count, total seconds, max seconds)
+    for the spans in a Chrome trace or JSON span file, slowest first
+    '''
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if 'traceEvents' in data:
+        durations = [(e['name'], e['dur'] / 1e6) for e in data['traceEvents'] if e.get('ph') == 'X']
+    else:
+        durations = [(s['name'], s['duration']) for s in data['spans']]
+    summary = {}
+    for name, seconds in durations:
+        count, total, longest = summary.get(name, (0, 0.0, 0.0))
+        summary[name] = (count + 1, total + seconds, max(longest, seconds))
+    return sorted([(name,) + values for name, values in summary.items()], key=lambda s: -s[2])
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarise a trace file by span name')
+    parser.add_argument("trace", help="The Chrome trace or JSON span file.")
+    args = parser.parse_args()
+
+    print('%-36s %8s %10s %10s' % ('Span', 'Count', 'Seconds', 'Max'))
+    for name, count, total, longest in summarizeTrace(args.trace):
+        print('%-36s %8i %10.2f %10.2f' % (name, count, total, longest))
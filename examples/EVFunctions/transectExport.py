@@ -0,0 +1,382 @@
+'''
+transectExport - exports one transect's EV file for Macebase2.
+
+This is the body of Exporter.export_py_MB2, moved out of the dialog so it can
+be run without the GUI (see exportDaemon). Everything it used to take from
+the dialog is now passed in: the export type and threshold flags are params
+attributes (export_type, apply_min_thresh and apply_max_thresh), messages go
+to a log function, and the exclusion line offset lookup is a function of
+(line name, 'upper' or 'lower'), e.g. one returned by
+exportParameters.lineOffsetLookup.
+
+If a runLedger.Run is passed the transect is recorded as a unit of the run,
+with a child unit for each zone (and variable of a multi-frequency export),
+along with the time spent in each stage and the files written.
+'''
+
+import os
+
+from EVFunctions import calibrationStore, evRegistry, lineExportCache, runLedger, exportMetrics
+
+
+#  the multi-frequency variables exported after '38 kHz for survey', differing only in the
+#  variable, thresholds and output file name suffix. Entries are:
+#  (variable, label, apply thresholds, min threshold attribute, max threshold attribute, file suffix)
+MF_VARIABLES = [('120 kHz for survey', '120 kHz for survey', 1, 'v120min', 'v120max', 'z'),
+        ('Autokrill for export', 'Autokrill', 1, 'autokrillmin', 'autokrillmax', 'k1'),
+        ('Autokrill mean z for export', 'Autokrill mean z', 0, None, None, 'k2'),
+        ('Autopollock for export', 'Autopollock', 1, 'autopollockmin', 'autopollockmax', 'p1'),
+        ('Autopollock mean z for export', 'Autopollock mean z', 0, None, None, 'p2')]
+
+#  the multi-frequency variable whose zones' exclusion lines are exported
+MF_LINE_VARIABLE = '38 kHz for survey'
+
+
+def exportName(ev_file):
+    '''
+    exportName returns the name the outputs of an EV file are given, the file
+    name up to the zone e.g. v157-s202407-x2-f38-t005-z0.ev -> v157-s202407-x2-f38-t005
+    '''
+    filename = os.path.basename(ev_file)
+    return filename[:filename.find('-z')]
+
+
+def lineReference(line_type, ref, offset):
+    '''
+    lineReference returns the reference text used in an exclusion line's file
+    name, e.g. '5.0 below surface'
+    '''
+    if line_type == 'upper':
+        if float(offset)<=0:
+            return str(-float(offset))+' above '+ ref.lower()
+        return str(float(offset))+' below '+ ref.lower()
+    if float(offset)<0:
+        return str(-float(offset))+' above '+ ref.lower()
+    return str(-float(offset))+' below '+ ref.lower()
+
+
+def lineFileName(line_dir, export_name, line, ref_string, zone, line_type):
+    '''
+    lineFileName returns the path a zone's upper or lower exclusion line is exported to
+    '''
+    return line_dir+os.sep+export_name+'-'+line+'-'+ref_string+'-z'+str(zone)+'-'+line_type+'.evl'
+
+
+def integrationFileName(out_dir, export_name, zone, suffix=None):
+    '''
+    integrationFileName returns the path a zone's integration is exported to.
+    suffix is None for single variable exports or a multi-frequency variable's
+    file suffix. Only the 'z' suffix includes the zone.
+    '''
+    if suffix is None:
+        return out_dir + os.sep + export_name + '-z' + str(zone) +'-' +'.csv'
+    #  edited name on 7/3/2016 by nel requested by patrick
+    if suffix == 'z':
+        return out_dir + os.sep + export_name + 'z' + str(zone) +'.csv'
+    return out_dir + os.sep + export_name + suffix +'.csv'
+
+
+def exportTransect(ev, files, params, log, line_offset, uploader=None, calibration_store=None,
+        raw_dir=None, quit_echoview=True, run=None):
+    '''
+    exportTransect exports the first of a transect's EV files with a started
+    backend and returns a list with a 1 (exported) or 0 (failed) for each zone
+    of a single variable export.
+
+    uploader is an optional stagingUpload.Uploader to stage the outputs with
+    and calibration_store the calibrationStore.CalibrationStore params.calibration
+    was added to. If raw_dir is given the EV file's raw data path is reset to
+    it first. Echoview is shut down afterwards unless quit_echoview is False.
+    run is an optional runLedger.Run to record the transect in.
+    '''
+    EvFileName = str(files[0]) #pick the file
+    EvExportName = exportName(EvFileName) #chop off the .EV
+    if run is None:
+        run = runLedger.Run()
+    #  time the backend calls if metrics are enabled
+    ev = exportMetrics.meterBackend(ev)
+    unit = run.unit(EvExportName, variable=params.Variable_for_export, ev_file=EvFileName)
+    unit.input(EvFileName)
+    unit.begin('open')
+    #  with staging enabled the outputs are written to a local bundle that is uploaded when we're done
+    if uploader is not None:
+        outDir = uploader.stageDir(EvExportName)
+    else:
+        outDir = params.output_dir_mb2
+    log('\nExporting for Macebase 2...')
+    log('Working on '+ str(EvFileName))
+    #  the line export cache identifies the EV file as it was before it is re-saved below
+    evId = lineExportCache.fileIdentity(EvFileName)
+    if raw_dir is not None:
+        # reset the raw data directory
+        log('Setting new raw file directory')
+        EvFile = ev.openFile(EvFileName) #Open up the file
+        ev.addDataPath(EvFile, raw_dir)
+        ev.saveFileAs(EvFile, EvFileName)
+        ev.closeFile(EvFile)
+    log('Loading raw files...')
+    EvFile = ev.openFile(EvFileName) #Open up the file
+    #  look up the file's lines and variables once, the exports below resolve names from the registry
+    registry = evRegistry.EvRegistry(ev, EvFile)
+    Evfileset = ev.findFileset(EvFile, params.Fileset)
+    EvVar = registry.variable(params.Variable_for_export)
+    unit.begin('grid setup')
+    # Set up cal file
+    if not ev.setCalibrationFile(Evfileset, params.calibration.path):
+        log('Failed to set .ecs file')
+        log(EvExportName)
+    #  link the stored calibration file into the export directory and record it in the
+    #  transect's run metadata. Staged bundles only get the metadata so it isn't uploaded again.
+    unit.begin('copy')
+    linked = None
+    if uploader is None and calibration_store is not None:
+        linked = calibration_store.link(params.calibration, outDir + os.sep + EvExportName + '-calibration-.ecs')
+    calibrationStore.writeRunMetadata(outDir + os.sep + EvExportName + '-run.json',
+            calibrationStore.calibrationMetadata(params.calibration, linked))
+    unit.output(outDir + os.sep + EvExportName + '-run.json')
+    unit.begin('grid setup')
+
+    # set grid settings- params.int_class is set above using combination of types and units-
+    # 1 is time (in minutes), 2 is GPS distance (nmi), 3 is vessel log (nmi), 4 is distance (pings), 5 is GPS distance (m), 6 is vessel log (m)
+    ev.setTimeDistanceGrid(EvVar, params.int_class, params.EDSU_length)
+
+
+    # Single variable export
+    if params.export_type==0:
+        ev.enableExportVariables(EvFile, ['Date_E', 'Lat_E', 'Lon_E', 'Time_E', 'Region_notes',
+                'Grid_reference_line', 'Layer_bottom_to_reference_line_depth',
+                'Layer_top_to_reference_line_depth', 'Samples_In_Domain', 'Good_samples',
+                'No_data_samples', 'Sv_max'])
+
+        ev.setThresholds(EvVar, params.apply_min_thresh, getattr(params, 'min_int_threshold', None),
+                params.apply_max_thresh, getattr(params, 'max_int_threshold', None))
+
+        unit.begin('regions export')
+        ExportFileName = outDir + os.sep + EvExportName + '- (regions).csv' #output .csv filename
+        exporttest1 = ev.exportRegionsLog(EvVar, ExportFileName)
+        if exporttest1 != 1:
+            log('Error: Unable to make regions logbook \n')
+        unit.output(ExportFileName)
+
+        # Create a subfolder called 'Regions'
+        regionOutDir = outDir + os.sep + 'Regions'
+        dirExist = os.path.exists(regionOutDir)
+        if not dirExist:
+            os.mkdir(regionOutDir)
+        # Export Regions file
+        ExportFileName = regionOutDir + os.sep + EvExportName + '-regions.evr'
+        exporttest = ev.exportRegionDefinitions(EvFile, ExportFileName)
+        unit.output(ExportFileName)
+        
+        
+        # Create a subfolder called 'Lines'
+        lineOutDir = outDir + os.sep + 'Lines'
+        dirExist = os.path.exists(lineOutDir)
+        if not dirExist:
+            os.mkdir(lineOutDir)
+        #  lines are only exported once per run and not at all if they're up to date in the output directory
+        lineCache = lineExportCache.LineExportCache(ev, EvFileName, '.' + EvExportName + '-lines.json',
+                params.output_dir_mb2 + os.sep + 'Lines', ev_id=evId)
+
+        #  the zones are timed as units of their own
+        unit.end()
+        zonesExported=[]
+        exported_line_names = []
+        for z in range(len(params.zone)): #for each zone
+            cur_zone=params.zone[z]
+            zoneUnit = unit.child(zone=cur_zone)
+            zoneUnit.begin('grid setup')
+            ev.setDepthRangeGrid(EvVar, 1, params.layer_thickness[z])
+            try:
+                # Reference line
+                if params.layerReferenceName!='Surface (depth of zero)':
+                    # Set an offset for non-surface referenced exports. The offset line is
+                    #  created for the first zone and reused for the rest.
+                    NewEvLine = registry.offsetLine(params.layerReferenceName, params.reference_offset)
+                    if not NewEvLine:
+                        raise ValueError('Reference line ' + str(params.layerReferenceName) + ' not found')
+                    ev.setDepthRangeReferenceLine(EvVar, NewEvLine)
+                log('Exporting Zone '+str(cur_zone)+'...')
+                zoneUnit.begin('line export')
+                # Deal with lines:
+                # Set exclude above line
+                cur_line = str(params.exclude_above_line[z])
+                exported_line_names.append(cur_line)
+                ev.setExcludeAboveLine(EvVar, cur_line) # set exclude above line
+                # Export exclude above line
+                line_ref = registry.line(cur_line)
+                ref,  offset = line_offset(cur_line, 'upper')
+                ref_string = lineReference('upper', ref, offset)
+                test = lineCache.exportLine(EvVar, line_ref, cur_line, lineFileName(lineOutDir, EvExportName,
+                        cur_line, ref_string, cur_zone, 'upper'), ref_string)
+                if not test:
+                    log('There was a problem exporting the exclude above line file for zone'+str(cur_zone))
+                # Set exclude below line
+                cur_line = str(params.exclude_below_line[z])
+                exported_line_names.append(cur_line)
+                ev.setExcludeBelowLine(EvVar, cur_line) # set exclude below line
+                line_ref = registry.line(cur_line)
+                ref,  offset = line_offset(cur_line, 'lower')
+                ref_string = lineReference('lower', ref, offset)
+                # Export exclude below line
+                test = lineCache.exportLine(EvVar, line_ref, cur_line, lineFileName(lineOutDir, EvExportName,
+                        cur_line, ref_string, cur_zone, 'lower'), ref_string)
+                if not test:
+                    log('There was a problem exporting the exclude above line file for zone'+str(cur_zone))
+                
+                # Now complete the final export
+                zoneUnit.begin('integration export')
+                ExportFileName = integrationFileName(outDir, EvExportName, cur_zone) #output .csv filename
+                exporttest = ev.exportIntegrationByRegionsByCells(EvVar, ExportFileName)
+                zoneUnit.output(ExportFileName)
+            except:
+                exporttest=False
+                log('There is no exclude_above and/or exclude_below line associated with zone '+str(cur_zone)+' specified or it does not match a line in the EV file' )
+
+            if exporttest != True:
+                log('The export has failed for zone '+str(cur_zone))
+                zonesExported.append(0)
+                zoneUnit.finish('failed')
+            else:
+                log('Zone '+ str(cur_zone) +' Export Complete')
+                zonesExported.append(1)
+                zoneUnit.finish('ok')
+        # Export the rest of the lines
+        unit.begin('line export')
+        for EvName, EvLine in registry.listLines():
+            # For now, we will skip the 'Fileset1: line data...' lines since these should be included with the raw file and the colon is causing issues
+            isReject = EvName.find(':')
+            #  and the offset lines made for the zones' reference, which aren't part of the file
+            if EvName not in exported_line_names and isReject==-1 and not registry.isCreated(EvName):
+                lineCache.exportLine(EvVar, EvLine, EvName, lineOutDir+os.sep+EvExportName+'-'+EvName+'.evl')
+
+    # Multi-frequency export setup and execution
+    else:
+        zonesExported=[] # Fill this in because it will be returned at the end but not used for multi-frequency
+        #use the Item method to get a handle to the status of each export variable and enable it
+        ev.enableExportVariables(EvFile, ['Good_samples', 'Kurtosis', 'Skewness', 'Sv_mean',
+                'Standard_deviation'])
+
+        # Create a subfolder called 'Regions'
+        regionOutDir = outDir + os.sep + 'Regions'
+        dirExist = os.path.exists(regionOutDir)
+        if not dirExist:
+            os.mkdir(regionOutDir)
+        # Export Regions file
+        ExportFileName = regionOutDir + os.sep + EvExportName + '-regions.evr'
+        exporttest = ev.exportRegionDefinitions(EvFile, ExportFileName)
+        unit.output(ExportFileName)
+        
+        
+        # Create a subfolder called 'Lines'
+        lineOutDir = outDir + os.sep + 'Lines'
+        dirExist = os.path.exists(lineOutDir)
+        if not dirExist:
+            os.mkdir(lineOutDir)
+        #  lines are only exported once per run and not at all if they're up to date in the output directory
+        lineCache = lineExportCache.LineExportCache(ev, EvFileName, '.' + EvExportName + '-lines.json',
+                params.output_dir_mb2 + os.sep + 'Lines', ev_id=evId)
+
+        unit.end()
+        #The following sections are for the export of individual variables.  Each variable is exported if it is found within the list set within
+        #the parameters, assuming it was checked on the GUI.
+        if MF_LINE_VARIABLE in params.variable_export_list:
+            variable_for_export = MF_LINE_VARIABLE
+            EvVar = registry.variable(variable_for_export)
+            ev.setThresholds(EvVar, 1, params.v38min, 1, params.v38max)
+            for k in range(len(params.zone)):
+                zone = params.zone[k]
+                zoneUnit = unit.child(zone=zone, variable=variable_for_export)
+                zoneUnit.begin('grid setup')
+                ev.setDepthRangeGrid(EvVar, 1, params.layer_thickness[k])
+                # Reference line
+                if params.layerReferenceName!='Surface (depth of zero)':
+                    EvLine = registry.line(params.layerReferenceName)
+                    ev.setDepthRangeReferenceLine(EvVar, EvLine)
+                log('Exporting 38 kHz for survey from zone '+ str(zone))
+                zoneUnit.begin('line export')
+                # Deal with lines:
+                # Set exclude above line
+                cur_line = str(params.exclude_above_line[k])
+                ev.setExcludeAboveLine(EvVar, cur_line) # set exclude above line
+                # Export exclude above line
+                line_ref = registry.line(cur_line)
+                ref,  offset = line_offset(cur_line, 'upper')
+                ref_string = lineReference('upper', ref, offset)
+                test = lineCache.exportLine(EvVar, line_ref, cur_line, lineFileName(lineOutDir, EvExportName,
+                        cur_line, ref_string, zone, 'upper'), ref_string)
+                if not test:
+                    log('There was a problem exporting the exclude above line file for zone'+str(zone))
+                # Set exclude below line
+                cur_line = str(params.exclude_below_line[k])
+                ev.setExcludeBelowLine(EvVar, cur_line) # set exclude below line
+                line_ref = registry.line(cur_line)
+                ref,  offset = line_offset(cur_line, 'lower')
+                ref_string = lineReference('lower', ref, offset)
+                # Export exclude below line
+                test = lineCache.exportLine(EvVar, line_ref, cur_line, lineFileName(lineOutDir, EvExportName,
+                        cur_line, ref_string, zone, 'lower'), ref_string)
+                if not test:
+                    log('There was a problem exporting the exclude above line file for zone'+str(zone))
+                    
+                zoneUnit.begin('integration export')
+                ExportFileName = integrationFileName(outDir, EvExportName, zone, 'z') #output .csv filename
+                exporttest = ev.exportIntegrationByRegionsByCells(EvVar, ExportFileName)
+                zoneUnit.output(ExportFileName)
+                if exporttest != 1:
+                    log('The export has failed for zone '+str(zone))
+                    log(ExportFileName)
+                    zoneUnit.finish('failed')
+                else:
+                    log('Zone '+ str(zone) +' Export Complete')
+                    zoneUnit.finish('ok')
+
+        #  the remaining variables are exported in the same way
+        for variable_for_export, label, applyThresh, minAttr, maxAttr, suffix in MF_VARIABLES:
+            if variable_for_export not in params.variable_export_list:
+                continue
+            EvVar = registry.variable(variable_for_export)
+            if applyThresh:
+                ev.setThresholds(EvVar, 1, getattr(params, minAttr), 1, getattr(params, maxAttr))
+            else:
+                ev.setThresholds(EvVar, 0, None, 0, None)
+            for k in range(len(params.zone)):
+                zone = params.zone[k]
+                zoneUnit = unit.child(zone=zone, variable=variable_for_export)
+                zoneUnit.begin('grid setup')
+                ev.setDepthRangeGrid(EvVar, 1, params.layer_thickness[k])
+                # Reference line
+                if params.layerReferenceName!='Surface (depth of zero)':
+                    EvLine = registry.line(params.layerReferenceName)
+                    ev.setDepthRangeReferenceLine(EvVar, EvLine)
+                log('Exporting ' + label + ' from zone '+ str(zone))
+                ev.setExcludeAboveLine(EvVar, str(params.exclude_above_line[k]))  #this is working even though it spits gibberish to the screen
+                ev.setExcludeBelowLine(EvVar, str(params.exclude_below_line[k]))
+                ExportFileName = integrationFileName(outDir, EvExportName, zone, suffix)
+                zoneUnit.begin('integration export')
+                exporttest = ev.exportIntegrationByRegionsByCells(EvVar, ExportFileName)
+                zoneUnit.output(ExportFileName)
+                if exporttest != 1:
+                    log('The export has failed for zone '+str(zone))
+                    log(ExportFileName)
+                    zoneUnit.finish('failed')
+                else:
+                    log('Zone '+ str(zone) +' Export Complete')
+                    zoneUnit.finish('ok')
+    
+    unit.begin('copy')
+    lineCache.save(lineOutDir)
+    log(lineCache.summary())
+    unit.begin('close')
+    ev.closeFile(EvFile) #close .ev file
+    if quit_echoview:
+        ev.quit() #quit echoview to refresh for next .EV file, just in case
+    if uploader is not None:
+        unit.begin('copy')
+        uploader.submit(outDir, params.output_dir_mb2)
+        log('Queued ' + EvExportName + ' for upload to ' + params.output_dir_mb2)
+    if params.export_type == 0 and (not zonesExported or sum(zonesExported) < len(zonesExported)):
+        unit.finish('failed' if not any(zonesExported) else 'partial')
+    else:
+        unit.finish('ok')
+    return zonesExported
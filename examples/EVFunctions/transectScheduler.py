@@ -0,0 +1,283 @@
+'''
+transectScheduler - hands out the longest transects first so a run finishes sooner.
+
+Exporter.export() exports transects in the order they were typed or found
+and EVFileMaker builds them in reverse list order. When a run is spread over
+several Echoview instances (job board workers) a long transect that is
+started last keeps one worker busy long after the others have finished.
+TransectScheduler estimates each transect's cost and gives a worker that
+asks for work the most expensive transect left (longest processing time
+first). Transects are handed out as workers become free, not split between
+the workers up front, so the assignment follows the durations actually
+achieved, and every finished transect refits the cost model so the
+projected end of the run is updated as it goes.
+
+A transect's cost is estimated from, in order of preference:
+
+    its own duration in the run ledger, if the same EV file has been exported
+    its size (EV file plus raw files, see exportPlanner.transectSize) times
+        the seconds per byte of the ledger history and of this run so far
+    the mean transect duration, if sizes aren't known
+
+Ping counts aren't used: they would mean reading every raw file before the
+run starts, and for a given sounder configuration the raw bytes are
+proportional to the pings. With no history at all transects are ordered by
+size until the first one finishes.
+
+    scheduler = TransectScheduler(CostModel.fromLedger(ledger), workers=3)
+    for job in jobs:
+        scheduler.add(job.transect, size, job, key=job.files[0])
+    scheduled = scheduler.next(worker)
+    ...
+    scheduler.finish(scheduled)
+    print(scheduler.report())
+'''
+
+import os
+import time
+import heapq
+
+from EVFunctions import exportPlanner
+
+
+#  the number of recent transects the cost model is based on
+HISTORY_LENGTH = exportPlanner.HISTORY_LENGTH
+
+
+def lptMakespan(costs, loads):
+    '''
+    lptMakespan returns the time the last worker finishes if the costs are
+    handed out largest first to the worker that is free first. loads is the
+    time until each worker is free.
+    '''
+    loads = list(loads)
+    heapq.heapify(loads)
+    for cost in sorted(costs, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + cost)
+    return max(loads) if loads else 0.0
+
+
+class CostModel(object):
+    '''
+    CostModel predicts a transect's seconds from its size in bytes. history is
+    a list of (seconds, size) and durations a dict of key -> seconds for
+    transects that have been run before.
+    '''
+
+    def __init__(self, history=(), durations=None):
+        self.seconds = 0.0
+        self.bytes = 0
+        self.total = 0.0
+        self.count = 0
+        self.durations = dict(durations or {})
+        for seconds, size in history:
+            self.observe(size, seconds)
+
+    @classmethod
+    def fromLedger(cls, ledger, tools=exportPlanner.EXPORT_TOOLS, limit=HISTORY_LENGTH):
+        '''
+        fromLedger returns a CostModel fitted to the most recent transects the
+        tools finished in a runLedger.RunLedger, or an empty one if ledger is None
+        '''
+        if ledger is None:
+            return cls()
+        rawSizes = exportPlanner.rawBytes(ledger)
+        rows = ledger.query("SELECT u.ev_file, u.finished - u.started, " +
+                "(SELECT SUM(i.bytes) FROM inputs i WHERE i.unit_id = u.unit_id), " +
+                "(SELECT COUNT(*) FROM inputs i WHERE i.unit_id = u.unit_id AND LOWER(i.path) NOT LIKE '%.ev') " +
+                "FROM units u JOIN runs r ON r.run_id = u.run_id WHERE u.parent_id IS NULL AND " +
+                "u.status = 'ok' AND r.tool IN (" + ','.join(['?'] * len(tools)) + ") " +
+                "ORDER BY u.unit_id DESC LIMIT ?", tuple(tools) + (limit,))
+        history = []
+        durations = {}
+        for evFile, seconds, inputBytes, rawInputs in rows:
+            size = (inputBytes or 0)
+            if evFile:
+                #  an EVFileMaker build's inputs are the raw files rawBytes has for its EV file
+                if not rawInputs:
+                    size += rawSizes.get(exportPlanner._key(evFile), 0)
+                #  rows are newest first, keep the latest duration of each file
+                durations.setdefault(exportPlanner._key(evFile), seconds or 0)
+            history.append((seconds or 0, size))
+        return cls(history, durations)
+
+    def observe(self, size, seconds, key=None):
+        '''
+        observe adds a finished transect to the model
+        '''
+        self.total += seconds
+        self.count += 1
+        if size:
+            self.seconds += seconds
+            self.bytes += size
+        if key is not None:
+            self.durations[exportPlanner._key(key)] = seconds
+
+    def predict(self, size, key=None):
+        '''
+        predict returns the predicted seconds for a transect, or None if there
+        is nothing to base it on
+        '''
+        if key is not None and exportPlanner._key(key) in self.durations:
+            return self.durations[exportPlanner._key(key)]
+        if size and self.bytes > 0:
+            return size * self.seconds / self.bytes
+        if self.count > 0:
+            return self.total / self.count
+        return None
+
+
+class ScheduledTransect(object):
+    '''
+    ScheduledTransect is a transect in a schedule. item is whatever the caller
+    needs to run it, e.g. an exportFiles job.
+    '''
+
+    def __init__(self, name, size, item, key):
+        self.name = name
+        self.size = size
+        self.item = item
+        self.key = key
+        self.predicted = None
+        self.worker = None
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return '<ScheduledTransect ' + str(self.name) + '>'
+
+
+class TransectScheduler(object):
+    '''
+    TransectScheduler hands out transects to workers longest first
+    '''
+
+    def __init__(self, model=None, workers=1):
+        self.model = model if model is not None else CostModel()
+        self.workers = max(1, workers)
+        self.transects = []
+        self.predictedMakespan = None
+
+    def add(self, name, size=0, item=None, key=None):
+        '''
+        add adds a transect. key identifies it in the model's durations,
+        normally its EV file.
+        '''
+        transect = ScheduledTransect(name, size or 0, item, key)
+        self.transects.append(transect)
+        return transect
+
+    def _predict(self):
+        for transect in self.transects:
+            if transect.finished is None:
+                transect.predicted = self.model.predict(transect.size, transect.key)
+
+    def _pending(self):
+        return [t for t in self.transects if t.started is None]
+
+    def plan(self):
+        '''
+        plan returns the pending transects in the order they will be handed
+        out. The first plan of a run sets predictedMakespan.
+        '''
+        self._predict()
+        pending = sorted(self._pending(), key=lambda t: (t.predicted or 0, t.size), reverse=True)
+        if self.predictedMakespan is None and not [t for t in self.transects if t.started is not None] and \
+                all([t.predicted is not None for t in pending]):
+            self.predictedMakespan = lptMakespan([t.predicted for t in pending], [0.0] * self.workers)
+        return pending
+
+    def next(self, worker=0):
+        '''
+        next returns the most expensive pending transect for a worker and marks
+        it started, or None if there are none left
+        '''
+        pending = self.plan()
+        if not pending:
+            return None
+        transect = pending[0]
+        transect.worker = worker
+        transect.started = time.time()
+        return transect
+
+    def finish(self, transect, seconds=None, ok=True):
+        '''
+        finish marks a transect finished and, if it ran to the end, adds its
+        duration to the model. seconds defaults to the time since it started.
+        '''
+        transect.finished = time.time()
+        if seconds is None:
+            seconds = transect.finished - transect.started
+        if ok:
+            self.model.observe(transect.size, seconds, transect.key)
+
+    def achievedMakespan(self):
+        '''
+        achievedMakespan returns the seconds from the first start to the last
+        finish, or None if nothing has finished
+        '''
+        started = [t.started for t in self.transects if t.started is not None]
+        finished = [t.finished for t in self.transects if t.finished is not None]
+        if not finished:
+            return None
+        return max(finished) - min(started)
+
+    def projectedMakespan(self):
+        '''
+        projectedMakespan returns the predicted seconds for the whole run from
+        the durations so far and the refitted model, or None if there is no
+        prediction for some transect
+        '''
+        self._predict()
+        if any([t.predicted is None for t in self.transects if t.finished is None]):
+            return None
+        started = [t.started for t in self.transects if t.started is not None]
+        if not started:
+            return lptMakespan([t.predicted for t in self.transects], [0.0] * self.workers)
+        now = time.time()
+        running = [t for t in self.transects if t.started is not None and t.finished is None]
+        loads = [max(0.0, t.started + t.predicted - now) for t in running]
+        loads += [0.0] * max(0, self.workers - len(running))
+        return now - min(started) + lptMakespan([t.predicted for t in self._pending()], loads)
+
+    def report(self):
+        '''
+        report returns a line comparing the predicted and achieved makespan
+        '''
+        achieved = self.achievedMakespan()
+        text = str(len([t for t in self.transects if t.finished is not None])) + ' transect(s) on ' + \
+                str(self.workers) + ' worker(s)'
+        if self.predictedMakespan is not None:
+            text += ', predicted ' + exportPlanner.formatDuration(self.predictedMakespan)
+        else:
+            text += ', no prediction (no timing history)'
+        if achieved is not None:
+            text += ', achieved ' + exportPlanner.formatDuration(achieved)
+            if self.predictedMakespan:
+                text += ' (%+i%%)' % round(100.0 * (achieved - self.predictedMakespan) / self.predictedMakespan)
+        return text
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from EVFunctions import runLedger
+
+    parser = argparse.ArgumentParser(description='Show the largest first order and predicted makespan ' +
+            'of EV files')
+    parser.add_argument("files", nargs='+', help="The EV files to export.")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="The number of workers.")
+    parser.add_argument("--ledger", default=None, help="The run ledger file.")
+    args = parser.parse_args()
+
+    ledger = runLedger.RunLedger(args.ledger)
+    rawSizes = exportPlanner.rawBytes(ledger)
+    scheduler = TransectScheduler(CostModel.fromLedger(ledger), args.workers)
+    for path in args.files:
+        scheduler.add(os.path.basename(path), exportPlanner.transectSize(path, rawSizes), key=path)
+    for transect in scheduler.plan():
+        print('%-40s %14i %12s' % (transect.name, transect.size, '-' if transect.predicted is None else
+                exportPlanner.formatDuration(transect.predicted)))
+    if scheduler.predictedMakespan is not None:
+        print('Predicted makespan on ' + str(scheduler.workers) + ' worker(s): ' +
+                exportPlanner.formatDuration(scheduler.predictedMakespan))
@@ -0,0 +1,270 @@
+'''
+transectSegments - turns transect_events rows into on-effort segments and
+                   selects the .raw files that cover them.
+
+The original EVFileMaker.makeFile built its start/end lists with repeated
+events.index('BT')/pop calls, which assumed well ordered ST/BT/RT/ET events
+and fell over on duplicated or missing events. The functions here treat the
+event stream as a simple on/off effort signal:
+
+    ST, RT  ->  effort on
+    BT, ET  ->  effort off
+
+Only transitions of that signal start or end a segment, so duplicated events,
+breaks without a resume and so on are reported as anomalies instead of
+breaking the build. All of the work is done with numpy datetime64 arrays so
+a whole survey can be processed in a single call.
+'''
+
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from EVFunctions.lazyImport import lazyImport
+numpy = lazyImport('numpy')
+
+
+#  event types that turn effort on and off
+EFFORT_ON = ('ST', 'RT')
+EFFORT_OFF = ('BT', 'ET')
+
+#  the format of the times returned by TO_CHAR(time) in our transect_events queries
+EVENT_TIME_FORMAT = '%m/%d/%Y %H:%M:%S.%f'
+
+#  the date/time stamp embedded in EK60/EK80 raw file names
+RAW_TIME_REGEX = re.compile('D([0-9]{4})([0-9]{2})([0-9]{2})-T([0-9]{2})([0-9]{2})([0-9]{2})')
+
+#  segments are returned as parallel arrays
+Segments = namedtuple('Segments', ['transect', 'start', 'end'])
+
+#  anomaly kinds are one of: 'duplicate start', 'unmatched break', 'unmatched end',
+#  'unterminated segment', 'zero length', 'overlap', 'no data files', 'misnamed file'
+Anomaly = namedtuple('Anomaly', ['transect', 'kind', 'time', 'message'])
+
+#  per transect result of surveySegments
+TransectSegments = namedtuple('TransectSegments', ['start', 'end', 'files'])
+
+
+def eventTimes(time_strings):
+    '''
+    eventTimes converts the TO_CHAR(time) strings returned by the database into
+    a datetime64[ms] array.
+    '''
+    times = [datetime.strptime(str(t), EVENT_TIME_FORMAT) for t in time_strings]
+    return numpy.array(times, dtype='datetime64[ms]')
+
+
+def rawFileTimes(filenames):
+    '''
+    rawFileTimes extracts the DYYYYMMDD-Thhmmss time stamp from a list of raw
+    file names and returns a tuple (times, badNames) where times is a
+    datetime64[ms] array (NaT for misnamed files) and badNames is a list of
+    the file names that did not contain a valid time stamp.
+    '''
+    stamps = []
+    badNames = []
+    for name in filenames:
+        match = RAW_TIME_REGEX.search(os.path.basename(name))
+        if match:
+            stamps.append('%s-%s-%sT%s:%s:%s' % match.groups())
+        else:
+            stamps.append('NaT')
+            badNames.append(name)
+
+    return numpy.array(stamps, dtype='datetime64[ms]'), badNames
+
+
+def buildSegments(transects, event_types, event_times, merge_gap=0):
+    '''
+    buildSegments converts a stream of transect events into a normalised list of
+    on-effort segments. The three arguments are parallel sequences (one element
+    per transect_events row) and may contain any number of transects in any
+    order. event_times must be datetime64 values (see eventTimes).
+
+    Segments from the same transect that are separated by merge_gap seconds or
+    less are merged. Zero length segments are dropped.
+
+    Returns a tuple (segments, anomalies) where segments is a Segments tuple of
+    arrays sorted by transect and start time and anomalies is a list of Anomaly
+    tuples describing everything that was cleaned up along the way.
+    '''
+    transects = numpy.asarray(transects).astype(str)
+    event_types = numpy.char.upper(numpy.asarray(event_types).astype(str))
+    event_times = numpy.asarray(event_times, dtype='datetime64[ms]')
+    anomalies = []
+
+    #  drop events that don't affect effort and sort by transect, then time. The
+    #  on/off flag is the last sort key so ties resolve to on->off.
+    isOn = numpy.isin(event_types, EFFORT_ON)
+    keep = isOn | numpy.isin(event_types, EFFORT_OFF)
+    transects = transects[keep]
+    event_types = event_types[keep]
+    event_times = event_times[keep]
+    isOn = isOn[keep]
+    order = numpy.lexsort((~isOn, event_times, transects))
+    transects = transects[order]
+    event_types = event_types[order]
+    event_times = event_times[order]
+    state = isOn[order].astype(numpy.int8)
+
+    if state.size == 0:
+        empty = numpy.array([], dtype='datetime64[ms]')
+        return Segments(numpy.array([], dtype=str), empty, empty.copy()), anomalies
+
+    #  get the effort state prior to each event, resetting at the start of every transect
+    groupStart = numpy.ones(state.size, dtype=bool)
+    groupStart[1:] = transects[1:] != transects[:-1]
+    prevState = numpy.roll(state, 1)
+    prevState[groupStart] = 0
+
+    #  events that don't change the state are anomalies
+    for i in numpy.flatnonzero(state == prevState):
+        if state[i]:
+            kind = 'duplicate start'
+        elif event_types[i] == 'BT':
+            kind = 'unmatched break'
+        else:
+            kind = 'unmatched end'
+        anomalies.append(Anomaly(transects[i], kind, event_times[i],
+                '%s event at %s does not change the effort state' % (event_types[i], event_times[i])))
+
+    #  the transitions alternate on/off within each transect so every "on"
+    #  transition is paired with the next transition if it's in the same transect
+    trans = numpy.flatnonzero(state != prevState)
+    onPos = numpy.flatnonzero(state[trans] == 1)
+    hasNext = onPos + 1 < trans.size
+    nextIdx = numpy.where(hasNext, trans[numpy.minimum(onPos + 1, trans.size - 1)], 0)
+    paired = hasNext & (transects[nextIdx] == transects[trans[onPos]])
+    for i in trans[onPos[~paired]]:
+        anomalies.append(Anomaly(transects[i], 'unterminated segment', event_times[i],
+                '%s event at %s is never followed by a BT or ET' % (event_types[i], event_times[i])))
+
+    segTransect = transects[trans[onPos[paired]]]
+    segStart = event_times[trans[onPos[paired]]]
+    segEnd = event_times[nextIdx[paired]]
+
+    #  drop zero length segments
+    zero = segEnd <= segStart
+    for i in numpy.flatnonzero(zero):
+        anomalies.append(Anomaly(segTransect[i], 'zero length', segStart[i],
+                'segment starting at %s has zero length' % (segStart[i])))
+    segTransect = segTransect[~zero]
+    segStart = segStart[~zero]
+    segEnd = segEnd[~zero]
+
+    #  merge segments of the same transect that are separated by merge_gap or less
+    if merge_gap > 0 and segStart.size > 1:
+        gap = segStart[1:] - segEnd[:-1]
+        joined = (segTransect[1:] == segTransect[:-1]) & (gap <= numpy.timedelta64(int(merge_gap * 1000), 'ms'))
+        newSeg = numpy.concatenate(([True], ~joined))
+        lastOfSeg = numpy.concatenate((newSeg[1:], [True]))
+        segTransect = segTransect[newSeg]
+        segStart = segStart[newSeg]
+        segEnd = segEnd[lastOfSeg]
+
+    #  look for segments of different transects that overlap in time
+    order = numpy.argsort(segStart, kind='stable')
+    runEnd = numpy.maximum.accumulate(segEnd[order].astype('int64'))
+    overlaps = numpy.flatnonzero(segStart[order][1:].astype('int64') < runEnd[:-1]) + 1
+    for i in order[overlaps]:
+        anomalies.append(Anomaly(segTransect[i], 'overlap', segStart[i],
+                'segment starting at %s overlaps a segment of another transect' % (segStart[i])))
+
+    return Segments(segTransect, segStart, segEnd), anomalies
+
+
+def selectRawFiles(seg_start, seg_end, file_times, just_missed=300):
+    '''
+    selectRawFiles intersects on-effort segments with raw file spans. file_times
+    must be sorted and each file is assumed to span from its own time stamp to
+    the time stamp of the next file. The last file is treated as open ended.
+
+    Files are selected from the file containing the segment start (or a file
+    starting within just_missed seconds of it, whichever is earlier) through to
+    the file containing the segment end. This is the same rule makeFile has
+    always used to ensure at least one partial interval before the transect.
+
+    Returns a tuple of (first, last) index arrays, one element per segment.
+    Segments with no overlapping files have first == last == -1.
+    '''
+    seg_start = numpy.asarray(seg_start, dtype='datetime64[ms]')
+    seg_end = numpy.asarray(seg_end, dtype='datetime64[ms]')
+    file_times = numpy.asarray(file_times, dtype='datetime64[ms]')
+    nFiles = file_times.size
+    if nFiles == 0:
+        none = numpy.full(seg_start.size, -1)
+        return none, none.copy()
+
+    window = numpy.timedelta64(int(just_missed * 1000), 'ms')
+
+    #  the file that contains the start, and the first file that starts within the just missed window
+    containsStart = numpy.searchsorted(file_times, seg_start, side='right') - 1
+    nearStart = numpy.searchsorted(file_times, seg_start - window, side='right')
+    nearOK = nearStart < nFiles
+    nearOK[nearOK] = file_times[nearStart[nearOK]] < seg_start[nearOK] + window
+    first = numpy.where(nearOK, numpy.minimum(nearStart, numpy.where(containsStart < 0,
+            nFiles, containsStart)), containsStart)
+
+    #  segments that start before the first file but run into it start at the first file
+    early = (first < 0) & (seg_end > file_times[0])
+    first[early] = 0
+
+    #  the file that contains the end
+    last = numpy.searchsorted(file_times, seg_end, side='left') - 1
+    last = numpy.maximum(last, first)
+
+    #  flag segments that don't touch any file
+    none = (first < 0) | (first >= nFiles)
+    first[none] = -1
+    last[none] = -1
+
+    return first, last
+
+
+def surveySegments(transects, event_types, event_times, raw_files, just_missed=300,
+        merge_gap=0):
+    '''
+    surveySegments does the complete job for any number of transects in one call.
+    It builds the segments from the event stream, sorts the raw files by their
+    time stamps and intersects the two.
+
+    Returns a tuple (results, anomalies) where results is a dict keyed by
+    transect whose values are TransectSegments tuples containing the segment
+    start and end arrays and the sorted list of raw files needed for the
+    transect. Misnamed raw files are reported as anomalies with a transect of
+    None and are excluded from the sweep.
+    '''
+    segments, anomalies = buildSegments(transects, event_types, event_times,
+            merge_gap=merge_gap)
+
+    raw_files = numpy.asarray(raw_files, dtype=object)
+    fileTimes, badNames = rawFileTimes(raw_files)
+    for name in badNames:
+        anomalies.append(Anomaly(None, 'misnamed file', None, 'The raw file ' + str(name) +
+                ' is misnamed. Raw files must have the date and time in the name ' +
+                'in the form DYYYYMMDD-Thhmmss.'))
+    good = ~numpy.isnat(fileTimes)
+    order = numpy.argsort(fileTimes[good], kind='stable')
+    fileTimes = fileTimes[good][order]
+    raw_files = raw_files[good][order]
+
+    first, last = selectRawFiles(segments.start, segments.end, fileTimes,
+            just_missed=just_missed)
+
+    results = {}
+    for transect in numpy.unique(segments.transect):
+        mask = segments.transect == transect
+        keep = numpy.zeros(fileTimes.size, dtype=bool)
+        for f, l in zip(first[mask], last[mask]):
+            if f >= 0:
+                keep[f:l + 1] = True
+        results[str(transect)] = TransectSegments(segments.start[mask], segments.end[mask],
+                [str(f) for f in raw_files[keep]])
+
+    for i in numpy.flatnonzero(first < 0):
+        anomalies.append(Anomaly(segments.transect[i], 'no data files', segments.start[i],
+                'There are no data files for the transect segment that starts at ' +
+                str(segments.start[i]) + '.'))
+
+    return results, anomalies
@@ -0,0 +1,67 @@
+'''
+unitOfWork - collects database corrections and writes them in one go.
+
+Exporter.checksAndSetup asks the user whether to store values that are
+missing from the database (thresholds, the layer reference name, exclusion
+line names and layer thicknesses). It used to run each UPDATE as soon as the
+user said yes, so one export could make several auto-committed round trips
+and a later validation failure left the database partly updated.
+
+A UnitOfWork records each confirmed correction as a bound statement. Once
+validation has passed, apply() writes them all in a single transaction
+(DBSession.dbTransaction), runs each correction's on_commit callback so the
+caller can update its copy of the database values, and invalidates the
+metadata cache. If validation fails the corrections are simply discarded.
+'''
+
+from collections import namedtuple
+
+
+#  one correction. params are bound to the ? placeholders in sql
+Change = namedtuple('Change', ['description', 'sql', 'params', 'on_commit'])
+
+
+class UnitOfWork(object):
+    '''
+    UnitOfWork holds the corrections confirmed during validation
+    '''
+
+    def __init__(self):
+        self.changes = []
+
+    def __len__(self):
+        return len(self.changes)
+
+    def add(self, description, sql, params, on_commit=None):
+        '''
+        add records a correction. on_commit is called with no arguments after
+        the transaction commits.
+        '''
+        self.changes.append(Change(description, sql, tuple(params), on_commit))
+
+    def describe(self):
+        '''
+        describe returns the list of correction descriptions
+        '''
+        return [c.description for c in self.changes]
+
+    def apply(self, db, metadata=None):
+        '''
+        apply writes all of the corrections in one transaction and returns the
+        number of rows updated. Raises dbSession.DBError (and writes nothing) if
+        any statement fails. metadata is an optional metadataCache.MetadataCache
+        that is invalidated after the commit.
+        '''
+        if not self.changes:
+            return 0
+        count = db.dbTransaction([(c.sql, c.params) for c in self.changes])
+        for change in self.changes:
+            if change.on_commit is not None:
+                change.on_commit()
+        if metadata is not None:
+            metadata.invalidate()
+        self.changes = []
+        return count
+
+    def discard(self):
+        self.changes = []
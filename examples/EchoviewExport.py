@@ -35,7 +35,7 @@ Required accompanying python scripts:
 - ui_EchoviewExporter.py  (contains the GUI interface)
 
 Required python modules:
-PyQt4, numpy, glob, sys, os, win32com(pywin32)
+PyQt6, sys, os, win32com(pywin32)
 --
 
 created: 10 Jul 2014 robert.levine
@@ -45,14 +45,21 @@ last edited: 20 Oct 2017 nathan.lauffenburger- removed dependency on Lib file, d
 
 from PyQt6 import QtCore,  QtGui,  QtWidgets 
 from ui import ui_EchoviewExporter
-from MaceFunctions import connectdlg, dbConnection
-import numpy
-import glob
-import win32com.client
-import sys, os
+from MaceFunctions import connectdlg
+import sys, os, time
+from EVFunctions import evBackend, exportFiles, dbSession, metadataCache, asyncQueries, unitOfWork
+from EVFunctions import stagingUpload, calibrationStore, exportParameters, transectExport, jobBoard
+from EVFunctions import runLedger, exportPlanner, exportMetrics, echoviewWatchdog, transectScheduler
+from EVFunctions.exportFiles import parameterSetup
 
 class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
 
+    #  emitted by the metadata cache refresh thread with the list of changed snapshots
+    metadataUpdated = QtCore.pyqtSignal(list)
+
+    #  carries the results of background loads to the GUI thread
+    loadFinished = QtCore.pyqtSignal(object)
+
     def __init__(self, odbcSource, username, password,  acoustic_schema, bio_schema, parent=None):
         super(Exporter, self).__init__(parent)
         self.setupUi(self)
@@ -79,6 +86,18 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
             self.rawFilesDir.insert(self.latestRawDir)
             self.setRawFiles.setChecked(True)
         self.cal_file.insert(self.appSettings.value('latestCalFile',''))
+        self.evBackendName = self.appSettings.value('ev_backend','')
+        self.stagingDir = self.appSettings.value('staging_dir','')
+        self.calibrationStoreDir = self.appSettings.value('calibration_store','')
+        self.jobBoardDir = self.appSettings.value('job_board_dir','')
+        self.runLedgerFile = self.appSettings.value('run_ledger','')
+        #  Echoview is quit after every transect unless a memory or handle limit is set,
+        #  then it is kept running until the watchdog sees it reach one
+        self.watchdog = echoviewWatchdog.EchoviewWatchdog(self.appSettings.value('ev_max_memory_mb',''),
+                self.appSettings.value('ev_max_handles',''),
+                float(self.appSettings.value('ev_watchdog_interval', 2)))
+        self.runningEv = None
+        self.calStore = None
         self.latestFileSet = self.appSettings.value('latestFileSet','')
         if self.latestFileSet!='':
             self.fileset_name.insert(self.latestFileSet)
@@ -105,6 +124,16 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
         self.cal_button.clicked.connect(self.getCalFile)
         self.Cancel.clicked.connect(self.quit)
         self.Export.clicked.connect(self.export)
+        #  the dry run button sits next to the export button
+        self.DryRun = QtWidgets.QPushButton('Dry Run', self.Export.parentWidget())
+        self.DryRun.setToolTip('List the exports and estimate the run time without starting Echoview')
+        for layout in self.Export.parentWidget().findChildren(QtWidgets.QBoxLayout):
+            if layout.indexOf(self.Export) >= 0:
+                layout.insertWidget(layout.indexOf(self.Export), self.DryRun)
+                break
+        else:
+            self.DryRun.move(self.Export.x() - self.Export.width() - 6, self.Export.y())
+        self.DryRun.clicked.connect(self.dryRun)
         self.setRawFiles.stateChanged[int].connect(self.selectRaw)
         self.rawfiles_button.clicked.connect(self.getRawFilesDirectory)
         self.maxThresholdCheck.stateChanged[int].connect(self.threshOnOff)
@@ -131,6 +160,44 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
         self.myboldFont.setBold(True)
         self.mynormalFont.setBold(False)
 
+        #  the metadata cache is refreshed in the background. Updates are passed
+        #  to the GUI thread by the metadataUpdated signal.
+        self.baseTitle = self.windowTitle()
+        self.metadata = None
+        self.metadataUpdated.connect(self.metadataChanged)
+
+        #  the ship/survey/data set cascade is loaded in the background
+        self.loader = asyncQueries.QueryRunner(self.loadFinished.emit)
+        self.loadFinished.connect(self.runLoadCallback)
+
+        #  if a staging directory is set Echoview exports to it and the results are
+        #  uploaded to the output directory in the background
+        self.uploader = None
+        if self.stagingDir != '':
+            self.uploader = stagingUpload.Uploader(self.stagingDir,
+                    on_status=lambda msg: self.loadFinished.emit(lambda: self.refresh_text_box(msg)))
+            recovered = self.uploader.recover()
+            if recovered:
+                self.refresh_text_box('Retrying the upload of ' + str(recovered) + ' staged transect(s)')
+
+        #  every export run is recorded in the run ledger
+        try:
+            self.ledger = runLedger.RunLedger(self.runLedgerFile or None)
+        except Exception as e:
+            self.ledger = None
+            self.refresh_text_box('Unable to open the run ledger, this run won\'t be recorded: ' + str(e))
+
+        #  metrics are exposed in a textfile collector file and/or on a local HTTP port if set
+        self.metrics = None
+        metricsFile = self.appSettings.value('metrics_file','')
+        metricsPort = self.appSettings.value('metrics_port','')
+        if metricsFile or metricsPort:
+            try:
+                self.metrics = exportMetrics.enable(textfile=metricsFile or None,
+                        port=int(metricsPort) if metricsPort else None)
+            except (ValueError, OSError) as e:
+                self.refresh_text_box('Unable to expose the export metrics: ' + str(e))
+
         timer = QtCore.QTimer(self)
         timer.setSingleShot(True)
         timer.timeout.connect(self.applicationInit)
@@ -162,80 +229,162 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
             self.bioSchema = connectDlg.getBioSchema()
 
         #  create the database connection
-        self.db = dbConnection.dbConnection(self.odbc, self.dbUser,
+        self.db = dbSession.getSession(self.odbc, self.dbUser,
                 self.dbPassword, 'EchoviewExport')
 
         #  store the bioSchema and acousticSchema in the db object
         self.db.bioSchema=self.bioSchema
         self.db.acousticSchema = self.acousticSchema
 
+        #  the metadata lists are loaded from the local snapshot when there is one
+        self.metadata = metadataCache.MetadataCache('EchoviewExport', on_update=self.metadataUpdated.emit)
+
         try:
             self.db.dbOpen()
-        except dbConnection.DBError as e:
+        except dbSession.DBError as e:
             #  ooops, there was a problem
             errorMsg = ('Unable to connect to ' + self.dbUser+ '@' +
                     self.odbc + '\n' + e.error)
-            QtWidgets.QMessageBox.critical(self, "Database Login Error", errorMsg)
-            self.close()
-            return
+            if not self.metadata.hasSnapshots():
+                QtWidgets.QMessageBox.critical(self, "Database Login Error", errorMsg)
+                self.close()
+                return
+            #  we can continue with the cached metadata
+            self.metadata.offline = True
+            self.refresh_text_box('Warning- ' + errorMsg + '\nUsing cached metadata. Exports that ' +
+                    'need the database will fail until the connection is restored.')
 
         if self.db !=None:
-            #populate ship
-            query = self.db.dbQuery("SELECT ship FROM "+self.db.bioSchema+".ships WHERE ship <> 999 ORDER BY ship")
-            for ship,  in query:
-                self.shipBox.addItem(ship)
-            if self.latestShip =='':
-                self.shipBox.setCurrentIndex(self.shipBox.findText('157', QtCore.Qt.MatchFlag.MatchExactly))
-            else:
-                self.shipBox.setCurrentIndex(self.shipBox.findText(self.latestShip, QtCore.Qt.MatchFlag.MatchExactly))
-                
+            self.getShips()
             self.getAllIntervalTypes()
             self.activateMF()
             self.getSurveys()
 
+            #  start refreshing the snapshots in the background
+            self.metadata.start(self.db)
+            self.showMetadataStatus()
+
+
+    def getShips(self):
+        query = self.metadata.query(self.db, "SELECT ship FROM "+self.db.bioSchema+".ships WHERE ship <> 999 ORDER BY ship")
+        self.shipBox.clear()
+        for ship,  in query:
+            self.shipBox.addItem(ship)
+        if self.latestShip =='':
+            self.shipBox.setCurrentIndex(self.shipBox.findText('157', QtCore.Qt.MatchFlag.MatchExactly))
+        else:
+            self.shipBox.setCurrentIndex(self.shipBox.findText(self.latestShip, QtCore.Qt.MatchFlag.MatchExactly))
+
+
+    @QtCore.pyqtSlot(list)
+    def metadataChanged(self, changed):
+        '''
+        metadataChanged is called when the metadata cache has been refreshed. If
+        any of the snapshots changed the lists are reloaded, keeping the current
+        selections.
+        '''
+        if changed:
+            self.latestShip = self.shipBox.currentText()
+            self.latestSurvey = self.surveyBox.currentText()
+            self.latestDataSet = self.dataSetBox.currentText()
+            self.getShips()
+            self.getAllIntervalTypes()
+            self.getSurveys()
+        self.showMetadataStatus()
+
+
+    @QtCore.pyqtSlot(object)
+    def runLoadCallback(self, callback):
+        #  background load results are applied here, on the GUI thread
+        callback()
+
+
+    def showMetadataStatus(self):
+        status = self.metadata.statusText()
+        if status:
+            self.setWindowTitle(self.baseTitle + ' - ' + status)
+        else:
+            self.setWindowTitle(self.baseTitle)
+
     def getSurveys(self):
         self.ship=self.shipBox.currentText()
         if self.ship != '' and self.ship is not None:
-            query = self.db.dbQuery("SELECT survey FROM "+self.db.bioSchema+".surveys WHERE survey>200000 and " +
-                    "survey<209900 and ship=" + self.ship+" ORDER BY survey DESC")
-            self.surveyBox.clear()
-            for survey, in query:
-                self.surveyBox.addItem(survey)
-            self.surveyBox.setCurrentIndex(self.surveyBox.findText(self.latestSurvey,
-                    QtCore.Qt.MatchFlag.MatchExactly))
-            self.getDataSets()
-            
+            #  load the surveys in the background. This supersedes any loads in flight
+            #  for the previous ship.
+            self.Export.setEnabled(False)
+            sql = ("SELECT survey FROM "+self.db.bioSchema+".surveys WHERE survey>200000 and " +
+                    "survey<209900 and ship=? ORDER BY survey DESC")
+            params = (self.ship,)
+            self.loader.submit('surveys', lambda: self.metadata.query(self.db, sql, params),
+                    self.setSurveys, self.loadFailed, cancels=('datasets', 'parameters'))
+
+
+    def setSurveys(self, query):
+        self.surveyBox.clear()
+        for survey, in query:
+            self.surveyBox.addItem(survey)
+        self.surveyBox.setCurrentIndex(self.surveyBox.findText(self.latestSurvey,
+                QtCore.Qt.MatchFlag.MatchExactly))
+        self.getDataSets()
+
 
     def getDataSets(self):
         self.survey=self.surveyBox.currentText()
         if self.survey != '' and self.survey is not None:
-            query = self.db.dbQuery("SELECT data_set_id FROM "+self.db.acousticSchema+".data_sets" +
-               " WHERE (ship = "+self.ship+" ) AND"+
-               " (survey = "+self.survey+" )" )
-            self.dataSetBox.clear()
-            for data_set_id  in query:
-                self.dataSetBox.addItem(data_set_id[0])
-            self.dataSetBox.setCurrentIndex(self.dataSetBox.findText(self.latestDataSet,
-                    QtCore.Qt.MatchFlag.MatchExactly))
-            self.getExportParameters()
+            self.Export.setEnabled(False)
+            sql = ("SELECT data_set_id FROM "+self.db.acousticSchema+".data_sets" +
+               " WHERE ship = ? AND survey = ?")
+            params = (self.ship, self.survey)
+            self.loader.submit('datasets', lambda: self.metadata.query(self.db, sql, params),
+                    self.setDataSets, self.loadFailed, cancels=('parameters',))
+
+
+    def setDataSets(self, query):
+        self.dataSetBox.clear()
+        for data_set_id  in query:
+            self.dataSetBox.addItem(data_set_id[0])
+        self.dataSetBox.setCurrentIndex(self.dataSetBox.findText(self.latestDataSet,
+                QtCore.Qt.MatchFlag.MatchExactly))
+        self.getExportParameters()
 
 
     def getExportParameters(self):
         self.dataSet = self.dataSetBox.currentText()
         if self.dataSet != '' and self.dataSet is not None:
-            self.getExportVariable()
-            self.getIntervalType()
-            self.getLayerReference()
-            self.getThresholds()
-            self.getZones()
-            self.editAllBox.setChecked(False)
-            self.updateEdits()
-
-
-    def getExportVariable(self):
-        query = self.db.dbQuery("SELECT source_name FROM "+self.db.acousticSchema+".data_sets" +
-               " INNER JOIN "+self.db.acousticSchema+".acoustic_data_sources ON "+self.db.acousticSchema+".data_sets.source_id = "+self.db.acousticSchema+".acoustic_data_sources.source_id" +
-               " WHERE ship = "+self.ship+" AND survey = "+self.survey+" AND data_set_id = "+self.dataSet)
+            #  the export is disabled until the parameters for this data set arrive.
+            #  The lookups are independent so they run concurrently.
+            self.Export.setEnabled(False)
+            keys = (self.ship, self.survey, self.dataSet)
+            work = lambda: self.loader.parallel(lambda: self.queryExportVariable(*keys),
+                    lambda: self.queryIntervalType(*keys), lambda: self.queryLayerReference(*keys),
+                    lambda: self.queryThresholds(*keys), lambda: self.queryZones(*keys))
+            self.loader.submit('parameters', work, self.setExportParameters, self.loadFailed)
+
+
+    def setExportParameters(self, results):
+        exportVariable, intervalType, layerReference, thresholds, zones = results
+        self.getExportVariable(exportVariable)
+        self.getIntervalType(intervalType)
+        self.getLayerReference(layerReference)
+        self.getThresholds(thresholds)
+        self.getZones(zones)
+        self.editAllBox.setChecked(False)
+        self.updateEdits()
+        self.Export.setEnabled(True)
+
+
+    def loadFailed(self, error):
+        #  we're probably working offline from the metadata cache
+        message = error.error if isinstance(error, dbSession.DBError) else str(error)
+        self.refresh_text_box('Warning- Unable to load the ship, survey and data set parameters. ' +
+                'Exporting is disabled until they can be loaded.\n' + message)
+
+
+    def queryExportVariable(self, ship, survey, dataSet):
+        return exportParameters.queryExportVariable(self.db, ship, survey, dataSet)
+
+
+    def getExportVariable(self, query):
         self.exportVariable=query.first()[0]
         # Right now, source_id in data_sets table can be set to null, so we will catch that case here.  Maybe this shouldn't be allow int he database though.
         if self.exportVariable!='' and self.exportVariable is not None:
@@ -249,26 +398,31 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
             self.exportVariable='NO DATA'
 
 
-    def getLayerReference(self):
-        query = self.db.dbQuery("SELECT layer_reference FROM "+self.db.acousticSchema+".data_sets" +
-               " WHERE ship = "+self.ship+" AND survey = "+self.survey+" AND data_set_id = "+self.dataSet)
-        self.layerReference=query.first()[0]
+    def queryLayerReference(self, ship, survey, dataSet):
+        query = exportParameters.queryLayerReference(self.db, ship, survey, dataSet)
+        layerReference, layerReferenceName = query.first()
+        referenceOffset = None
+        if (layerReferenceName=='' or layerReferenceName is None) and layerReference=='Surface':
+            # For past surveys and data sets that have not filled in this entry, assume the surface reference will be "Surface (depth of zero)"
+            sql=("UPDATE "+self.db.acousticSchema+".data_sets SET layer_reference_name = 'Surface (depth of zero)' "
+                                " WHERE survey=? and ship=? and data_set_id=?")
+            self.db.dbExec(sql, (survey, ship, dataSet))
+        elif layerReferenceName!='' and layerReferenceName is not None and layerReference != 'Surface':
+            referenceOffset = exportParameters.queryReferenceOffset(self.db, ship, survey, dataSet, layerReferenceName)
+        return layerReference, layerReferenceName, referenceOffset
+
+
+    def getLayerReference(self, result):
+        self.layerReference, self.layerReferenceName, referenceOffset = result
         # Do not need to catch the condition that there is no layer reference because it cannot be null in the database
         self.reference_label.clear()
         self.reference_label.insert(self.layerReference)
         self.reference_label.setFont(self.mynormalFont)
-        query = self.db.dbQuery("SELECT layer_reference_name FROM "+self.db.acousticSchema+".data_sets" +
-               " WHERE ship = "+self.ship+" AND survey = "+self.survey+" AND data_set_id = "+self.dataSet)
 
         self.referenceOffset = str(0)
         self.reference_offset.clear()
         self.reference_offset.insert(self.referenceOffset)
-        self.layerReferenceName=query.first()[0]
         if (self.layerReferenceName=='' or self.layerReferenceName is None) and self.layerReference=='Surface':
-            # For past surveys and data sets that have not filled in this entry, assume the surface reference will be "Surface (depth of zero)"
-            sql=("UPDATE "+self.db.acousticSchema+".data_sets SET layer_reference_name = 'Surface (depth of zero)' "
-                                " WHERE survey="+self.survey+" and ship="+self.ship+" and data_set_id="+self.dataSet)
-            self.db.dbExec(sql)
             self.reference_label_name.clear()
             self.reference_label_name.insert('Surface (depth of zero)')
             self.reference_label_name.setFont(self.mynormalFont)
@@ -281,29 +435,21 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
             self.reference_label_name.clear()
             self.reference_label_name.insert(self.layerReferenceName)
             self.reference_label_name.setFont(self.mynormalFont)
-            if self.layerReference != 'Surface':
-                # For now assume that bottom referenced data sets have one zone
-                query = self.db.dbQuery("SELECT lower_exclusion_line FROM "+self.db.acousticSchema+".zones" +
-               " WHERE ship = "+self.ship+" AND survey = "+self.survey+" AND data_set_id = "+self.dataSet+" AND lower_exclusion_name = '"+self.layerReferenceName+"'")
-                excl_num = query.first()[0]
-                if excl_num != '' and excl_num is not None:
-                    query = self.db.dbQuery("SELECT exclusion_line_offset FROM "+self.db.acousticSchema+".exclusion_lines" +
-                    " WHERE exclusion_line_id = "+excl_num)
-                    self.reference_offset.clear()
-                    self.referenceOffset = str(-float(query.first()[0]))
-                    self.reference_offset.insert(self.referenceOffset)
+            if referenceOffset is not None:
+                self.reference_offset.clear()
+                self.referenceOffset = referenceOffset
+                self.reference_offset.insert(self.referenceOffset)
 
 
     def getOffset(self, line_name, line_type):
-        query = self.db.dbQuery("SELECT layer_reference, exclusion_line_offset FROM "+self.db.acousticSchema+".exclusion_lines a" +
-                    " JOIN zones b ON a.exclusion_line_id = b."+line_type+"_exclusion_line WHERE b."+line_type+"_exclusion_name = '"+line_name+"'" + 
-                    " AND b.ship = "+self.ship+" AND b.survey = "+self.survey+" AND b.data_set_id = "+self.dataSet)
-        return query.first()
+        return exportParameters.lineOffset(self.db, line_name, line_type, self.ship, self.survey, self.dataSet)
         
         
-    def getThresholds(self):
-        query = self.db.dbQuery("SELECT minimum_threshold_applied as min_bool, minimum_threshold as min_val, maximum_threshold_applied as max_bool, maximum_threshold as max_val FROM "+self.db.acousticSchema+".data_sets" +
-               " WHERE ship = "+self.ship+" AND survey = "+self.survey+" AND data_set_id = "+self.dataSet)
+    def queryThresholds(self, ship, survey, dataSet):
+        return exportParameters.queryThresholds(self.db, ship, survey, dataSet)
+
+
+    def getThresholds(self, query):
         # Catch cases when these are null in the database
         for min_bool, min_val, max_bool, max_val in query:
             if min_bool=='1':
@@ -361,16 +507,16 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
                 self.MaxThreshold='NO DATA'
 
 
-    def getZones(self):
+    def queryZones(self, ship, survey, dataSet):
+        return exportParameters.queryZones(self.db, ship, survey, dataSet)
+
+
+    def getZones(self, query):
         if self.dataSet != '' and self.dataSet is not None:
             
             #  disconnect zoneCheckBoxes signals while we manipulate the zoneCheckBoxes
             for box in self.zoneCheckBoxes:
                 box.stateChanged[int].disconnect()
-            
-            query = self.db.dbQuery("SELECT zone, lower_exclusion_name as low_name, upper_exclusion_name as " +
-                    "up_name, layer_thickness as thickness FROM "+self.db.acousticSchema+".zones" +
-                   " WHERE ship = "+self.ship+" AND survey = "+self.survey+" AND data_set_id = "+self.dataSet)
 
             # hide all boxes to reset
             self.zonesChecked=[]
@@ -433,20 +579,24 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
 
 
     def getAllIntervalTypes(self):
-        queryType = self.db.dbQuery("SELECT interval_type FROM "+self.db.acousticSchema+".interval_types")
+        queryType = self.metadata.query(self.db, "SELECT interval_type FROM "+self.db.acousticSchema+".interval_types")
+        self.intervalTypeBox.clear()
         self.intervalTypeOptions=[]
         for type in queryType:
             self.intervalTypeBox.addItem(type[0])
 
-        queryUnit = self.db.dbQuery("SELECT interval_units FROM "+self.db.acousticSchema+".interval_units")
+        queryUnit = self.metadata.query(self.db, "SELECT interval_units FROM "+self.db.acousticSchema+".interval_units")
+        self.intervalUnitBox.clear()
         self.intervalUnitOptions=[]
         for unit in queryUnit:
             self.intervalUnitBox.addItem(unit[0])
 
 
-    def getIntervalType(self):
-        query = self.db.dbQuery("SELECT interval_type, interval_units, interval_length FROM "+self.db.acousticSchema+".data_sets" +
-               " WHERE ship = "+self.ship+" AND survey = "+self.survey+" AND data_set_id = "+self.dataSet)
+    def queryIntervalType(self, ship, survey, dataSet):
+        return exportParameters.queryIntervalType(self.db, ship, survey, dataSet)
+
+
+    def getIntervalType(self, query):
         for type, unit, length in query:
             self.type=type
             self.unit=unit
@@ -584,11 +734,21 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
             self.applyMinThresh = 0
 
 
-    def checksAndSetup(self):
+    def checksAndSetup(self, dry_run=False):
+        '''
+        checksAndSetup checks the export settings and returns the params structure,
+        or False if the export can't go ahead. Values missing from the database
+        that the user confirms are written back. With dry_run the user isn't asked
+        and nothing is written, the corrections that would be offered are listed.
+        '''
 
         #initiate params class from export tools
         params = parameterSetup()
 
+        #  corrections the user confirms are collected here and only written to the
+        #  database, in one transaction, once all of the checks have passed
+        changes = unitOfWork.UnitOfWork()
+
         # Extract parameters from the GUI fields, but catch if there is nothing entered
         # A lot of error handling in here for cases when things are changed from what is in the database
         # and allowing user to enter in data to the database when it is not already there.
@@ -642,48 +802,15 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
         # There are 6 options for interval type and unit in exporting, ignoring for now the no time/distance grid option
         # Catch cases of erroneous picks by the user, such as a time unit with a distance type
         # Establish the time ditsance grid mode identifier for echoview and save it in params for use later
-        # 1 is time (in minutes)
-        # 2 is GPS distance (nmi)
-        # 3 is vessel log (nmi)
-        # 4 is distance (pings)
-        # 5 is GPS distance (m)
-        # 6 is vessel log (m)
-        params.EDSU_length=length
-        if type=='Time':
-            params.int_class=1
-            if unit=='minutes':
-                pass
-            elif unit=='hours':
-                params.EDSU_length=length*60
-            elif unit=='days':
-                params.EDSU_length=length*24*60
-            else:
-                QtWidgets.QMessageBox.critical(self, "Error", "Interval units do not fit with the interval type.")
-                return False
-        if type=='GPS distance':
-            if unit=='m':
-                params.int_class=5
-            elif unit=='nmi':
-                params.int_class=2
-            else:
-                QtWidgets.QMessageBox.critical(self, "Error", "Interval units do not fit with the interval type.")
-                return False
-        if type=='Vessel log distance':
-            if unit=='m':
-                params.int_class=6
-            elif unit=='nmi':
-                params.int_class=3
-            else:
-                QtWidgets.QMessageBox.critical(self, "Error", "Interval units do not fit with the interval type.")
-                return False
-        if type=='Ping number':
-            if unit=='pings':
-                params.int_class=4
-            else:
-                QtWidgets.QMessageBox.critical(self, "Error", "Interval units do not fit with the interval type.")
-                return False
+        try:
+            params.int_class, params.EDSU_length = exportParameters.intervalClass(type, unit, length)
+        except ValueError:
+            QtWidgets.QMessageBox.critical(self, "Error", "Interval units do not fit with the interval type.")
+            return False
 
         # Handle cases for the minimum and maximum integration threshold
+        params.apply_min_thresh = self.applyMinThresh
+        params.apply_max_thresh = self.applyMaxThresh
         if self.startMinThresh!=self.applyMinThresh:
             self.refresh_text_box('Warning- The apply minimum threshold flag (yes/no) has been changed from that which is specified in the database.')
 
@@ -701,15 +828,16 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
                 except:
                     QtWidgets.QMessageBox.critical(self, "Error", "Minimum integration threshold isn't a number.  Export aborted")
                     return False
-                yes = QtWidgets.QMessageBox.question(self, "Commit?","The minimum integration threshold is unspecified in database for this data set. " +
+                yes = self.askCommit(dry_run, "The minimum integration threshold is unspecified in database for this data set. " +
                             "Do you want to insert "+t_min+" as minimum threshold value " +
                             "into database for survey " +self.survey+ ", ship "+self.ship+", data set id "+self.dataSet+"?",
                             QtWidgets.QMessageBox.StandardButton.Yes|QtWidgets.QMessageBox.StandardButton.No)
                 if (yes == QtWidgets.QMessageBox.StandardButton.Yes):
                     # This will insure min threshold is in database and min threshold applied is set to true in the database
-                    sql=("UPDATE "+self.db.acousticSchema+".data_sets SET minimum_threshold = " +t_min+ ", minimum_threshold_applied = 1 "
-                                " WHERE survey="+self.survey+" and ship="+self.ship+" and data_set_id="+self.dataSet)
-                    self.db.dbExec(sql)
+                    sql=("UPDATE "+self.db.acousticSchema+".data_sets SET minimum_threshold = ?, minimum_threshold_applied = 1 "
+                                " WHERE survey=? and ship=? and data_set_id=?")
+                    changes.add('minimum threshold ' + t_min, sql, (params.min_int_threshold, self.survey, self.ship, self.dataSet),
+                            on_commit=lambda t_min=t_min: self.thresholdCommitted('min', t_min))
             elif t_min!=self.MinThreshold and self.MinThreshold!='NO DATA' and t_min!='':
                 self.refresh_text_box('Warning- The minimum integration threshold has been changed from that which is specified in the database.')
                 try:
@@ -735,15 +863,16 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
                 except:
                     QtWidgets.QMessageBox.critical(self, "Error", "Maximum integration threshold isn't a number.  Export aborted")
                     return False
-                yes = QtWidgets.QMessageBox.question(self, "Commit?","The maximum integration threshold is unspecified in database for this data set. " +
+                yes = self.askCommit(dry_run, "The maximum integration threshold is unspecified in database for this data set. " +
                             "Do you want to insert "+t_max+" as maximum threshold value " +
                             "into database for survey " +self.survey+ ", ship "+self.ship+", data set id "+self.dataSet+"?",
                             QtWidgets.QMessageBox.StandardButton.Yes|QtWidgets.QMessageBox.StandardButton.No)
                 if (yes == QtWidgets.QMessageBox.StandardButton.Yes):
                     # This will insure min threshold is in database and min threshold applied is set to true in the database
-                    sql=("UPDATE "+self.db.acousticSchema+".data_sets SET maximum_threshold = " +t_max+ ", maximum_threshold_applied = 1 "
-                                " WHERE survey="+self.survey+" and ship="+self.ship+" and data_set_id="+self.dataSet)
-                    self.db.dbExec(sql)
+                    sql=("UPDATE "+self.db.acousticSchema+".data_sets SET maximum_threshold = ?, maximum_threshold_applied = 1 "
+                                " WHERE survey=? and ship=? and data_set_id=?")
+                    changes.add('maximum threshold ' + t_max, sql, (params.max_int_threshold, self.survey, self.ship, self.dataSet),
+                            on_commit=lambda t_max=t_max: self.thresholdCommitted('max', t_max))
             elif t_max!=self.MaxThreshold and self.MaxThreshold!='NO DATA' and t_max!='':
                 self.refresh_text_box('Warning- The maximum integration threshold has been changed from that which is specified in the database.')
                 try:
@@ -774,15 +903,16 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
             return False
         elif name!=self.layerReferenceName and self.layerReferenceName=='NO DATA':
             params.layerReferenceName=name
-            yes = QtWidgets.QMessageBox.question(self, "Commit?","The layer reference name is unspecified in database for this data set. " +
+            yes = self.askCommit(dry_run, "The layer reference name is unspecified in database for this data set. " +
                             "Do you want to insert "+name+" as layer reference name " +
                             "into database for survey " +self.survey+ ", ship "+self.ship+", data set id "+self.dataSet+"?",
                             QtWidgets.QMessageBox.StandardButton.Yes|QtWidgets.QMessageBox.StandardButton.No)
             if (yes == QtWidgets.QMessageBox.StandardButton.Yes):
                 # This will insure min threshold is in database and min threshold applied is set to true in the database
-                sql=("UPDATE "+self.db.acousticSchema+".data_sets SET layer_reference_name = '" +name+ "' "
-                                " WHERE survey="+self.survey+" and ship="+self.ship+" and data_set_id="+self.dataSet)
-                self.db.dbExec(sql)
+                sql=("UPDATE "+self.db.acousticSchema+".data_sets SET layer_reference_name = ? "
+                                " WHERE survey=? and ship=? and data_set_id=?")
+                changes.add('layer reference name ' + name, sql, (name, self.survey, self.ship, self.dataSet),
+                        on_commit=lambda name=name: setattr(self, 'layerReferenceName', name))
         elif name!=self.layerReferenceName and self.layerReference!='NO DATA':
             params.layerReferenceName=name
             self.refresh_text_box('Warning- The layer reference name has been changed from that which is specified in the database.')
@@ -833,14 +963,16 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
 
                 # Lower exclusion line name
                 if self.lowNamesAvailable[zone_ind]!=low_name and self.lowNamesAvailable[zone_ind]=='NO DATA' and low_name!='':
-                    yes = QtWidgets.QMessageBox.question(self, "Commit?","The lower exclusion line name is unspecified in database for zone " + zone + ". " +
+                    yes = self.askCommit(dry_run, "The lower exclusion line name is unspecified in database for zone " + zone + ". " +
                         "Do you want to insert "+low_name+" as lower exclusion line " +
                         "into database for survey " +self.survey+ ", ship "+self.ship+", data set id "+self.dataSet+" and zone "+zone+ "?",
                         QtWidgets.QMessageBox.StandardButton.Yes|QtWidgets.QMessageBox.StandardButton.No)
                     if (yes == QtWidgets.QMessageBox.StandardButton.Yes):
-                        sql=("UPDATE "+self.db.acousticSchema+".zones SET lower_exclusion_name = '" +low_name+
-                            "' WHERE survey="+self.survey+" and ship="+self.ship+" and data_set_id="+self.dataSet+" and zone="+zone)
-                        self.db.dbExec(sql)
+                        sql=("UPDATE "+self.db.acousticSchema+".zones SET lower_exclusion_name = ?" +
+                            " WHERE survey=? and ship=? and data_set_id=? and zone=?")
+                        changes.add('zone ' + zone + ' lower exclusion line name ' + low_name, sql,
+                                (low_name, self.survey, self.ship, self.dataSet, zone),
+                                on_commit=lambda i=zone_ind, v=low_name: self.lowNamesAvailable.__setitem__(i, v))
                 elif self.lowNamesAvailable[zone_ind]!=low_name and low_name!='NO DATA' and low_name!='':
                     self.refresh_text_box('Warning- The lower exclusion line name for zone '+zone+' has been changed from that which is specified in the database.')
                 elif low_name=='' or low_name=='NO DATA':
@@ -849,15 +981,17 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
 
                 # Upper exclusion line name
                 if self.upNamesAvailable[zone_ind]!=up_name and self.upNamesAvailable[zone_ind]=='NO DATA' and up_name!='':
-                    yes = QtWidgets.QMessageBox.question(self, "Commit?","The upper exclusion line name is unspecified in database for zone " + zone + ". " +
+                    yes = self.askCommit(dry_run, "The upper exclusion line name is unspecified in database for zone " + zone + ". " +
                         "Do you want to insert "+up_name+" as upper exclusion line " +
                         "into database for survey " +self.survey+ ", ship "+self.ship+", data set id "+self.dataSet+" and zone "+zone+ "?" +
                         " If no, that's okay- the export will still continue without updating database.",
                         QtWidgets.QMessageBox.StandardButton.Yes|QtWidgets.QMessageBox.StandardButton.No)
                     if (yes == QtWidgets.QMessageBox.StandardButton.Yes):
-                        sql=("UPDATE "+self.db.acousticSchema+".zones SET upper_exclusion_name = '" +up_name+
-                            "' WHERE survey="+self.survey+" and ship="+self.ship+" and data_set_id="+self.dataSet+" and zone="+zone)
-                        self.db.dbExec(sql)
+                        sql=("UPDATE "+self.db.acousticSchema+".zones SET upper_exclusion_name = ?" +
+                            " WHERE survey=? and ship=? and data_set_id=? and zone=?")
+                        changes.add('zone ' + zone + ' upper exclusion line name ' + up_name, sql,
+                                (up_name, self.survey, self.ship, self.dataSet, zone),
+                                on_commit=lambda i=zone_ind, v=up_name: self.upNamesAvailable.__setitem__(i, v))
                 elif self.upNamesAvailable[zone_ind]!=up_name and up_name!='NO DATA' and up_name!='':
                     self.refresh_text_box('Warning- The upper exclusion line name for zone '+zone+' has been changed from that which is specified in the database.')
                 elif up_name=='' or up_name=='NO DATA':
@@ -866,20 +1000,52 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
 
                 # Layer thickness
                 if self.thicknessAvailable[zone_ind]!=thickness and self.thicknessAvailable[zone_ind]=='NO DATA':
-                    yes = QtWidgets.QMessageBox.question(self, "Commit?","The layer thickness is unspecified in database for zone " + zone + ". " +
+                    yes = self.askCommit(dry_run, "The layer thickness is unspecified in database for zone " + zone + ". " +
                         "Do you want to insert "+thickness+" as layer thickness " +
                         "into database for survey " +self.survey+ ", ship "+self.ship+", data set id "+self.dataSet+" and zone "+zone+ "?" +
                         " If no, that's okay- the export will still continue without updating database.",
                         QtWidgets.QMessageBox.StandardButton.Yes|QtWidgets.QMessageBox.StandardButton.No)
                     if yes == QtWidgets.QMessageBox.StandardButton.Yes:
-                        sql=("UPDATE "+self.db.acousticSchema+".zones SET layer_thickness = " +thickness+
-                            " WHERE survey="+self.survey+" and ship="+self.ship+" and data_set_id="+self.dataSet+" and zone="+zone)
-                        self.db.dbExec(sql)
+                        sql=("UPDATE "+self.db.acousticSchema+".zones SET layer_thickness = ?" +
+                            " WHERE survey=? and ship=? and data_set_id=? and zone=?")
+                        changes.add('zone ' + zone + ' layer thickness ' + thickness, sql,
+                                (params.layer_thickness[-1], self.survey, self.ship, self.dataSet, zone),
+                                on_commit=lambda i=zone_ind, v=thickness: self.thicknessAvailable.__setitem__(i, v))
                 elif self.thicknessAvailable[zone_ind]!=thickness:
                     self.refresh_text_box('Warning- The layer thickness for zone '+zone+' has been changed from that which is specified in the database.')
+
+        #  all of the checks passed, write the confirmed corrections
+        if len(changes) > 0 and dry_run:
+            self.refresh_text_box('The export would offer to update the database: ' +
+                    ', '.join(changes.describe()))
+        elif len(changes) > 0:
+            description = ', '.join(changes.describe())
+            try:
+                changes.apply(self.db, self.metadata)
+                self.refresh_text_box('Updated the database: ' + description)
+            except dbSession.DBError as e:
+                #  nothing was written. The export can still go ahead with the values entered.
+                self.refresh_text_box('Warning- Unable to update the database, no changes were made.\n' + e.error)
         return params
 
 
+    def askCommit(self, dry_run, question, buttons):
+        #  a dry run collects every correction without asking or writing it
+        if dry_run:
+            return QtWidgets.QMessageBox.StandardButton.Yes
+        return QtWidgets.QMessageBox.question(self, "Commit?", question, buttons)
+
+
+    def thresholdCommitted(self, which, value):
+        #  a threshold correction was written, it is now the database value
+        if which == 'min':
+            self.MinThreshold = value
+            self.startMinThresh = 1
+        else:
+            self.MaxThreshold = value
+            self.startMaxThresh = 1
+
+
     def setupMF(self, params):
         params.variable_export_list = []
         if self.select_mf1.isChecked():
@@ -919,86 +1085,164 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
             return
 
         # if multi-frequency has been checked, do checks on variables and store in params structure
+        params.export_type = self.exportType
         if self.exportType==1:
             params=self.setupMF(params)
 
         self.refresh_text_box('Starting New Export')
 
-        #If multiple transects, separate into list
-        transect_names=[]
-        all = 0
-        if ',' in params.transect_name:
-            transect_names = params.transect_name.split(',')
-        elif ' ' in params.transect_name:
-            transect_names = params.transect_name.split(' ')
-        elif '-' in params.transect_name:
-            transect_names = params.transect_name.split('-')
-            transect_names = range(int(transect_names[0]), int(transect_names[1])+1)
-            transect_names = [str(i) for i in transect_names]
-        elif params.transect_name == 'ALL':
-            allfiles = numpy.asarray(glob.glob(str(params.input_dir) + '\\'  + '*.EV'))
-            if len(allfiles) == 0:
+        #  the calibration file is stored once by content and the transects refer to the stored copy
+        storeDir = self.calibrationStoreDir
+        if storeDir == '':
+            storeDir = os.path.join(params.output_dir_mb2, calibrationStore.STORE_DIRNAME)
+        if self.calStore is None or self.calStore.root != os.path.normpath(storeDir):
+            self.calStore = calibrationStore.CalibrationStore(storeDir)
+        try:
+            params.calibration = self.calStore.add(params.ECSfilename)
+        except (IOError, OSError) as e:
+            QtWidgets.QMessageBox.critical(self, "Error", "Unable to store the calibration file: " +
+                    str(e) + ". Export aborted.")
+            return
+        self.refresh_text_box('Using calibration ' + os.path.basename(params.ECSfilename) +
+                ' (sha1 ' + params.calibration.digest + ')')
+
+        #  work out which EV files to export for each transect
+        jobs = exportFiles.exportJobs(params.input_dir, params.survey_no, params.transect_name)
+        if params.transect_name == 'ALL':
+            if len(jobs) == 0:
                 QtWidgets.QMessageBox.critical(self, "Error", "No .EV files found. Export aborted.")
                 return
-            self.refresh_text_box('\nFound '+ str(len(allfiles)) +' files\n')
-            transect_names = allfiles
-            all = 1
-        else:
-            transect_names.append(params.transect_name)
-
-        #How many transects are there?
-        transect_ct = len(transect_names)
-        if transect_ct > 1:
-            for k in (range(transect_ct)): #iterate through each transect
-                if all == 1:
-                    transect_name = allfiles[k][allfiles[k].find("-t")+2:allfiles[k].find("-z")]
-                else:
-                    transect_name = transect_string(transect_names[k])
-                #  find all .EV files containing the transect name in that input directory
-                filelist = numpy.asarray(glob.glob(str(params.input_dir) + '\\' + '*'+str(params.survey_no)+
-                        '*' + '*'+str(transect_name)+'*' + '*.EV'))
-                 # make sure that the file for the correct transect existed in the folder you chose
-                num_loops = len(filelist)
-                if num_loops == 0:
-                    QtWidgets.QMessageBox.critical(self, "Error", "No .EV files found for transect "  + transect_name[1:] +
-                            ". This transect will be skipped.")
-                elif [] in filelist:
-                    #  there could be 2 transects of .EV files, but maybe not the two transect specified by the user
-                    QtWidgets.QMessageBox.critical(self, "Error", "Not all if the .EV files could be found for transect " +
-                            transect_name[1:] +  ". This transect will be skipped.")
-                else:
-                    self.refresh_text_box('Beginning Export of Transect ' + transect_name[1:] + '...')
-                    successMB2 =  self.export_py_MB2(filelist, params)
-
-                    self.refresh_text_box('For Transect ' + transect_name[1:] + '...')
-                    total_zones_exported=sum(successMB2)
-                    if self.exportType==0:
-                        if total_zones_exported ==len(params.zone) and self.exportType==0:
-                            self.refresh_text_box('All zones exported \n')
-                        else:
-                            self.refresh_text_box(str(total_zones_exported)+' zone(s) exported out of '+str(len(params.zones))+' zone(s)')
-
-        else: #If there's only one transect
-            if all == 1:
-                transect_name = allfiles[0][allfiles[0].find("-t")+2:allfiles[0].find("-z")]
-            else:
-                transect_name = transect_string(transect_names[0])
-            filelist =  numpy.asarray(glob.glob(str(params.input_dir) + '\\' + '*'+str(params.survey_no)+
-                    '*' + '*'+str(transect_name)+'*' +'*.EV'))
-            num_loops = len(filelist)
-            if num_loops == 0:
+            self.refresh_text_box('\nFound '+ str(sum([len(job.files) for job in jobs])) +' files\n')
+
+        #  in job board mode the run is posted for the export workers instead of being exported here
+        if self.jobBoardDir != '':
+            self.postJobs(jobs, params)
+            return
+
+        run = runLedger.Run(tool='EchoviewExport')
+        if self.ledger is not None:
+            run = self.ledger.startRun('EchoviewExport', self.ship, self.survey, self.dataSet, params)
+        status = 'ok'
+        try:
+            status = self.exportJobs(jobs, params, run)
+        finally:
+            run.finish(status)
+            if self.runningEv is not None:
+                self.runningEv.quit()
+                self.runningEv = None
+
+
+    def exportJobs(self, jobs, params, run):
+        '''
+        exportJobs exports each transect's EV file, recording them in run, and
+        returns the run status: 'ok' or 'partial' if any transect or zone failed.
+        The transects are exported largest first.
+        '''
+        status = 'ok'
+        scheduler = self.scheduleJobs(jobs)
+        while True:
+            scheduled = scheduler.next()
+            if scheduled is None:
+                break
+            job = scheduled.item
+            transect_name = job.transect
+            # make sure that the file for the correct transect existed in the folder you chose
+            if len(job.files) == 0:
                 QtWidgets.QMessageBox.critical(self, "Error", "No .EV files found for transect "  + transect_name[1:] +
-                            ". This transect will be skipped.")
+                        ". This transect will be skipped.")
+                status = 'partial'
+                scheduler.finish(scheduled, ok=False)
+                continue
+
+            self.refresh_text_box('Beginning Export of Transect ' + transect_name[1:] + '...')
+            successMB2 =  self.export_py_MB2(job.files, params, run)
+            scheduler.finish(scheduled, ok=len(successMB2) > 0)
+
+            self.refresh_text_box('For Transect ' + transect_name[1:] + '...')
+            total_zones_exported=sum(successMB2)
+            if self.exportType==0:
+                if total_zones_exported ==len(params.zone):
+                    self.refresh_text_box('All zones exported \n')
+                else:
+                    self.refresh_text_box(str(total_zones_exported)+' zone(s) exported out of '+str(len(params.zone))+' zone(s)')
+                    status = 'partial'
+        self.refresh_text_box('Makespan: ' + scheduler.report())
+        return status
+
+
+    def scheduleJobs(self, jobs, workers=1):
+        '''
+        scheduleJobs returns a transectScheduler.TransectScheduler for the jobs
+        with their costs estimated from the run ledger
+        '''
+        rawSizes = {}
+        model = None
+        if self.ledger is not None:
+            rawSizes = exportPlanner.rawBytes(self.ledger)
+            model = transectScheduler.CostModel.fromLedger(self.ledger)
+        scheduler = transectScheduler.TransectScheduler(model, workers)
+        for job in jobs:
+            if job.files:
+                scheduler.add(job.transect, exportPlanner.transectSize(job.files[0], rawSizes), job,
+                        key=job.files[0])
             else:
-                self.refresh_text_box('Beginning Export of Transect ' + transect_name[1:] + '...')
-                successMB2 =self.export_py_MB2(filelist, params)
-                #  if the export is successful
-                total_zones_exported=sum(successMB2)
-                if self.exportType==0:
-                    if total_zones_exported ==len(params.zone):
-                        self.refresh_text_box('All Files Done \n')
-                    else:
-                        self.refresh_text_box(str(total_zones_exported)+' zone(s) exported out of '+str(len(params.zone))+' zone(s)')
+                scheduler.add(job.transect, 0, job)
+        return scheduler
+
+
+    def dryRun(self):
+        '''
+        dryRun lists what export() would export, flags any problems and
+        estimates the run time from the run ledger, without starting Echoview
+        or writing to the database
+        '''
+        params=self.checksAndSetup(dry_run=True)
+        if params==False:
+            return
+        params.export_type = self.exportType
+        if self.exportType==1:
+            params=self.setupMF(params)
+
+        self.refresh_text_box('Dry run, nothing will be exported')
+        jobs = exportFiles.exportJobs(params.input_dir, params.survey_no, params.transect_name)
+        plan = exportPlanner.planExport(params, jobs, self.getOffset,
+                self.uploader is None and self.calStore is not None)
+        runEstimate = None
+        if self.ledger is not None:
+            runEstimate = exportPlanner.estimate(plan, self.ledger)
+        self.refresh_text_box(exportPlanner.formatPlan(plan, runEstimate) + '\n')
+
+
+    def postJobs(self, jobs, params):
+        '''
+        postJobs posts an export run to a new board in the job board directory.
+        The exclusion line offsets are looked up now so the workers don't need
+        the database.
+        '''
+        if self.setRawFilesi == 1:
+            params.raw_dir = self.rawFilesDir.text()
+        try:
+            offsets = jobBoard.lineOffsetTable(params, self.getOffset)
+        except dbSession.DBError as e:
+            QtWidgets.QMessageBox.critical(self, "Error", "Unable to look up the exclusion line offsets: " +
+                    e.error + ". Export aborted.")
+            return
+        #  the workers claim units in board order, so the largest transects are posted first
+        units = []
+        scheduler = self.scheduleJobs(jobs)
+        for scheduled in scheduler.plan():
+            job = scheduled.item
+            if len(job.files) == 0:
+                self.refresh_text_box('No .EV files found for transect ' + job.transect[1:] + ', skipping it.')
+                continue
+            units.append({'ev_file': job.files[0], 'params': params, 'line_offsets': offsets,
+                    'size': scheduled.size, 'predicted_seconds': scheduled.predicted})
+        boardDir = os.path.join(self.jobBoardDir, 'export-s' + str(params.survey_no) + '-' +
+                time.strftime('%Y%m%d-%H%M%S'))
+        board = jobBoard.JobBoard.post(boardDir, units, description='Ship ' + str(self.ship) +
+                ' survey ' + str(self.survey) + ' data set ' + str(self.dataSet))
+        self.refresh_text_box('Posted ' + str(len(board.units())) + ' transect(s) to ' + boardDir +
+                '\nStart the workers with: python -m EVFunctions.jobBoard work "' + boardDir + '"')
 
 
     # Button function for input directory dialog button.  assign directory to input directory text field.
@@ -1035,387 +1279,34 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
         sys.exit()
 
 
-    def export_py_MB2(self, files, params):
+    def export_py_MB2(self, files, params, run=None):
         #Open up Echoview
-        EvApp = win32com.client.Dispatch("EchoviewCom.EvApplication")
-        license = EvApp.IsLicensed()
-        if license == 0:
+        ev = evBackend.getBackend(self.evBackendName)
+        if not ev.start():
             self.refresh_text_box('No Scripting Module Found')
-            EvApp.Quit()
-            pass
-        EvApp.Minimize()
-        EvFileName = str(files[0]) #pick the file
-        filename = os.path.basename(EvFileName) #filename
-        EvExportName = filename[:filename.find('-z')] #chop off the .EV
-        self.refresh_text_box('\nExporting for Macebase 2...')
-        self.refresh_text_box('Working on '+ str(EvFileName))
+            return []
+        rawDir = None
         if self.setRawFilesi == 1:
-        # The following 7 line should be part of an if statement based on a flag for resetting the raw data directory.
             rawDir = self.rawFilesDir.text()
             if rawDir == '':
                 QtWidgets.QMessageBox.about(self, "Warning", "Raw Files Directory is Blank")
-            self.refresh_text_box('Setting new raw file directory')
-            EvFile = EvApp.OpenFile(EvFileName) #Open up the file
-            EvFile.PreReadDataFiles #pre-read just in case
-            EvFile.Properties.DataPaths.Add(rawDir);
-            EvFile.SaveAs(EvFileName)
-            EvApp.CloseFile(EvFile)
-        self.refresh_text_box('Loading raw files...')
-        EvFile = EvApp.OpenFile(EvFileName) #Open up the file
-        Evfileset = EvFile.Filesets.FindByName(params.Fileset)
-        EvVar =  EvFile.Variables.FindByName(params.Variable_for_export)
-        EvFile.PreReadDataFiles #pre-read just in case
-        # Set up cal file
-        calfiletest = Evfileset.SetCalibrationFile(params.ECSfilename)
-        if calfiletest != 1:
-            self.refresh_text_box('Failed to set .ecs file')
-            self.refresh_text_box(EvExportName)
-
-        # set grid settings- params.int_class is set above using combination of types and units-
-        # 1 is time (in minutes), 2 is GPS distance (nmi), 3 is vessel log (nmi), 4 is distance (pings), 5 is GPS distance (m), 6 is vessel log (m)
-        EvVar.Properties.Grid.SetTimeDistanceGrid(params.int_class, params.EDSU_length)
-
-
-        # Single variable export
-        if self.exportType==0:
-            Date_E=EvFile.Properties.Export.Variables.Item('Date_E');
-            Date_E.Enabled=1;
-            Lat_E=EvFile.Properties.Export.Variables.Item('Lat_E');
-            Lat_E.Enabled=1;
-            Lon_E=EvFile.Properties.Export.Variables.Item('Lon_E');
-            Lon_E.Enabled=1;
-            Time_E=EvFile.Properties.Export.Variables.Item('Time_E');
-            Time_E.Enabled=1;
-            Region_notes=EvFile.Properties.Export.Variables.Item('Region_notes');
-            Region_notes.Enabled=1;
-            Grid_reference_line=EvFile.Properties.Export.Variables.Item('Grid_reference_line');
-            Grid_reference_line.Enabled=1;
-            Layer_btrld=EvFile.Properties.Export.Variables.Item('Layer_bottom_to_reference_line_depth');
-            Layer_btrld.Enabled=1;
-            Layer_ttrld=EvFile.Properties.Export.Variables.Item('Layer_top_to_reference_line_depth');
-            Layer_ttrld.Enabled=1;
-            Samples_In_Domain=EvFile.Properties.Export.Variables.Item('Samples_In_Domain');
-            Samples_In_Domain.Enabled=1;
-            Good_samples=EvFile.Properties.Export.Variables.Item('Good_samples');
-            Good_samples.Enabled=1;
-            No_data_samples=EvFile.Properties.Export.Variables.Item('No_data_samples');
-            No_data_samples.Enabled=1;
-            Sv_max=EvFile.Properties.Export.Variables.Item('Sv_max');
-            Sv_max.Enabled=1;
-
-            EvVar.Properties.Data.ApplyMinimumThreshold= self.applyMinThresh
-            if self.applyMinThresh ==1:
-                EvVar.Properties.Data.MinimumThreshold= params.min_int_threshold
-            EvVar.Properties.Data.ApplyMaximumThreshold= self.applyMaxThresh
-            if self.applyMaxThresh ==1:
-                EvVar.Properties.Data.MaximumThreshold= params.max_int_threshold
-
-            ExportFileName = params.output_dir_mb2 + '\\' + EvExportName + '- (regions).csv' #output .csv filename
-            exporttest1 = EvVar.ExportRegionsLogAll(ExportFileName);
-            if exporttest1 != 1:
-                self.refresh_text_box('Error: Unable to make regions logbook \n')
-
-            # Save calibration ecs file in export directory
-            f=open(params.ECSfilename,'r')
-            contents=f.read()
-            f.close()
-            h=open(params.output_dir_mb2 + '\\' + EvExportName + '-calibration-.ecs','w+')
-            h.write(contents)
-            h.close()
-
-            # Create a subfolder called 'Regions'
-            regionOutDir = params.output_dir_mb2 + '\\Regions'
-            dirExist = os.path.exists(regionOutDir)
-            if not dirExist:
-                os.mkdir(regionOutDir)
-            # Export Regions file
-            ExportFileName = regionOutDir + '\\' + EvExportName + '-regions.evr'
-            exporttest = EvFile.Regions.ExportDefinitionsAll(ExportFileName)
-            
-            
-            # Create a subfolder called 'Lines'
-            lineOutDir = params.output_dir_mb2 + '\\Lines'
-            dirExist = os.path.exists(lineOutDir)
-            if not dirExist:
-                os.mkdir(lineOutDir)
-
-            self.exporttestMB2=[]
-            exported_line_names = []
-            for z in range(len(params.zone)): #for each zone
-                EvVar.Properties.Grid.SetDepthRangeGrid(1,params.layer_thickness[z])
-                cur_zone=params.zone[z]
-                try:
-                    # Reference line
-                    if params.layerReferenceName!='Surface (depth of zero)':
-                        # Set an offset for non-surface referenced exports.
-                        EvLine = EvFile.Lines.FindByName(str(params.layerReferenceName))
-                        NewEvLine = EvFile.Lines.CreateOffsetLinear(EvLine, 1, params.reference_offset)
-                        NewEvLine.Name = str(params.layerReferenceName+"-offset"+str(params.reference_offset))
-                        EvVar.Properties.Grid.DepthRangeReferenceLine = NewEvLine
-                    self.refresh_text_box('Exporting Zone '+str(cur_zone)+'...')
-                    # Deal with lines:
-                    # Set exclude above line
-                    cur_line = str(params.exclude_above_line[z])
-                    exported_line_names.append(cur_line)
-                    EvVar.Properties.Analysis.ExcludeAboveLine = cur_line # set exclude above line
-                    # Export exclude above line
-                    line_ref = EvFile.Lines.FindByName(cur_line)
-                    ref,  offset = self.getOffset(cur_line, 'upper')
-                    if float(offset)<=0:
-                        ref_string = str(-float(offset))+' above '+ ref.lower()
-                    else:
-                        ref_string = str(float(offset))+' below '+ ref.lower()
-                    test = EvVar.ExportLine(line_ref, lineOutDir+'\\'+EvExportName+'-'+cur_line+'-'+ref_string+'-z'+str(cur_zone)+'-upper'+'.evl', -1, -1)
-                    if not test:
-                        self.refresh_text_box('There was a problem exporting the exclude above line file for zone'+str(cur_zone))
-                    # Set exclude below line
-                    cur_line = str(params.exclude_below_line[z])
-                    exported_line_names.append(cur_line)
-                    EvVar.Properties.Analysis.ExcludeBelowLine = cur_line # set exclude below line
-                    line_ref = EvFile.Lines.FindByName(cur_line)
-                    ref,  offset = self.getOffset(cur_line, 'lower')
-                    if float(offset)<0:
-                        ref_string = str(-float(offset))+' above '+ ref.lower()
-                    else:
-                        ref_string = str(-float(offset))+' below '+ ref.lower()
-                    # Export exclude below line
-                    test = EvVar.ExportLine(line_ref, lineOutDir+'\\'+EvExportName+'-'+cur_line+'-'+ref_string+'-z'+str(cur_zone)+'-lower'+'.evl', -1, -1)
-                    if not test:
-                        self.refresh_text_box('There was a problem exporting the exclude above line file for zone'+str(cur_zone))
-                    
-                    # Now complete the final export
-                    ExportFileName = params.output_dir_mb2 + '\\' + EvExportName + '-z' + str(cur_zone) +'-' +'.csv' #output .csv filename
-                    self.exporttest = EvVar.ExportIntegrationByRegionsByCellsAll(ExportFileName)
-                except:
-                    self.exporttest=False
-                    self.refresh_text_box('There is no exclude_above and/or exclude_below line associated with zone '+str(cur_zone)+' specified or it does not match a line in the EV file' )
-
-                if self.exporttest != True:
-                    self.refresh_text_box('The export has failed for zone '+str(cur_zone))
-                    self.exporttestMB2.append(0)
-                else:
-                    self.refresh_text_box('Zone '+ str(cur_zone) +' Export Complete')
-                    self.exporttestMB2.append(1)
-            # Export the rest of the lines
-            N = EvFile.Lines.count
-            for ind in range(0, N):
-                EvLine = EvFile.Lines(ind)
-                EvName = EvLine.Name
-                # For now, we will skip the 'Fileset1: line data...' lines since these should be included with the raw file and the colon is causing issues
-                isReject = EvName.find(':')
-                if EvName not in exported_line_names and isReject==-1:
-                    EvVar.ExportLine(EvLine, lineOutDir+'\\'+EvExportName+'-'+EvName+'.evl', -1, -1)            
-
-        # Multi-frequency export setup and execution
+        self.watchdog.watch(ev, os.path.basename(files[0]))
+        try:
+            success = transectExport.exportTransect(ev, files, params, self.refresh_text_box, self.getOffset,
+                    uploader=self.uploader, calibration_store=self.calStore, raw_dir=rawDir,
+                    quit_echoview=False, run=run)
+        finally:
+            usage = self.watchdog.stop()
+        self.refresh_text_box(echoviewWatchdog.formatUsage(usage))
+        reason = self.watchdog.recycleReason(usage)
+        if reason:
+            self.refresh_text_box('Restarting Echoview, ' + reason)
+        if not self.watchdog.enabled or reason:
+            ev.quit()
+            self.runningEv = None
         else:
-            self.exporttestMB2=[] # Fill this in because it will be returned at the end but not used for multi-frequency
-            ExportSamplesStatus=EvFile.Properties.Export.Variables.Item('Good_samples')  #use Item method to get handle to status of export variable samples
-            ExportSamplesStatus.Enabled=1  #set the status to enabled
-            ExportKurtosisStatus=EvFile.Properties.Export.Variables.Item('Kurtosis')
-            ExportKurtosisStatus.Enabled=1
-            ExportSkewnessStatus=EvFile.Properties.Export.Variables.Item('Skewness')
-            ExportSkewnessStatus.Enabled=1
-            ExportSv_meanStatus=EvFile.Properties.Export.Variables.Item('Sv_mean')
-            ExportSv_meanStatus.Enabled=1
-            ExportStandard_deviationStatus=EvFile.Properties.Export.Variables.Item('Standard_deviation')
-            ExportStandard_deviationStatus.Enabled=1
-
-            # Create a subfolder called 'Regions'
-            regionOutDir = params.output_dir_mb2 + '\\Regions'
-            dirExist = os.path.exists(regionOutDir)
-            if not dirExist:
-                os.mkdir(regionOutDir)
-            # Export Regions file
-            ExportFileName = regionOutDir + '\\' + EvExportName + '-regions.evr'
-            exporttest = EvFile.Regions.ExportDefinitionsAll(ExportFileName)
-            
-            
-            # Create a subfolder called 'Lines'
-            lineOutDir = params.output_dir_mb2 + '\\Lines'
-            dirExist = os.path.exists(lineOutDir)
-            if not dirExist:
-                os.mkdir(lineOutDir)
-
-            #The following sections are for the export of individual variables.  Each variable is exported if it is found within the list set within
-            #the parameters, assuming it was checked on the GUI.
-            if '38 kHz for survey' in params.variable_export_list:
-                variable_for_export = '38 kHz for survey'
-                EvVar =  EvFile.Variables.FindByName(variable_for_export)
-                EvVar.Properties.Data.ApplyMinimumThreshold= 1
-                EvVar.Properties.Data.MinimumThreshold= params.v38min
-                EvVar.Properties.Data.ApplyMaximumThreshold= 1
-                EvVar.Properties.Data.MaximumThreshold= params.v38max
-                for k in range(len(params.zone)):
-                    EvVar.Properties.Grid.SetDepthRangeGrid(1,params.layer_thickness[k])
-                    zone = params.zone[k]
-                    # Reference line
-                    if params.layerReferenceName!='Surface (depth of zero)':
-                        EvLine = EvFile.Lines.FindByName(str(params.layerReferenceName))
-                        EvVar.Properties.Grid.DepthRangeReferenceLine = EvLine
-                    self.refresh_text_box('Exporting 38 kHz for survey from zone '+ str(zone))
-                    # Deal with lines:
-                    # Set exclude above line
-                    cur_line = str(params.exclude_above_line[k])
-                    EvVar.Properties.Analysis.ExcludeAboveLine = cur_line # set exclude above line
-                    # Export exclude above line
-                    line_ref = EvFile.Lines.FindByName(cur_line)
-                    ref,  offset = self.getOffset(cur_line, 'upper')
-                    if float(offset)<=0:
-                        ref_string = str(-float(offset))+' above '+ ref.lower()
-                    else:
-                        ref_string = str(float(offset))+' below '+ ref.lower()
-                    test = EvVar.ExportLine(line_ref, lineOutDir+'\\'+EvExportName+'-'+cur_line+'-'+ref_string+'-z'+str(zone)+'-upper'+'.evl', -1, -1)
-                    if not test:
-                        self.refresh_text_box('There was a problem exporting the exclude above line file for zone'+str(zone))
-                    # Set exclude below line
-                    cur_line = str(params.exclude_below_line[k])
-                    EvVar.Properties.Analysis.ExcludeBelowLine = cur_line # set exclude below line
-                    line_ref = EvFile.Lines.FindByName(cur_line)
-                    ref,  offset = self.getOffset(cur_line, 'lower')
-                    if float(offset)<0:
-                        ref_string = str(-float(offset))+' above '+ ref.lower()
-                    else:
-                        ref_string = str(-float(offset))+' below '+ ref.lower()
-                    # Export exclude below line
-                    test = EvVar.ExportLine(line_ref, lineOutDir+'\\'+EvExportName+'-'+cur_line+'-'+ref_string+'-z'+str(zone)+'-lower'+'.evl', -1, -1)
-                    if not test:
-                        self.refresh_text_box('There was a problem exporting the exclude above line file for zone'+str(zone))
-                        
-                    ExportFileName = params.output_dir_mb2 + '\\' + EvExportName + 'z' + str(zone) +'.csv' #output .csv filename- edited name on 7/3/2016 by nel requested by patrick
-                    exporttest = EvVar.ExportIntegrationByRegionsByCellsAll(ExportFileName)
-                    if exporttest != 1:
-                        self.refresh_text_box('The export has failed for zone '+str(zone))
-                        self.refresh_text_box(ExportFileName)
-                    else:
-                        self.refresh_text_box('Zone '+ str(zone) +' Export Complete')
-
-            if '120 kHz for survey' in params.variable_export_list:
-                variable_for_export = '120 kHz for survey'
-                EvVar = EvFile.Variables.FindByName(variable_for_export)
-                EvVar.Properties.Data.ApplyMinimumThreshold= 1 #this is an example of implicit syntax for setting the property ApplyMinimumThreshold of COM object
-                EvVar.Properties.Data.MinimumThreshold= params.v120min
-                EvVar.Properties.Data.ApplyMaximumThreshold= 1
-                EvVar.Properties.Data.MaximumThreshold= params.v120max
-                for k in range(len(params.zone)):
-                    EvVar.Properties.Grid.SetDepthRangeGrid(1,params.layer_thickness[k])
-                    zone = params.zone[k]
-                    # Reference line
-                    if params.layerReferenceName!='Surface (depth of zero)':
-                        EvLine = EvFile.Lines.FindByName(str(params.layerReferenceName))
-                        EvVar.Properties.Grid.DepthRangeReferenceLine = EvLine
-                    self.refresh_text_box('Exporting 120 kHz for survey from zone '+ str(zone))
-                    EvVar.Properties.Analysis.ExcludeAboveLine = str(params.exclude_above_line[k])  #this is working even though it spits gibberish to the screen
-                    EvVar.Properties.Analysis.ExcludeBelowLine = str(params.exclude_below_line[k])
-                    ExportFileName = params.output_dir_mb2 + '\\' + EvExportName + 'z' + str(zone) +'.csv' #output .csv filename- edited name on 7/3/2016 by nel requested by patrick
-                    ExportFileName.replace("x2-f38", "x4-f120")
-                    exporttest = EvVar.ExportIntegrationByRegionsByCellsAll(ExportFileName)
-                    if exporttest != 1:
-                        self.refresh_text_box('The export has failed for zone '+str(zone))
-                        self.refresh_text_box(ExportFileName)
-                    else:
-                        self.refresh_text_box('Zone '+ str(zone) +' Export Complete')
-
-            if 'Autokrill for export' in params.variable_export_list:
-                variable_for_export = 'Autokrill for export'
-                EvVar =  EvFile.Variables.FindByName(variable_for_export)
-                EvVar.Properties.Data.ApplyMinimumThreshold= 1
-                EvVar.Properties.Data.MinimumThreshold= params.autokrillmin
-                EvVar.Properties.Data.ApplyMaximumThreshold= 1
-                EvVar.Properties.Data.MaximumThreshold= params.autokrillmax
-                for k in range(len(params.zone)):
-                    EvVar.Properties.Grid.SetDepthRangeGrid(1,params.layer_thickness[k])
-                    zone = params.zone[k]
-                    # Reference line
-                    if params.layerReferenceName!='Surface (depth of zero)':
-                        EvLine = EvFile.Lines.FindByName(str(params.layerReferenceName))
-                        EvVar.Properties.Grid.DepthRangeReferenceLine = EvLine
-                    self.refresh_text_box('Exporting Autokrill from zone '+ str(zone))
-                    EvVar.Properties.Analysis.ExcludeAboveLine = str(params.exclude_above_line[k])  #this is working even though it spits gibberish to the screen
-                    EvVar.Properties.Analysis.ExcludeBelowLine = str(params.exclude_below_line[k])
-                    ExportFileName = params.output_dir_mb2 + '\\' + EvExportName + 'k1' +'.csv' #output .csv filename- edited name on 7/3/2016 by nel requested by patrick
-                    ExportFileName.replace("x2-f38", "x4-f120")
-                    exporttest = EvVar.ExportIntegrationByRegionsByCellsAll(ExportFileName)
-                    if exporttest != 1:
-                        self.refresh_text_box('The export has failed for zone '+str(zone))
-                        self.refresh_text_box(ExportFileName)
-                    else:
-                        self.refresh_text_box('Zone '+ str(zone) +' Export Complete')
-
-            if 'Autokrill mean z for export' in params.variable_export_list:
-                variable_for_export = 'Autokrill mean z for export'
-                EvVar =  EvFile.Variables.FindByName(variable_for_export)
-                EvVar.Properties.Data.ApplyMinimumThreshold= 0
-                EvVar.Properties.Data.ApplyMaximumThreshold= 0
-                for k in range(len(params.zone)):
-                    EvVar.Properties.Grid.SetDepthRangeGrid(1,params.layer_thickness[k])
-                    zone = params.zone[k]
-                    # Reference line
-                    if params.layerReferenceName!='Surface (depth of zero)':
-                        EvLine = EvFile.Lines.FindByName(str(params.layerReferenceName))
-                        EvVar.Properties.Grid.DepthRangeReferenceLine = EvLine
-                    self.refresh_text_box('Exporting Autokrill mean z from zone '+ str(zone))
-                    EvVar.Properties.Analysis.ExcludeAboveLine = str(params.exclude_above_line[k])  #this is working even though it spits gibberish to the screen
-                    EvVar.Properties.Analysis.ExcludeBelowLine = str(params.exclude_below_line[k])
-                    ExportFileName = params.output_dir_mb2 + '\\' + EvExportName + 'k2' +'.csv' #output .csv filename- edited name on 7/3/2016 by nel requested by patrick
-                    ExportFileName.replace("x2-f38", "x4-f120")
-                    exporttest = EvVar.ExportIntegrationByRegionsByCellsAll(ExportFileName)
-                    if exporttest != 1:
-                        self.refresh_text_box('The export has failed for zone '+str(zone))
-                        self.refresh_text_box(ExportFileName)
-                    else:
-                        self.refresh_text_box('Zone '+ str(zone) +' Export Complete')
-
-            if 'Autopollock for export' in params.variable_export_list:
-                variable_for_export = 'Autopollock for export'
-                EvVar =  EvFile.Variables.FindByName(variable_for_export)
-                EvVar.Properties.Data.ApplyMinimumThreshold= 1
-                EvVar.Properties.Data.MinimumThreshold = params.autopollockmin
-                EvVar.Properties.Data.ApplyMaximumThreshold= 1
-                EvVar.Properties.Data.MaximumThreshold = params.autopollockmax
-                for k in range(len(params.zone)):
-                    EvVar.Properties.Grid.SetDepthRangeGrid(1,params.layer_thickness[k])
-                    zone = params.zone[k]
-                    # Reference line
-                    if params.layerReferenceName!='Surface (depth of zero)':
-                        EvLine = EvFile.Lines.FindByName(str(params.layerReferenceName))
-                        EvVar.Properties.Grid.DepthRangeReferenceLine = EvLine
-                    self.refresh_text_box('Exporting Autopollock from zone '+ str(zone))
-                    EvVar.Properties.Analysis.ExcludeAboveLine = str(params.exclude_above_line[k])  #this is working even though it spits gibberish to the screen
-                    EvVar.Properties.Analysis.ExcludeBelowLine = str(params.exclude_below_line[k])
-                    ExportFileName = params.output_dir_mb2 + '\\' + EvExportName + 'p1' +'.csv' #output .csv filename- edited name on 7/3/2016 by nel requested by patrick
-                    exporttest = EvVar.ExportIntegrationByRegionsByCellsAll(ExportFileName)
-                    if exporttest != 1:
-                        self.refresh_text_box( 'The export has failed for zone '+str(zone))
-                        self.refresh_text_box(ExportFileName)
-                    else:
-                        self.refresh_text_box('Zone '+ str(zone) +' Export Complete')
-
-            if 'Autopollock mean z for export' in params.variable_export_list:
-                variable_for_export = 'Autopollock mean z for export'
-                EvVar =  EvFile.Variables.FindByName(variable_for_export)
-                EvVar.Properties.Data.ApplyMinimumThreshold= 0
-                EvVar.Properties.Data.ApplyMaximumThreshold= 0
-                for k in range(len(params.zone)):
-                    EvVar.Properties.Grid.SetDepthRangeGrid(1,params.layer_thickness[k])
-                    zone = params.zone[k]
-                    # Reference line
-                    if params.layerReferenceName!='Surface (depth of zero)':
-                        EvLine = EvFile.Lines.FindByName(str(params.layerReferenceName))
-                        EvVar.Properties.Grid.DepthRangeReferenceLine = EvLine
-                    self.refresh_text_box( 'Exporting Autopollock mean z from zone '+ str(zone))
-                    EvVar.Properties.Analysis.ExcludeAboveLine = str(params.exclude_above_line[k])  #this is working even though it spits gibberish to the screen
-                    EvVar.Properties.Analysis.ExcludeBelowLine = str(params.exclude_below_line[k])
-                    ExportFileName = params.output_dir_mb2 + '\\' + EvExportName + 'p2' +'.csv' #output .csv filename- edited name on 7/3/2016 by nel requested by patrick
-                    exporttest = EvVar.ExportIntegrationByRegionsByCellsAll(ExportFileName)
-                    if exporttest != 1:
-                        self.refresh_text_box('The export has failed for zone '+str(zone))
-                        self.refresh_text_box(ExportFileName)
-                    else:
-                        self.refresh_text_box('Zone '+ str(zone) +' Export Complete')
-        
-        EvApp.CloseFile(EvFile) #close .ev file
-        EvApp.Quit() #quit echoview to refresh for next .EV file, just in case
-        return self.exporttestMB2
+            self.runningEv = ev
+        return success
 
     def closeEvent(self, event=None):
         """
@@ -1431,7 +1322,15 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
         self.appSettings.setValue('latestRawDir',self.rawFilesDir.text())
         self.appSettings.setValue('latestCalFile',self.cal_file.text())
         self.appSettings.setValue('latestFileSet',self.fileset_name.text())
-        #  close our connection to the database
+        #  stop the background loads and metadata refresh and close our connection to the database.
+        #  Uploads in progress are allowed to finish, anything left is retried next time.
+        self.loader.shutdown()
+        if self.uploader is not None:
+            self.uploader.shutdown()
+        if self.metrics is not None:
+            self.metrics.shutdown()
+        if self.metadata is not None:
+            self.metadata.close()
         try:
             self.db.close()
         except:
@@ -1507,31 +1406,6 @@ class Exporter(QtWidgets.QDialog, ui_EchoviewExporter.Ui_ExportDialog):
         return [newPosition, newSize]
 
 
-class parameterSetup:
-    setup = True
-
-# global function.  used to change from a transect number to the 't###' format commonly used in the .EV file names.
-def transect_string(transect_names):
-    if '.' in transect_names:
-        transect_1 = transect_names.split('.')[0]
-        transect_2 = transect_names.split('.')[1]
-        if len(transect_1) == 1:
-            transect_name = 't00' + transect_1
-        elif len(transect_1) ==2:
-            transect_name = 't0' + transect_1
-        elif len(transect_1) ==3:
-            transect_name = 't' + transect_1
-        transect_name = transect_name + '.'+transect_2
-    else:
-        if len(transect_names) == 1:
-            transect_name = 't00' + transect_names
-        elif len(transect_names) ==2:
-            transect_name = 't0' + transect_names
-        elif len(transect_names) ==3:
-            transect_name = 't' + transect_names
-    return transect_name
-
-
 # main, runs all from command line
 if __name__ == "__main__":
     '''
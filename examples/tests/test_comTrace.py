@@ -0,0 +1,101 @@
+'''
+Tests for EVFunctions.comTrace. Run from the examples directory:
+
+    python -m unittest discover -s tests
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from EVFunctions import calibrationStore, comTrace, jobBoard
+from EVFunctions.exportFiles import parameterSetup
+
+
+def exportParams(output_dir, calibration):
+    params = parameterSetup()
+    params.output_dir_mb2 = output_dir
+    params.Fileset = 'Fileset 1'
+    params.Variable_for_export = '38 kHz for survey'
+    params.int_class = 2
+    params.EDSU_length = 0.5
+    params.export_type = 0
+    params.apply_min_thresh = 1
+    params.min_int_threshold = -70.0
+    params.apply_max_thresh = 0
+    params.layerReferenceName = 'Surface (depth of zero)'
+    params.reference_offset = 0
+    params.survey_no = '202407'
+    params.zone = ['0', '1']
+    params.exclude_above_line = ['surface_exclusion', 'surface_exclusion']
+    params.exclude_below_line = ['bottom_exclusion', 'bottom_exclusion']
+    params.layer_thickness = [10.0, 10.0]
+    params.calibration = calibration
+    return params
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        inputDir = os.path.join(self.root, 'in')
+        outputDir = os.path.join(self.root, 'out')
+        os.makedirs(inputDir)
+        os.makedirs(outputDir)
+        ecs = os.path.join(self.root, 'survey.ecs')
+        with open(ecs, 'w') as f:
+            f.write('calibration\n')
+        calibration = calibrationStore.CalibrationStore(os.path.join(self.root, 'calibration')).add(ecs)
+        params = exportParams(outputDir, calibration)
+        offsets = jobBoard.lineOffsetTable(params, lambda name, line_type: ('Surface (depth of zero)', '5'))
+        self.units = []
+        for transect in (1, 2):
+            evFile = os.path.join(inputDir, 'v157-s202407-x2-f38-t%03i-z0.ev' % transect)
+            with open(evFile, 'w') as f:
+                f.write('EV file\n')
+            self.units.append({'ev_file': evFile, 'params': jobBoard.paramsToDict(params),
+                    'line_offsets': offsets})
+        self.trace = os.path.join(self.root, 'trace.jsonl')
+
+        #  record the run the way the apps do, with a new backend for every transect
+        for unit in self.units:
+            backend = comTrace.RecordingBackend(self.trace, backend='standin')
+            jobBoard.exportUnit(unit, backend=backend, log=lambda msg: None)
+        comTrace.endSession(self.trace)
+        self.records = comTrace.loadTrace(self.trace)
+
+    def tearDown(self):
+        comTrace.endSession(self.trace)
+        shutil.rmtree(self.root)
+
+    def replayDir(self):
+        return tempfile.mkdtemp(dir=self.root)
+
+    def testTraceNumbering(self):
+        self.assertEqual([record['seq'] for record in self.records], list(range(1, len(self.records) + 1)))
+        opened = [record['result']['__handle__'] for record in self.records if record['method'] == 'openFile']
+        self.assertEqual(len(opened), 2)
+        self.assertNotEqual(opened[0], opened[1])
+
+    def testCleanReplay(self):
+        replay = comTrace.replayUnits(self.trace, self.units, self.replayDir(), log=lambda msg: None)
+        self.assertEqual(replay.mismatches, [], replay.report())
+        self.assertEqual(replay.session.calls, len(self.records))
+
+    def testExtraCall(self):
+        self.assertNotIn('createFixedDepth', [record['method'] for record in self.records])
+        injected = []
+
+        def log(msg):
+            #  a backend created during the replay joins the replay's session
+            if msg.startswith('Working on') and not injected:
+                injected.append(comTrace.ReplayBackend(self.trace).createFixedDepth(None, 5))
+
+        replay = comTrace.replayUnits(self.trace, self.units, self.replayDir(), log=log)
+        self.assertEqual([(m.kind, m.method) for m in replay.mismatches], [('extra call', 'createFixedDepth')])
+        self.assertIn('extra call: call to createFixedDepth is not in the trace', replay.report())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+'''
+Tests for EVFunctions.dbSession against SQLite. Run from the examples directory:
+
+    python -m unittest discover -s tests
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from EVFunctions import dbSession
+
+
+class DBSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.session = dbSession.DBSession(factory=dbSession.sqliteFactory(os.path.join(self.root, 'test.sqlite')),
+                keepalive=0, retry_delay=0, pool_size=1)
+        self.session.dbOpen()
+        self.session.dbExec('CREATE TABLE macebase2.surveys (ship INTEGER, survey INTEGER, name TEXT)')
+        self.checkoutWait = dbSession.CHECKOUT_WAIT
+
+    def tearDown(self):
+        dbSession.CHECKOUT_WAIT = self.checkoutWait
+        self.session.close()
+        shutil.rmtree(self.root)
+
+    def count(self):
+        return self.session.dbQuery('SELECT COUNT(*) FROM macebase2.surveys').first()[0]
+
+    def testBoundParameters(self):
+        for survey, name in ((202407, "Bering Sea"), (202408, "O'Neill's")):
+            self.assertEqual(self.session.dbExec('INSERT INTO macebase2.surveys VALUES (?, ?, ?)',
+                    (157, survey, name)), 1)
+        query = self.session.dbQuery('SELECT survey, name FROM macebase2.surveys WHERE ship=? AND name=?',
+                (157, "O'Neill's"))
+        self.assertEqual(query.columns, ['survey', 'name'])
+        self.assertEqual(list(query), [('202408', "O'Neill's")])
+        self.assertEqual(self.session.dbQuery('SELECT name FROM macebase2.surveys WHERE survey=?',
+                (1,)).first(), (None,))
+
+    def testRetryAfterDroppedConnection(self):
+        #  the pooled connection drops while it is idle
+        self.session.idle.queue[0].connection.close()
+        self.assertEqual(self.count(), '0')
+        self.assertEqual(self.session.nOpen, 1)
+
+    def testTransactionRollback(self):
+        with self.assertRaises(dbSession.DBError):
+            self.session.dbTransaction([
+                    ('INSERT INTO macebase2.surveys VALUES (?, ?, ?)', (157, 202407, 'Bering Sea')),
+                    ('INSERT INTO macebase2.no_such_table VALUES (?)', (1,))])
+        self.assertEqual(self.count(), '0')
+        self.assertEqual(self.session.dbTransaction([
+                ('INSERT INTO macebase2.surveys VALUES (?, ?, ?)', (157, 202407, 'Bering Sea')),
+                ('UPDATE macebase2.surveys SET name=? WHERE survey=?', ('Gulf of Alaska', 202407))]), 2)
+        self.assertEqual(self.count(), '1')
+
+    def testCheckoutAfterDiscard(self):
+        #  a query waiting for the only connection gets a new one when that
+        #  connection is discarded instead of returned
+        dbSession.CHECKOUT_WAIT = 0.05
+        held = self.session._checkout()
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(self.count()), daemon=True)
+        waiter.start()
+        waiter.join(0.2)
+        self.assertTrue(waiter.is_alive())
+        self.session._discard(held)
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(results, ['0'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+'''
+Tests for EVFunctions.exportMetrics. Run from the examples directory:
+
+    python -m unittest discover -s tests
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from EVFunctions import exportMetrics, runLedger
+
+
+#  metrics are enabled once per process, so the units are recorded under a
+#  tool of their own to keep other tests' units out of the samples
+TOOL = 'exportMetricsTest'
+
+
+class ExposureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.textfile = os.path.join(self.root, 'evfunctions.prom')
+        self.exposure = exportMetrics.enable(textfile=self.textfile, port=0)
+
+    def tearDown(self):
+        self.exposure.shutdown()
+        shutil.rmtree(self.root)
+
+    def checkSamples(self, samples):
+        self.assertEqual(samples['evfunctions_transects_total{tool="' + TOOL + '",status="ok"}'], 1)
+        self.assertEqual(samples['evfunctions_stage_seconds_count{tool="' + TOOL + '",stage="export"}'], 1)
+        self.assertEqual(samples['evfunctions_stage_seconds_bucket{tool="' + TOOL + '",stage="export",' +
+                'le="+Inf"}'], 1)
+        self.assertEqual(samples['evfunctions_stage_seconds_count{tool="' + TOOL + '",stage="copy"}'], 1)
+
+    def testFinishedUnit(self):
+        run = runLedger.Run(tool=TOOL)
+        unit = run.unit('t005')
+        unit.begin('export')
+        unit.begin('copy')
+        unit.finish('ok')
+        run.finish('ok')
+
+        port = self.exposure.server.server_address[1]
+        self.checkSamples(exportMetrics.scrape('http://127.0.0.1:' + str(port) + '/metrics'))
+        #  the writer rewrites the file one last time when it is shut down
+        self.exposure.writer.shutdown()
+        self.exposure.writer = None
+        self.checkSamples(exportMetrics.scrape(self.textfile))
+
+
+class ParseMetricsTest(unittest.TestCase):
+
+    def testMalformedLine(self):
+        with self.assertRaises(ValueError):
+            exportMetrics.parseMetrics('evfunctions_transects_total{tool="x"} many\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
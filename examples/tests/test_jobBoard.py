@@ -0,0 +1,131 @@
+'''
+Tests for EVFunctions.jobBoard. Run from the examples directory:
+
+    python -m unittest discover -s tests
+'''
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+from EVFunctions import calibrationStore, jobBoard, standInBackend
+from EVFunctions.exportFiles import parameterSetup
+
+
+def exportParams(output_dir, calibration):
+    params = parameterSetup()
+    params.output_dir_mb2 = output_dir
+    params.Fileset = 'Fileset 1'
+    params.Variable_for_export = '38 kHz for survey'
+    params.int_class = 2
+    params.EDSU_length = 0.5
+    params.export_type = 0
+    params.apply_min_thresh = 1
+    params.min_int_threshold = -70.0
+    params.apply_max_thresh = 0
+    params.layerReferenceName = 'Surface (depth of zero)'
+    params.reference_offset = 0
+    params.survey_no = '202407'
+    params.zone = ['0']
+    params.exclude_above_line = ['surface_exclusion']
+    params.exclude_below_line = ['bottom_exclusion']
+    params.layer_thickness = [10.0]
+    params.calibration = calibration
+    return params
+
+
+def runWorker(path, worker, counts):
+    #  a worker process exporting with the stand-in backend
+    os.environ[standInBackend.DELAY_ENV_VAR] = '0.01'
+    board = jobBoard.JobBoard(path, lease_time=30, heartbeat=0.2)
+    counts.put((worker, jobBoard.work(board, worker=worker, backend='standin', log=lambda msg: None)))
+
+
+class JobBoardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        inputDir = os.path.join(self.root, 'in')
+        outputDir = os.path.join(self.root, 'out')
+        os.makedirs(inputDir)
+        os.makedirs(outputDir)
+        ecs = os.path.join(self.root, 'survey.ecs')
+        with open(ecs, 'w') as f:
+            f.write('calibration\n')
+        calibration = calibrationStore.CalibrationStore(os.path.join(self.root, 'calibration')).add(ecs)
+        params = exportParams(outputDir, calibration)
+        self.units = []
+        for transect in range(1, 7):
+            evFile = os.path.join(inputDir, 'v157-s202407-x2-f38-t%03i-z0.ev' % transect)
+            with open(evFile, 'w') as f:
+                f.write('EV file\n')
+            self.units.append({'ev_file': evFile, 'params': params,
+                    'line_offsets': jobBoard.lineOffsetTable(params,
+                    lambda name, line_type: ('Surface (depth of zero)', '5'))})
+        self.path = os.path.join(self.root, 'board')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def post(self, units, **kwargs):
+        return jobBoard.JobBoard.post(self.path, units, description='test', **kwargs)
+
+    def testTwoWorkers(self):
+        board = self.post(self.units)
+        counts = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=runWorker, args=(self.path, 'worker' + str(n), counts))
+                for n in (1, 2)]
+        for worker in workers:
+            worker.start()
+        results = dict([counts.get(timeout=60) for worker in workers])
+        for worker in workers:
+            worker.join(60)
+            self.assertEqual(worker.exitcode, 0)
+
+        #  every unit was exported once
+        self.assertEqual(sum(results.values()), len(self.units))
+        self.assertEqual(board.status()['done'], len(self.units))
+        self.assertTrue(board.finished())
+        self.assertEqual(os.listdir(os.path.join(self.path, jobBoard.LEASE_DIR)), [])
+
+    def testHeartbeat(self):
+        board = self.post(self.units[:1], lease_time=0.5, heartbeat=0.1)
+        lease = board.claim('worker1')
+        self.assertIsNotNone(lease)
+        time.sleep(1.0)
+        #  the heartbeat has kept the lease from expiring
+        self.assertEqual(board.state(lease.unit['id']), 'leased')
+        self.assertIsNone(jobBoard.JobBoard(self.path, lease_time=0.5).claim('worker2'))
+        self.assertTrue(board.complete(lease, [1]))
+        self.assertEqual(board.state(lease.unit['id']), 'done')
+
+    def testExpiredLeaseReclaimed(self):
+        board = self.post(self.units[:2])
+        #  a worker that crashed holding the first unit
+        with open(board.leasePath(board.units()[0]['id']), 'w') as f:
+            f.write('{"worker": "crashed", "expires": ' + str(time.time() - 10) + '}')
+        self.assertEqual(board.state(board.units()[0]['id']), 'expired')
+        lease = board.claim('worker1')
+        self.assertEqual(lease.unit['id'], board.units()[0]['id'])
+        self.assertTrue(board.complete(lease, [1]))
+
+    def testLostLease(self):
+        board = self.post(self.units[:1], lease_time=0.3, heartbeat=60)
+        slow = board.claim('worker1')
+        time.sleep(0.5)
+        #  worker1's lease has expired without a heartbeat and worker2 takes the unit over
+        other = jobBoard.JobBoard(self.path, lease_time=0.3, heartbeat=60).claim('worker2')
+        self.assertEqual(other.unit['id'], slow.unit['id'])
+        self.assertFalse(board.complete(slow, [1]))
+        self.assertTrue(slow.lost)
+        self.assertEqual(board.state(slow.unit['id']), 'leased')
+        self.assertTrue(board.complete(other, [1]))
+        with open(os.path.join(self.path, jobBoard.DONE_DIR, other.unit['id'] + '.json')) as f:
+            self.assertIn('"worker2"', f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+'''
+Tests for EVFunctions.lineRegionIndex. Run from the examples directory:
+
+    python -m unittest discover -s tests
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from EVFunctions import lineRegionIndex
+
+
+class ParseNameTest(unittest.TestCase):
+
+    def test3DigitTransect(self):
+        self.assertEqual(lineRegionIndex.parseName('v157-s202407-x2-f38-t005-bottom_exclusion' +
+                '--0.5 above bottom-z0-lower.evl'),
+                ('t005', 'bottom_exclusion', '0', 'lower', '-0.5 above bottom'))
+
+    def test4DigitTransect(self):
+        self.assertEqual(lineRegionIndex.parseName('v157-s202407-x2-f38-t1001-bottom_exclusion' +
+                '--0.5 above bottom-z0-lower.evl'),
+                ('t1001', 'bottom_exclusion', '0', 'lower', '-0.5 above bottom'))
+
+    def testTransectPart(self):
+        self.assertEqual(lineRegionIndex.parseName('v157-s202407-x2-f38-t1001.2-regions.evr')[:2],
+                ('t1001', 'regions'))
+
+    def testNoTransect(self):
+        self.assertIsNone(lineRegionIndex.parseName('v157-s202407-x2-f38-bottom_exclusion.evl'))
+
+
+class TransectFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for directory in ('Lines', 'Regions'):
+            os.makedirs(os.path.join(self.root, directory))
+        for name in ('Lines/v157-s202407-x2-f38-t1001-surface_exclusion-0.5 below surface-z0-upper.evl',
+                'Lines/v157-s202407-x2-f38-t100-surface_exclusion-0.5 below surface-z0-upper.evl',
+                'Regions/v157-s202407-x2-f38-t1001-regions.evr'):
+            with open(os.path.join(self.root, name), 'w') as f:
+                f.write('EVBD 3\n0\n')
+        lineRegionIndex.clearCache()
+
+    def tearDown(self):
+        lineRegionIndex.clearCache()
+        shutil.rmtree(self.root)
+
+    def test4DigitTransect(self):
+        files = lineRegionIndex.transectFiles(self.root, '1001')
+        self.assertEqual(list(files.lines), ['surface_exclusion'])
+        self.assertEqual([os.path.basename(path) for path in files.regions],
+                ['v157-s202407-x2-f38-t1001-regions.evr'])
+        self.assertEqual(len(lineRegionIndex.transectFiles(self.root, '100').regions), 0)
+
+    def testFileRewrittenInPlace(self):
+        older = os.path.join(self.root, 'Lines', 'v157-s202407-x2-f38-t1001-surface_exclusion' +
+                '-0.5 below surface-z0-upper.evl')
+        newer = os.path.join(self.root, 'Lines', 'v157-s202407-x2-f38-t1001-surface_exclusion' +
+                '-1.0 below surface-z0-upper.evl')
+        with open(newer, 'w') as f:
+            f.write('EVBD 3\n0\n')
+        os.utime(older, (1000, 1000))
+        os.utime(newer, (2000, 2000))
+        self.assertEqual(lineRegionIndex.transectFiles(self.root, '1001').lines['surface_exclusion'].path, newer)
+        #  overwriting a file doesn't change the directory's mtime
+        directoryTimes = os.stat(os.path.join(self.root, 'Lines'))
+        with open(older, 'w') as f:
+            f.write('EVBD 3\n1\n')
+        os.utime(older, (3000, 3000))
+        os.utime(os.path.join(self.root, 'Lines'), (directoryTimes.st_atime, directoryTimes.st_mtime))
+        self.assertEqual(lineRegionIndex.transectFiles(self.root, '1001').lines['surface_exclusion'].path, older)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+'''
+Tests for EVFunctions.transectScheduler. Run from the examples directory:
+
+    python -m unittest discover -s tests
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from EVFunctions import runLedger, transectScheduler
+
+
+class CostModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.ledger = runLedger.RunLedger(os.path.join(self.root, 'ledger.sqlite'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def writeFile(self, name, size):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def testBuildRawBytesCountedOnce(self):
+        raw = self.writeFile('D20240701-T000000.raw', 1000)
+        evFile = os.path.join(self.root, 't005.EV')
+        run = self.ledger.startRun('EVFileMaker')
+        unit = run.unit('t005', ev_file=evFile)
+        unit.started -= 1.0
+        unit.input(raw)
+        unit.output(evFile)
+        unit.finish('ok')
+        run.finish('ok')
+        model = transectScheduler.CostModel.fromLedger(self.ledger, ('EVFileMaker',))
+        self.assertAlmostEqual(model.predict(1000), 1.0, places=2)
+
+    def testExportAddsRawBytes(self):
+        evFile = self.writeFile('t005.EV', 100)
+        raw = self.writeFile('D20240701-T000000.raw', 900)
+        build = self.ledger.startRun('EVFileMaker')
+        unit = build.unit('t005', ev_file=evFile)
+        unit.input(raw)
+        unit.output(evFile)
+        unit.finish('ok')
+        build.finish('ok')
+        export = self.ledger.startRun('EchoviewExport')
+        unit = export.unit('t005', ev_file=evFile)
+        unit.started -= 2.0
+        unit.input(evFile)
+        unit.finish('ok')
+        export.finish('ok')
+        model = transectScheduler.CostModel.fromLedger(self.ledger)
+        self.assertAlmostEqual(model.predict(500), 1.0, places=2)
+
+
+if __name__ == "__main__":
+    unittest.main()